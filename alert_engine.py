@@ -0,0 +1,287 @@
+"""Engine cảnh báo theo sự kiện: đánh giá từng packet ngay khi nhận
+
+- Luật khai báo bằng AlertRule: metric, phép so sánh, ngưỡng bật và ngưỡng tắt
+  (hysteresis), điều kiện kèm theo, thời gian debounce
+- Trạng thái (đang cảnh báo / đang chờ debounce) giữ riêng cho từng tracker
+- Offline: mỗi packet đặt lại hẹn giờ của tracker trên timer wheel, thread nền
+  chỉ quay wheel mỗi tick thay vì truy vấn database
+- Thống kê độ trễ đánh giá mỗi packet và độ trễ phát hiện offline
+"""
+import math
+import threading
+import time
+from collections import deque
+
+_OPS = {'<': lambda a, b: a < b, '>': lambda a, b: a > b}
+_CLEAR_OPS = {'<': lambda a, b: a > b, '>': lambda a, b: a < b}
+
+def _number(sample, metric):
+    # Packet đến từ thiết bị: giá trị thiếu hoặc không phải số thì bỏ qua luật
+    value = sample.get(metric)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+class AlertRule:
+    """Một luật ngưỡng trên metric của packet
+
+    Bật khi metric <op> threshold (và mọi điều kiện when thỏa) liên tục debounce
+    giây; tắt khi metric vượt qua clear theo chiều ngược lại hoặc when không còn
+    thỏa. message/fields là template str.format() trên giá trị packet và threshold.
+    """
+
+    def __init__(self, name, title, severity, metric, op, threshold, clear=None, when=None,
+                 debounce=0, message='', fields=None, activates=()):
+        if op not in _OPS:
+            raise ValueError(f'unknown operator {op}')
+        self.name = name
+        self.title = title
+        self.severity = severity
+        self.metric = metric
+        self.op = op
+        self.threshold = threshold
+        self.clear = threshold if clear is None else clear
+        self.when = when or {}            # {metric: (op, ngưỡng)}
+        self.debounce = debounce
+        self.message = message
+        self.fields = fields or {}
+        self.activates = activates        # luật coi như đã cảnh báo khi luật này bật
+
+    def _when_ok(self, sample):
+        for metric, (op, value) in self.when.items():
+            current = _number(sample, metric)
+            if current is None or not _OPS[op](current, value):
+                return False
+        return True
+
+    def triggered(self, sample):
+        value = _number(sample, self.metric)
+        return value is not None and _OPS[self.op](value, self.threshold) and self._when_ok(sample)
+
+    def cleared(self, sample):
+        value = _number(sample, self.metric)
+        if value is None:
+            return False
+        if not self._when_ok(sample):
+            return True
+        if self.clear == self.threshold:
+            return not _OPS[self.op](value, self.threshold)
+        return _CLEAR_OPS[self.op](value, self.clear)
+
+    def render(self, values):
+        values = dict(values, threshold=self.threshold)
+        return {
+            'rule': self.name,
+            'title': self.title,
+            'severity': self.severity,
+            'message': self.message.format(**values),
+            'data': {key: template.format(**values) for key, template in self.fields.items()}
+        }
+
+class TimerWheel:
+    """Hashed timer wheel: schedule/cancel O(1), advance chỉ duyệt các slot đã qua"""
+
+    def __init__(self, tick=1.0, slots=512, now=None):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._where = {}                  # key -> chỉ số slot
+        self._current = int((time.monotonic() if now is None else now) // tick)
+
+    def schedule(self, key, deadline):
+        """Hẹn giờ cho key (thay hẹn giờ cũ nếu có) tại thời điểm monotonic deadline"""
+        self.cancel(key)
+        t = max(math.ceil(deadline / self.tick), self._current + 1)
+        index = t % len(self._slots)
+        self._slots[index][key] = t
+        self._where[key] = index
+
+    def cancel(self, key):
+        index = self._where.pop(key, None)
+        if index is not None:
+            self._slots[index].pop(key, None)
+
+    def advance(self, now):
+        """Quay wheel tới now, trả về các key đã tới hạn"""
+        target = int(now // self.tick)
+        expired = []
+        n = len(self._slots)
+        for step in range(1, min(target - self._current, n) + 1):
+            slot = self._slots[(self._current + step) % n]
+            due = [key for key, t in slot.items() if t <= target]
+            for key in due:
+                del slot[key]
+                del self._where[key]
+            expired.extend(due)
+        self._current = max(self._current, target)
+        return expired
+
+    def __len__(self):
+        return len(self._where)
+
+class _LatencyStats:
+    def __init__(self, window=1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._recent.append(seconds)
+
+    def summary(self, scale=1e6):
+        recent = sorted(self._recent)
+        def pct(p):
+            return round(recent[min(len(recent) - 1, int(len(recent) * p))] * scale, 1) if recent else None
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count * scale, 1) if self.count else None,
+            'max': round(self.max * scale, 1),
+            'p50': pct(0.5),
+            'p99': pct(0.99)
+        }
+
+class AlertEngine:
+    """Đánh giá luật trên trạng thái mới nhất của từng tracker, gọi notify(device_id, alert) khi bật cảnh báo"""
+
+    def __init__(self, rules, offline_rule, notify, tick=1.0):
+        self.rules = list(rules)
+        self.offline_rule = offline_rule  # threshold = số giây không có packet
+        self.notify = notify
+        self.tick = tick
+        self._wheel = TimerWheel(tick, max(64, int(offline_rule.threshold / tick) + 1))
+        self._devices = {}                # device_id -> {'rules': {tên: [active, pending_since]}, ...}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._evaluate_stats = _LatencyStats()
+        self._offline_stats = _LatencyStats()
+        self.stats = {'packets': 0, 'stale': 0, 'fired': {}, 'cleared': 0}
+
+    def _device(self, device_id):
+        state = self._devices.get(device_id)
+        if state is None:
+            state = self._devices[device_id] = {
+                'rules': {rule.name: [False, None] for rule in self.rules},
+                'offline': False,
+                'last_seen': None,        # epoch (wall clock) của packet cuối
+                'deadline': None          # monotonic lúc hết hạn offline
+            }
+        return state
+
+    def watch(self, device_id, last_seen=None):
+        """Theo dõi offline cho tracker chưa gửi packet kể từ khi khởi động"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._device(device_id)
+            if state['deadline'] is not None:
+                return
+            state['last_seen'] = last_seen
+            state['deadline'] = now + self.offline_rule.threshold
+            self._wheel.schedule(device_id, state['deadline'])
+
+    def evaluate(self, device_id, sample, sampled_at=None):
+        """Đánh giá một packet (dict metric -> giá trị), trả về các cảnh báo vừa bật
+
+        sampled_at: epoch lúc đo của packet gửi theo lô (mặc định lúc nhận); packet cũ
+        hơn packet cuối đã đánh giá bị bỏ qua, hạn offline tính từ lúc đo
+        """
+        started = time.perf_counter()
+        now = time.monotonic()
+        wall = time.time()
+        sampled_at = wall if sampled_at is None else min(sampled_at, wall)
+        fired = []
+        with self._lock:
+            state = self._device(device_id)
+            if state['last_seen'] is not None and sampled_at < state['last_seen']:
+                self.stats['stale'] += 1
+                return fired
+            state['offline'] = False
+            state['last_seen'] = sampled_at
+            state['deadline'] = now + self.offline_rule.threshold - (wall - sampled_at)
+            self._wheel.schedule(device_id, state['deadline'])
+            self.stats['packets'] += 1
+            for rule in self.rules:
+                rule_state = state['rules'][rule.name]
+                if rule.triggered(sample):
+                    if rule_state[0]:
+                        continue
+                    if rule_state[1] is None:
+                        rule_state[1] = now
+                    if now - rule_state[1] >= rule.debounce:
+                        rule_state[0], rule_state[1] = True, None
+                        for name in rule.activates:
+                            state['rules'][name][0] = True
+                        fired.append(rule.render(sample))
+                        self.stats['fired'][rule.name] = self.stats['fired'].get(rule.name, 0) + 1
+                else:
+                    rule_state[1] = None
+                    if rule_state[0] and rule.cleared(sample):
+                        rule_state[0] = False
+                        self.stats['cleared'] += 1
+            self._evaluate_stats.add(time.perf_counter() - started)
+        for alert in fired:
+            self.notify(device_id, alert)
+        return fired
+
+    def check_offline(self, now=None):
+        """Quay timer wheel, gửi cảnh báo cho tracker quá hạn; trả về danh sách tracker"""
+        now = time.monotonic() if now is None else now
+        fired = []
+        with self._lock:
+            for device_id in self._wheel.advance(now):
+                state = self._devices[device_id]
+                if state['offline']:
+                    continue
+                state['offline'] = True
+                self._offline_stats.add(now - state['deadline'])
+                last_seen = state['last_seen']
+                offline_seconds = self.offline_rule.threshold + now - state['deadline']
+                if last_seen is not None:
+                    offline_seconds = max(offline_seconds, time.time() - last_seen)
+                fired.append((device_id, self.offline_rule.render({
+                    'offline_minutes': int(offline_seconds / 60),
+                    'last_data_time': (time.strftime('%H:%M:%S %d/%m/%Y', time.localtime(last_seen))
+                                       if last_seen is not None else 'không rõ')
+                })))
+                name = self.offline_rule.name
+                self.stats['fired'][name] = self.stats['fired'].get(name, 0) + 1
+        for device_id, alert in fired:
+            self.notify(device_id, alert)
+        return [device_id for device_id, _ in fired]
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='alert-timer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.check_offline()
+            except Exception as e:
+                print(f"❌ Alert timer error: {e}")
+
+    def active_alerts(self):
+        """{device_id: [tên luật đang bật]}"""
+        with self._lock:
+            result = {}
+            for device_id, state in self._devices.items():
+                active = [name for name, (on, _) in state['rules'].items() if on]
+                if state['offline']:
+                    active.append(self.offline_rule.name)
+                if active:
+                    result[device_id] = active
+            return result
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats,
+                        fired=dict(self.stats['fired']),
+                        devices=len(self._devices),
+                        timers=len(self._wheel),
+                        evaluate_us=self._evaluate_stats.summary(),
+                        offline_lag_ms=self._offline_stats.summary(1e3))
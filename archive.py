@@ -0,0 +1,220 @@
+"""Lưu trữ dạng cột cho các ngày đã đóng, đọc qua mmap không cần parse
+
+Mỗi file là dữ liệu thô của một tracker trong một ngày UTC:
+
+    <thư mục>/<device_id>/<YYYY-MM-DD>.stc
+
+Layout (little-endian):
+
+    header       '<4sHHIqq'  magic b'STCA', version, số cột, số dòng,
+                             epoch dòng đầu, epoch dòng cuối
+    thư mục cột  n x '<16sc7xQ'  tên cột, typecode ('q' int64 / 'd' float64), offset
+    dữ liệu      mỗi cột là một mảng liền, căn 8 byte
+
+Cột 'epoch' (giây UTC) được sắp tăng dần nên tìm khoảng thời gian bằng tìm kiếm
+nhị phân. Có NumPy thì mỗi cột là ndarray trỏ thẳng vào vùng mmap, không thì
+memoryview.cast() — cả hai đều không copy dữ liệu.
+"""
+import bisect
+import mmap
+import os
+import re
+import struct
+from array import array
+
+from rollups import metric_value
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'STCA'
+VERSION = 1
+HEADER_FORMAT = '<4sHHIqq'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+COLUMN_FORMAT = '<16sc7xQ'
+COLUMN_SIZE = struct.calcsize(COLUMN_FORMAT)
+
+# Thứ tự cột cũng là thứ tự trong dòng trả về từ iter_rows (sau nhãn thời gian)
+ARCHIVE_COLUMNS = (
+    ('current', 'd'), ('voltage', 'd'), ('power', 'd'), ('efficiency', 'd'),
+    ('battery_voltage', 'd'), ('battery_soc', 'd'), ('epoch', 'q')
+)
+
+_SAFE_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+def _device_dir(device_id):
+    # device_id đến từ thiết bị: chỉ dùng nguyên văn khi an toàn làm tên thư mục
+    return device_id if _SAFE_NAME.match(device_id) else 'x' + device_id.encode().hex()
+
+def write_day_file(path, columns):
+    """Ghi file cột từ {tên: array} (cùng độ dài, epoch đã sắp), ghi tạm rồi os.replace"""
+    n_rows = len(columns['epoch'])
+    offset = HEADER_SIZE + COLUMN_SIZE * len(ARCHIVE_COLUMNS)
+    offset += -offset % 8
+    directory = []
+    for name, typecode in ARCHIVE_COLUMNS:
+        directory.append(struct.pack(COLUMN_FORMAT, name.encode(), typecode.encode(), offset))
+        offset += n_rows * 8
+
+    epochs = columns['epoch']
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(ARCHIVE_COLUMNS), n_rows,
+                         epochs[0] if n_rows else 0, epochs[-1] if n_rows else 0)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(b''.join(directory))
+        f.write(b'\0' * (-f.tell() % 8))
+        for name, _ in ARCHIVE_COLUMNS:
+            columns[name].tofile(f)
+    os.replace(tmp_path, path)
+
+class ArchiveDay:
+    """Một file ngày đã mở bằng mmap; cột truy cập qua day.column(tên)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_columns, self.rows, self.first_epoch, self.last_epoch = \
+            struct.unpack_from(HEADER_FORMAT, self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f'bad archive file {path}')
+        self._columns = {}
+        for i in range(n_columns):
+            name, typecode, offset = struct.unpack_from(COLUMN_FORMAT, self._mm, HEADER_SIZE + i * COLUMN_SIZE)
+            name = name.rstrip(b'\0').decode()
+            typecode = typecode.decode()
+            if np is not None:
+                self._columns[name] = np.frombuffer(self._mm, dtype='<' + ('i8' if typecode == 'q' else 'f8'),
+                                                    count=self.rows, offset=offset)
+            else:
+                self._columns[name] = memoryview(self._mm)[offset:offset + self.rows * 8].cast(typecode)
+
+    def column(self, name):
+        return self._columns[name]
+
+    def index_range(self, start_epoch=None, end_epoch=None):
+        """(i0, i1) các dòng có start_epoch <= epoch < end_epoch"""
+        epochs = self._columns['epoch']
+        if np is not None:
+            i0 = 0 if start_epoch is None else int(np.searchsorted(epochs, start_epoch, 'left'))
+            i1 = self.rows if end_epoch is None else int(np.searchsorted(epochs, end_epoch, 'left'))
+        else:
+            i0 = 0 if start_epoch is None else bisect.bisect_left(epochs, start_epoch)
+            i1 = self.rows if end_epoch is None else bisect.bisect_left(epochs, end_epoch)
+        return i0, i1
+
+    def aggregate(self, names, start_epoch=None, end_epoch=None):
+        """{cột: {count, min, max, sum, avg}} trong khoảng thời gian, tính vector hóa trên mmap"""
+        i0, i1 = self.index_range(start_epoch, end_epoch)
+        result = {}
+        for name in names:
+            values = self._columns[name][i0:i1]
+            count = i1 - i0
+            if not count:
+                result[name] = {'count': 0, 'min': None, 'max': None, 'sum': 0.0, 'avg': None}
+                continue
+            if np is not None:
+                total = float(values.sum())
+                low, high = float(values.min()), float(values.max())
+            else:
+                total, low, high = sum(values), min(values), max(values)
+            result[name] = {'count': count, 'min': low, 'max': high, 'sum': total, 'avg': total / count}
+        return result
+
+    def iter_rows(self, start_epoch=None, end_epoch=None, chunk=4096):
+        """Duyệt (None, cột...) theo thứ tự ARCHIVE_COLUMNS, đổi kiểu theo khối để giữ bộ nhớ cố định"""
+        i0, i1 = self.index_range(start_epoch, end_epoch)
+        columns = [self._columns[name] for name, _ in ARCHIVE_COLUMNS]
+        for lo in range(i0, i1, chunk):
+            hi = min(lo + chunk, i1)
+            if np is not None:
+                parts = [col[lo:hi].tolist() for col in columns]
+            else:
+                parts = [col[lo:hi] for col in columns]
+            for values in zip(*parts):
+                yield (None,) + values
+
+    def close(self):
+        self._columns.clear()
+        try:
+            self._mm.close()
+        except BufferError:
+            # Còn view NumPy trỏ vào vùng nhớ: mmap được đóng khi view bị thu hồi
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class ColumnarArchive:
+    """Thư mục file ngày, mỗi tracker một thư mục con"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def day_path(self, device_id, day):
+        return os.path.join(self.root, _device_dir(device_id), f'{day}.stc')
+
+    def has_day(self, device_id, day):
+        return os.path.exists(self.day_path(device_id, day))
+
+    def open_day(self, device_id, day):
+        return ArchiveDay(self.day_path(device_id, day))
+
+    def merge_rows(self, device_id, day, rows):
+        """Gộp dòng đến muộn (theo thứ tự ARCHIVE_COLUMNS, epoch cuối) vào file ngày đã có,
+        ghi lại cả file; không bao giờ xóa file vì dữ liệu thô có thể đã bị dọn. Trả về số dòng gộp"""
+        if not rows or not self.has_day(device_id, day):
+            return 0
+        with self.open_day(device_id, day) as existing:
+            # bytes() copy khỏi mmap trước khi đóng file
+            merged = list(zip(*[array(typecode, bytes(existing.column(name)))
+                                for name, typecode in ARCHIVE_COLUMNS]))
+        merged.extend(tuple(metric_value(value) for value in row) for row in rows)
+        merged.sort(key=lambda row: row[-1])
+        columns = {name: array(typecode, values)
+                   for (name, typecode), values in zip(ARCHIVE_COLUMNS, zip(*merged))}
+        write_day_file(self.day_path(device_id, day), columns)
+        return len(rows)
+
+    def write_day(self, conn, device_id, day, day_bounds, fetch_size=5000):
+        """Xuất dữ liệu thô của (device_id, ngày) từ SQLite ra file cột, trả về số dòng"""
+        columns = {name: array(typecode) for name, typecode in ARCHIVE_COLUMNS}
+        cursor = conn.execute(f'''SELECT {', '.join(name for name, _ in ARCHIVE_COLUMNS[:-1])},
+                                         CAST(strftime('%s', timestamp) AS INTEGER)
+                                  FROM sensor_data
+                                  WHERE device_id = ? AND timestamp >= ? AND timestamp < ?
+                                  ORDER BY timestamp ASC''', (device_id,) + tuple(day_bounds))
+        appends = [columns[name].append for name, _ in ARCHIVE_COLUMNS]
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                for append, value in zip(appends, row):
+                    append(metric_value(value))
+        if not columns['epoch']:
+            return 0
+        path = self.day_path(device_id, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_day_file(path, columns)
+        return len(columns['epoch'])
+
+    def devices_for_day(self, day):
+        """Các thư mục tracker có file cho ngày này"""
+        if not os.path.isdir(self.root):
+            return []
+        return [name for name in os.listdir(self.root)
+                if os.path.exists(os.path.join(self.root, name, f'{day}.stc'))]
+
+    def open_days(self, device_id, day):
+        """Mở các file của ngày: một tracker, hoặc mọi tracker nếu device_id là None"""
+        if device_id:
+            return [self.open_day(device_id, day)] if self.has_day(device_id, day) else []
+        return [ArchiveDay(os.path.join(self.root, name, f'{day}.stc')) for name in self.devices_for_day(day)]
@@ -0,0 +1,60 @@
+"""Cache trạng thái tài khoản cho login_required
+
+- Mỗi user_id giữ trạng thái (active hay không) tối đa ttl giây, request trong
+  thời gian đó chỉ tra dict thay vì truy vấn bảng users
+- invalidate() khi sửa / xóa user: thay đổi qua API có hiệu lực ngay, thay đổi
+  ngoài API (sửa trực tiếp database) có hiệu lực sau tối đa ttl giây
+- Lần đọc database đang chạy khi có invalidate() không được ghi đè giá trị mới
+- load() lỗi: dùng giá trị cuối đã cache (kể cả đã hết hạn) nếu có, không thì
+  ném lỗi để caller từ chối request
+"""
+import threading
+import time
+
+class AccountCache:
+    """Cache TTL trạng thái active theo user_id, load(user_id) -> True / False (False nếu không tồn tại)"""
+
+    def __init__(self, load, ttl=30.0):
+        self.load = load
+        self.ttl = ttl
+        self._entries = {}                # user_id -> (hạn monotonic, active)
+        self._generation = 0              # tăng mỗi lần invalidate
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'load_errors': 0, 'stale_served': 0}
+
+    def is_active(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.stats['hits'] += 1       # Không khóa: đường hit chỉ là tra dict
+            return entry[1]
+        with self._lock:
+            self.stats['misses'] += 1
+            generation = self._generation
+        try:
+            active = bool(self.load(user_id))
+        except Exception:
+            with self._lock:
+                self.stats['load_errors'] += 1
+                entry = self._entries.get(user_id)
+                if entry is None:
+                    raise
+                self.stats['stale_served'] += 1
+                return entry[1]
+        with self._lock:
+            if generation == self._generation:
+                self._entries[user_id] = (time.monotonic() + self.ttl, active)
+        return active
+
+    def invalidate(self, user_id=None):
+        """Bỏ cache của một user (None = mọi user)"""
+        with self._lock:
+            self._generation += 1
+            self.stats['invalidations'] += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), ttl=self.ttl)
@@ -0,0 +1,89 @@
+"""So sánh tổng hợp power/voltage/battery_soc trên nhiều ngày: SQLite từng dòng vs file cột mmap
+
+Chạy: python benchmarks/bench_archive.py [số ngày]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import archive as archive_module
+from archive import ColumnarArchive
+
+ROWS_PER_DAY = 28800    # một packet mỗi 3 giây
+START = 1700006400      # 00:00 UTC
+
+def build(conn, store, days):
+    conn.execute('''CREATE TABLE sensor_data (timestamp TEXT, device_id TEXT, current REAL, voltage REAL,
+                    power REAL, efficiency REAL, battery_voltage REAL, battery_soc REAL)''')
+    rng = random.Random(1)
+    for d in range(days):
+        base = START + d * 86400
+        conn.executemany('INSERT INTO sensor_data VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+            (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(base + i * 3)), 'default',
+             rng.random(), 12 + rng.random(), rng.random() * 20, 90.0, 12.5, rng.randint(20, 100))
+            for i in range(ROWS_PER_DAY)))
+    conn.execute('CREATE INDEX idx_ts ON sensor_data(device_id, timestamp)')
+    day_names = []
+    for d in range(days):
+        day = time.strftime('%Y-%m-%d', time.gmtime(START + d * 86400))
+        bounds = (day + ' 00:00:00', time.strftime('%Y-%m-%d 00:00:00', time.gmtime(START + (d + 1) * 86400)))
+        store.write_day(conn, 'default', day, bounds)
+        day_names.append(day)
+    return day_names
+
+def sqlite_aggregate(conn):
+    # Cách hiện tại của các route: duyệt tuple và float() từng giá trị
+    total = {'power': 0.0, 'voltage': 0.0, 'battery_soc': 0.0}
+    peak = 0.0
+    count = 0
+    for row in conn.execute('SELECT power, voltage, battery_soc FROM sensor_data ORDER BY timestamp'):
+        power = float(row[0])
+        total['power'] += power
+        total['voltage'] += float(row[1])
+        total['battery_soc'] += float(row[2])
+        peak = max(peak, power)
+        count += 1
+    return count, peak, total
+
+def archive_aggregate(store, days):
+    total = {'power': 0.0, 'voltage': 0.0, 'battery_soc': 0.0}
+    peak = 0.0
+    count = 0
+    for day in days:
+        with store.open_day('default', day) as archived:
+            stats = archived.aggregate(('power', 'voltage', 'battery_soc'))
+        for name in total:
+            total[name] += stats[name]['sum']
+        peak = max(peak, stats['power']['max'])
+        count += stats['power']['count']
+    return count, peak, total
+
+def main(days=30):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'bench.db'))
+        store = ColumnarArchive(os.path.join(tmp, 'archive'))
+        day_names = build(conn, store, days)
+        print(f"{days} days x {ROWS_PER_DAY} rows, numpy={'yes' if archive_module.np is not None else 'no'}")
+
+        started = time.perf_counter()
+        expected = sqlite_aggregate(conn)
+        sqlite_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        result = archive_aggregate(store, day_names)
+        archive_s = time.perf_counter() - started
+
+        assert expected[0] == result[0] and abs(expected[1] - result[1]) < 1e-9
+        print(f"{'source':<12}{'seconds':>10}")
+        print(f"{'sqlite':<12}{sqlite_s:>10.3f}")
+        print(f"{'archive':<12}{archive_s:>10.3f}")
+        print(f"speedup x{sqlite_s / archive_s:.0f}")
+        conn.close()
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,81 @@
+"""Độ trễ từ lúc web gửi lệnh đến lúc PICO nhận: poll 1 Hz (firmware cũ) vs long-poll
+
+Server thật chạy trong process con (database tạm). Một thread giả lập vòng lặp lấy lệnh
+của firmware, client web gửi lệnh qua /api/control/pico vào các thời điểm ngẫu nhiên.
+Độ trễ đo đến lúc firmware nhận lệnh; thời gian servo quay (apply_command trên PICO)
+cần phần cứng nên không nằm trong số đo.
+
+Chạy: python benchmarks/bench_command_latency.py [số lệnh mỗi chế độ]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench_serving import PACKET, free_port, start_server
+
+POLL_INTERVAL = 1.0         # main.py cũ: GET /api/get-command mỗi giây
+LONG_POLL_WAIT = 20         # main.py: LONG_POLL_WAIT
+
+def poller(base, mode, received, stop):
+    session = requests.Session()
+    while not stop.is_set():
+        if mode == 'long_poll':
+            url = f'{base}/api/get-command?device_id=bench&wait={LONG_POLL_WAIT}'
+        else:
+            url = f'{base}/api/get-command?device_id=bench'
+        try:
+            command = session.get(url, timeout=LONG_POLL_WAIT + 5).json()
+        except requests.RequestException:
+            continue
+        if command.get('seq') is not None:
+            received[command['seq']] = time.perf_counter()
+        if mode == 'poll':
+            stop.wait(POLL_INTERVAL)
+
+def run(mode, commands):
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    with tempfile.TemporaryDirectory() as cwd:
+        proc = start_server('threading', port, cwd)
+        try:
+            requests.post(f'{base}/api/sensor-data', data=PACKET,
+                          headers={'Content-Type': 'application/json'}, timeout=5)
+            web = requests.Session()
+            web.post(f'{base}/login', data={'username': 'admin', 'password': 'admin123'}, timeout=5)
+            received, stop = {}, threading.Event()
+            thread = threading.Thread(target=poller, args=(base, mode, received, stop), daemon=True)
+            thread.start()
+            time.sleep(1)
+            rng = random.Random(1)
+            sent = {}
+            for seq in range(commands):
+                time.sleep(rng.uniform(0.5, 1.5))
+                sent[seq] = time.perf_counter()
+                web.post(f'{base}/api/control/pico', timeout=5, json={
+                    'command': 'SET_ANGLE', 'azimuth': 90, 'elevation': 45, 'device_id': 'bench', 'seq': seq})
+            time.sleep(POLL_INTERVAL * 2)
+            stop.set()
+        finally:
+            proc.kill()
+            proc.wait()
+    latencies = sorted((received[seq] - sent[seq]) * 1000 for seq in sent if seq in received)
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else float('nan')
+    return {'delivered': len(latencies), 'p50': pct(0.5), 'p99': pct(0.99),
+            'max': latencies[-1] if latencies else float('nan')}
+
+def main(commands=30):
+    print(f"{commands} lệnh mỗi chế độ, web -> /api/control/pico -> firmware nhận lệnh")
+    print(f"{'mode':<11}{'delivered':>10}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for mode in ('poll', 'long_poll'):
+        r = run(mode, commands)
+        print(f"{mode:<11}{r['delivered']:>10}{r['p50']:>9.1f}{r['p99']:>9.1f}{r['max']:>9.1f}")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,80 @@
+"""So sánh cách lọc cũ (fetchall + lấy mỗi step dòng) với LTTB / min-max stream trên 1M dòng
+
+Đo thời gian, bộ nhớ Python tối đa (tracemalloc) và việc giữ lại đỉnh công suất.
+
+Chạy: python benchmarks/bench_downsample.py [số dòng] [số điểm]
+"""
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import downsample
+from downsample import downsample as downsample_rows, iter_cursor
+
+QUERY = '''SELECT datetime(timestamp, 'localtime'), current, voltage, power, efficiency,
+                  battery_voltage, battery_soc, CAST(strftime('%s', timestamp) AS INTEGER)
+           FROM sensor_data ORDER BY timestamp ASC'''
+
+def build_db(rows):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''CREATE TABLE sensor_data (timestamp TEXT, current REAL, voltage REAL, power REAL,
+                    efficiency REAL, battery_voltage REAL, battery_soc REAL)''')
+    start = 1700000000
+    rng = random.Random(1)
+
+    def gen():
+        for i in range(rows):
+            # Đường cong ngày + nhiễu + vài gai ngắn (đỉnh mà biểu đồ phải giữ)
+            power = max(0.0, 20 * math.sin(i / 28800 * math.pi)) + rng.random()
+            if rng.random() < 0.0005:
+                power += 30
+            yield (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + i * 3)),
+                   power / 12, 12.0, power, 90.0, 12.5, 80.0)
+    conn.executemany('INSERT INTO sensor_data VALUES (?, ?, ?, ?, ?, ?, ?)', gen())
+    conn.execute('CREATE INDEX idx_ts ON sensor_data(timestamp)')
+    return conn, start + rows * 3
+
+def step_filter(conn, points):
+    all_rows = conn.execute(QUERY).fetchall()
+    step = max(1, len(all_rows) // points)
+    filtered = all_rows[::step][:points]
+    filtered[0], filtered[-1] = all_rows[0], all_rows[-1]
+    return filtered
+
+def stream_filter(conn, points, x_end, method):
+    cursor = conn.execute(QUERY)
+    return downsample_rows(iter_cursor(cursor), points, x_end, 7, 3, method)
+
+def measure(label, func, true_max):
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    # Chạy lại dưới tracemalloc riêng để không làm sai lệch thời gian
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    kept_max = max(r[3] for r in result)
+    print(f"{label:<22}{len(result):>8}{elapsed:>10.2f}{peak / 1e6:>12.1f}{kept_max / true_max * 100:>12.1f}")
+
+def main(rows=1000000, points=500):
+    conn, x_end = build_db(rows)
+    true_max = conn.execute('SELECT MAX(power) FROM sensor_data').fetchone()[0]
+    print(f"{rows} rows -> {points} points, numpy={'yes' if downsample.np is not None else 'no'}")
+    print(f"{'method':<22}{'points':>8}{'seconds':>10}{'peak MB':>12}{'peak kept %':>12}")
+    measure('fetchall + step', lambda: step_filter(conn, points), true_max)
+    measure('stream lttb', lambda: stream_filter(conn, points, x_end, 'lttb'), true_max)
+    measure('stream minmax', lambda: stream_filter(conn, points, x_end, 'minmax'), true_max)
+    if downsample.np is not None:
+        np, downsample.np = downsample.np, None
+        measure('stream lttb (no numpy)', lambda: stream_filter(conn, points, x_end, 'lttb'), true_max)
+        downsample.np = np
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
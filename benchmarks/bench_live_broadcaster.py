@@ -0,0 +1,92 @@
+"""Fan-out realtime Socket.IO: emit nguyên trạng thái mỗi packet vs live_broadcaster
+
+Server python-socketio thật với client giả lập (room theo tracker + room xem mọi
+tracker), transport chỉ đếm packet / byte gửi tới từng client. Thời gian giả lập:
+mỗi tracker gửi một packet mỗi giây, broadcaster flush mỗi window giây.
+
+Chạy: python benchmarks/bench_live_broadcaster.py [số client] [số tracker]
+"""
+import os
+import random
+import sys
+import time
+
+import socketio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from live_broadcaster import LiveBroadcaster
+
+SECONDS = 30
+WINDOW = 0.25
+
+def make_server(clients, trackers):
+    sio = socketio.Server(async_mode='threading')
+    sent = {'packets': 0, 'bytes': 0}
+    def send_eio_packet(eio_sid, pkt):
+        sent['packets'] += 1
+        sent['bytes'] += len(pkt.data)
+    sio._send_eio_packet = send_eio_packet
+    for i in range(clients):
+        sid = sio.manager.connect(f'eio-{i}', '/')
+        # 1/5 client xem mọi tracker, còn lại xem một tracker
+        room = 'device:*' if i % 5 == 0 else f'device:T{i % trackers}'
+        sio.manager.enter_room(sid, '/', room)
+    return sio, sent
+
+def packets(trackers):
+    rng = random.Random(1)
+    states = {f'T{t}': {'device_id': f'T{t}', 'azimuth': 180.0, 'elevation': 45.0, 'current': 0.5,
+                        'voltage': 12.0, 'power': 6.0, 'efficiency': 80.0, 'mode': 'AUTO',
+                        'energy_saving': False, 'battery_voltage': 12.4, 'battery_soc': 80,
+                        'remaining_capacity_ah': 2.4, 'battery_capacity_ah': 3.0, 'timestamp': 0}
+              for t in range(trackers)}
+    for second in range(SECONDS):
+        for t in range(trackers):
+            state = states[f'T{t}']
+            # Packet thực tế: góc / công suất đổi liên tục, pin và chế độ ít đổi
+            state['azimuth'] = round(state['azimuth'] + rng.uniform(-0.5, 0.5), 1)
+            state['elevation'] = round(state['elevation'] + rng.uniform(-0.2, 0.2), 1)
+            state['power'] = round(rng.uniform(4, 8), 1)
+            state['current'] = round(state['power'] / 12, 2)
+            if rng.random() < 0.05:
+                state['battery_soc'] += 1
+            state['timestamp'] = 1700000000 + second
+            yield second + t / trackers, state, {'device_id': state['device_id'], 'pico_online': True,
+                                                  'last_update': f'12:00:{second % 60:02d}'}
+
+def run_direct(clients, trackers):
+    sio, sent = make_server(clients, trackers)
+    emits = 0
+    started = time.perf_counter()
+    for _, sensors, status in packets(trackers):
+        for room in (f'device:{sensors["device_id"]}', 'device:*'):
+            sio.emit('sensor_update', sensors, to=room)
+            sio.emit('status_update', status, to=room)
+            emits += 2
+    return time.perf_counter() - started, emits, sent
+
+def run_broadcaster(clients, trackers):
+    sio, sent = make_server(clients, trackers)
+    broadcaster = LiveBroadcaster(lambda event, data, room: sio.emit(event, data, to=room), WINDOW)
+    emits = 0
+    next_flush = WINDOW
+    started = time.perf_counter()
+    for at, sensors, status in packets(trackers):
+        while at >= next_flush:
+            emits += broadcaster.flush()
+            next_flush += WINDOW
+        for room in (f'device:{sensors["device_id"]}', 'device:*'):
+            broadcaster.update(room, sensors, status)
+    emits += broadcaster.flush()
+    return time.perf_counter() - started, emits, sent
+
+def main(clients=500, trackers=20):
+    print(f"{clients} clients, {trackers} trackers x 1 packet/s, {SECONDS}s simulated, window {WINDOW * 1000:.0f} ms")
+    print(f"{'':<18}{'cpu':>9}{'emits':>9}{'client msgs':>13}{'client MB':>11}")
+    for name, run in (('emit per packet', run_direct), ('live_broadcaster', run_broadcaster)):
+        elapsed, emits, sent = run(clients, trackers)
+        print(f"{name:<18}{elapsed:>8.2f}s{emits:>9}{sent['packets']:>13}{sent['bytes'] / 1e6:>11.2f}")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,107 @@
+"""Hàng đợi Slack với webhook giả lập cục bộ: độ trễ phía gọi, retry, gộp message, outbox
+
+Webhook giả lập (http.server) trả lời chậm, lỗi 500 / 429 vài lần đầu rồi 200.
+So sánh thời gian phía gọi của requests.post đồng bộ với notifier.enqueue().
+
+Chạy: python benchmarks/bench_notifier.py [số cảnh báo]
+"""
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier import SlackNotifier, create_outbox_table
+
+DELAY = 0.2          # giây mỗi request của webhook giả lập
+FAILURES = [500, 429, 500]
+
+class Webhook(BaseHTTPRequestHandler):
+    received = []
+    failures = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(DELAY)
+        with self.lock:
+            status = self.failures.pop(0) if self.failures else 200
+            if status == 200:
+                self.received.append(body)
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '0.1')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+def connect_factory(path):
+    def connect():
+        return sqlite3.connect(path, timeout=10, check_same_thread=False)
+    return connect
+
+def wait_for(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+def main(alerts=50):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Webhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/hook'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        connect = connect_factory(os.path.join(tmp, 'bench.db'))
+        conn = connect()
+        create_outbox_table(conn)
+        conn.close()
+
+        # Cách cũ: mỗi cảnh báo chặn luồng gọi suốt request
+        started = time.perf_counter()
+        for i in range(5):
+            requests.post(url, data=json.dumps({'text': f'sync {i}'}), timeout=10)
+        sync_ms = (time.perf_counter() - started) * 1000 / 5
+        Webhook.received.clear()
+
+        Webhook.failures[:] = FAILURES
+        notifier = SlackNotifier(connect, backoff_base=0.1, coalesce_window=0.5)
+        notifier.start()
+        started = time.perf_counter()
+        for i in range(alerts):
+            notifier.enqueue(url, {'text': f'alert {i}', 'attachments': [{'text': str(i)}]}, 'PIN YẾU')
+        enqueue_us = (time.perf_counter() - started) * 1e6 / alerts
+        wait_for(lambda: notifier.get_stats()['messages_sent'] == alerts)
+        stats = notifier.get_stats()
+
+        print(f"{'caller cost':<28}{'per message':>14}")
+        print(f"{'requests.post (sync)':<28}{sync_ms:>11.1f} ms")
+        print(f"{'notifier.enqueue':<28}{enqueue_us:>11.1f} us")
+        print(f"alerts={alerts} posts={len(Webhook.received)} coalesced={stats['coalesced']} "
+              f"retries={stats['retries']} failed={stats['failed']}")
+
+        # Outbox: message chưa gửi (webhook không tới được) được nạp lại ở lần chạy sau
+        dead = SlackNotifier(connect)
+        dead.enqueue('http://127.0.0.1:9/unreachable', {'text': 'after restart'})
+        conn = connect()
+        conn.execute('UPDATE notification_outbox SET webhook_url = ?', (url,))
+        conn.commit()
+        conn.close()
+        restarted = SlackNotifier(connect)
+        restarted.start()
+        wait_for(lambda: restarted.get_stats()['messages_sent'] == 1)
+        print(f"restored={restarted.get_stats()['restored']} "
+              f"delivered_after_restart={Webhook.received[-1]['text'] == 'after restart'}")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
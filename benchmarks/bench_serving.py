@@ -0,0 +1,153 @@
+"""Tải thử server: chế độ threading (Werkzeug) vs gevent (serve.py)
+
+Mỗi chế độ chạy server thật trong process con (database tạm), rồi:
+1. Mở N kết nối long-poll /api/get-command?wait= (PICO chờ lệnh) và giữ chúng
+2. Trong lúc đó C client gửi liên tục GET /api/get-command và POST /api/sensor-data,
+   đo requests/s và độ trễ
+3. Đọc CPU mỗi request, RSS, số thread của process server từ /proc (client chạy
+   cùng máy: trên máy ít core, req/s bị giới hạn bởi CPU chia cho cả client)
+
+Chạy: python benchmarks/bench_serving.py [số long-poll] [số client đồng thời] [giây đo]
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+THREADING_SERVER = '''import sys
+sys.path.insert(0, {root!r})
+import solar_server as s
+s.init_db()
+s.start_services(link=False)
+s.socketio.run(s.app, host='127.0.0.1', port={port}, allow_unsafe_werkzeug=True, log_output=False)
+'''
+
+PACKET = json.dumps({'device_id': 'bench', 'azimuth': 180.0, 'elevation': 45.0, 'current': 0.5,
+                     'voltage': 12.0, 'power': 6.0, 'efficiency': 80.0, 'mode': 'AUTO',
+                     'energy_saving': False, 'battery_voltage': 12.4, 'battery_soc': 80,
+                     'remaining_capacity_ah': 2.4, 'battery_capacity_ah': 3.0}).encode()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(mode, port, cwd):
+    if mode == 'gevent':
+        cmd = [sys.executable, os.path.join(ROOT, 'serve.py'), '--host', '127.0.0.1', '--port', str(port)]
+    else:
+        cmd = [sys.executable, '-c', THREADING_SERVER.format(root=os.path.abspath(ROOT), port=port)]
+    env = dict(os.environ, SOLAR_ASYNC_MODE=mode)
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+def proc_cpu(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def proc_status(pid):
+    fields = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            fields[key] = value.strip()
+    return int(fields['VmRSS'].split()[0]) // 1024, int(fields['Threads'])
+
+async def http(port, method, path, body=b''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        head = f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+        if body:
+            head += f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+        writer.write(head.encode() + b'\r\n' + body)
+        await writer.drain()
+        response = await reader.read()
+        return response.split(b' ', 2)[1] == b'200'
+    finally:
+        writer.close()
+
+async def hold(port, i, wait, results):
+    try:
+        # Long-poll chỉ được giữ cho tracker đã gửi dữ liệu
+        packet = json.dumps(dict(json.loads(PACKET), device_id=f'hold{i}')).encode()
+        await http(port, 'POST', '/api/sensor-data', packet)
+        ok = await http(port, 'GET', f'/api/get-command?device_id=hold{i}&wait={wait}')
+        results['held' if ok else 'failed'] += 1
+    except (OSError, IndexError):
+        results['failed'] += 1
+
+async def load(port, deadline, latencies, errors):
+    i = 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            if i % 2:
+                ok = await http(port, 'POST', '/api/sensor-data', PACKET)
+            else:
+                ok = await http(port, 'GET', '/api/get-command?device_id=bench')
+        except (OSError, IndexError):
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors.append(1)
+        i += 1
+
+async def run(mode, long_polls, clients, seconds):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as cwd:
+        proc = start_server(mode, port, cwd)
+        try:
+            await asyncio.sleep(2)
+            held = {'held': 0, 'failed': 0}
+            wait = seconds + 15
+            holders = []
+            for i in range(long_polls):
+                holders.append(asyncio.ensure_future(hold(port, i, wait, held)))
+                if i % 100 == 99:
+                    await asyncio.sleep(0.05)
+            await asyncio.sleep(2)
+            latencies, errors = [], []
+            deadline = time.monotonic() + seconds
+            started, cpu = time.monotonic(), proc_cpu(proc.pid)
+            await asyncio.gather(*(load(port, deadline, latencies, errors) for _ in range(clients)))
+            elapsed, cpu = time.monotonic() - started, proc_cpu(proc.pid) - cpu
+            rss_mb, threads = proc_status(proc.pid)
+            await asyncio.gather(*holders)
+        finally:
+            proc.kill()
+            proc.wait()
+    latencies.sort()
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else float('nan')
+    return {'held': held['held'], 'held_failed': held['failed'], 'rps': len(latencies) / elapsed,
+            'p50': pct(0.5), 'p99': pct(0.99), 'errors': len(errors), 'rss_mb': rss_mb, 'threads': threads,
+            'cpu_ms': cpu * 1000 / max(1, len(latencies))}
+
+def main(long_polls=1000, clients=50, seconds=10):
+    print(f"{long_polls} long-poll connections held, {clients} concurrent clients for {seconds}s "
+          f"(GET /api/get-command + POST /api/sensor-data)")
+    print(f"{'mode':<11}{'held':>7}{'failed':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}"
+          f"{'cpu ms/req':>11}{'RSS MB':>8}{'threads':>9}")
+    for mode in ('threading', 'gevent'):
+        r = asyncio.run(run(mode, long_polls, clients, seconds))
+        print(f"{mode:<11}{r['held']:>7}{r['held_failed']:>8}{r['rps']:>9.0f}{r['p50']:>9.1f}{r['p99']:>9.1f}"
+              f"{r['errors']:>8}{r['cpu_ms']:>11.2f}{r['rss_mb']:>8}{r['threads']:>9}")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:4]))
@@ -0,0 +1,47 @@
+"""So sánh gói telemetry JSON và nhị phân: số byte và thời gian decode phía server
+
+Chạy: python benchmarks/bench_telemetry_codec.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telemetry_codec import encode_packet, decode_packet, PACKET_SIZE
+
+SAMPLE_PACKET = {
+    "azimuth": 123.4,
+    "elevation": 67.8,
+    "voltage": 5.87,
+    "current": 3.26,
+    "power": 19.14,
+    "efficiency": 95.7,
+    "light_intensity": 1050.25,
+    "light_sensors": [1012.3456, 1100.5123, 903.2278, 1185.0091],
+    "battery_voltage": 12.14,
+    "battery_soc": 78,
+    "remaining_capacity_ah": 2.34,
+    "battery_capacity_ah": 3.0,
+    "mode": "AUTO",
+    "energy_saving": False,
+    "timestamp": 1760000000
+}
+
+def main(number=200000):
+    json_body = json.dumps(SAMPLE_PACKET).encode()
+    binary_body = encode_packet(SAMPLE_PACKET)
+    assert len(binary_body) == PACKET_SIZE
+
+    json_s = timeit.timeit(lambda: json.loads(json_body), number=number)
+    binary_s = timeit.timeit(lambda: decode_packet(binary_body), number=number)
+
+    print(f"{'format':<10}{'bytes':>8}{'decode us/pkt':>16}")
+    print(f"{'json':<10}{len(json_body):>8}{json_s / number * 1e6:>16.3f}")
+    print(f"{'binary':<10}{len(binary_body):>8}{binary_s / number * 1e6:>16.3f}")
+    print(f"size ratio: {len(binary_body) / len(json_body):.2%}, "
+          f"decode speedup: {json_s / binary_s:.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""weather_client với server Open-Meteo giả lập cục bộ (có độ trễ / lỗi được chèn vào)
+
+So sánh số request tới upstream và thời gian chờ của caller:
+- cách cũ: mỗi caller một requests.get
+- WeatherClient: single-flight khi cache trống, cache TTL, stale-while-revalidate,
+  backoff khi upstream trả 500
+
+Chạy: python benchmarks/bench_weather_client.py [số caller đồng thời]
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from weather_client import WeatherClient
+
+LATENCY = 0.3
+
+PAYLOAD = {
+    'current_weather': {'temperature': 30.1, 'windspeed': 3.2, 'winddirection': 120,
+                        'weathercode': 2, 'is_day': 1, 'time': '2024-01-01T12:00'},
+    'hourly': {'time': [f'2024-01-01T{h:02d}:00' for h in range(24)],
+               'temperature_2m': [28.0] * 24, 'relative_humidity_2m': [70] * 24,
+               'cloud_cover': [40] * 24, 'wind_speed_10m': [3.0] * 24},
+    'daily': {'sunrise': ['2024-01-01T05:45'], 'sunset': ['2024-01-01T18:15']}
+}
+
+class FakeOpenMeteo(BaseHTTPRequestHandler):
+    requests = 0
+    status = 200
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            FakeOpenMeteo.requests += 1
+        time.sleep(LATENCY)
+        body = json.dumps(PAYLOAD).encode()
+        self.send_response(self.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def concurrent(func, callers):
+    threads = [threading.Thread(target=func) for _ in range(callers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started
+
+def timed(func, repeat=1000):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) * 1e6 / repeat
+
+def main(callers=20):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenMeteo)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/v1/forecast'
+    params = {'latitude': 10.8, 'longitude': 106.6}
+
+    FakeOpenMeteo.requests = 0
+    old_s = concurrent(lambda: requests.get(url, params=params, timeout=10).json(), callers)
+    old_requests = FakeOpenMeteo.requests
+
+    updates = []
+    client = WeatherClient(url, params, ttl=0.5, max_stale=60, backoff_base=1, on_update=updates.append)
+    FakeOpenMeteo.requests = 0
+    cold_s = concurrent(client.get, callers)
+    cold_requests = FakeOpenMeteo.requests
+    hit_us = timed(client.get)
+
+    time.sleep(0.6)                                    # cache hết hạn
+    stale_us = timed(client.get, 1)
+    time.sleep(LATENCY + 0.1)                          # chờ làm mới nền
+
+    FakeOpenMeteo.status = 500
+    time.sleep(0.6)
+    for _ in range(50):
+        client.get(force=True)
+    stats = client.get_stats()
+
+    print(f"{callers} concurrent callers, upstream latency {LATENCY * 1000:.0f} ms")
+    print(f"{'':<26}{'upstream req':>14}{'wall':>10}")
+    print(f"{'requests.get each':<26}{old_requests:>14}{old_s:>9.2f}s")
+    print(f"{'WeatherClient cold':<26}{cold_requests:>14}{cold_s:>9.2f}s")
+    print(f"cache hit {hit_us:.1f} us, stale served in {stale_us:.0f} us (refreshed in background)")
+    print(f"upstream 500 x50 forced calls: requests={stats['requests']} errors={stats['errors']} "
+          f"backoff_skips={stats['backoff_skips']} cached={stats['cached']}")
+    print(f"payload updates saved: {len(updates)}")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,48 @@
+"""Kiểm tra query plan trên database mới tạo: truy vấn nóng phải dùng index, các truy vấn
+mẫu quét toàn bảng phải bị phát hiện (đảm bảo bản thân phép kiểm tra không bị lỏng)
+
+Chạy: python benchmarks/check_query_plans.py    (exit 1 nếu có lỗi, dùng được trong CI)
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# Truy vấn phải bị find_table_scans() đánh dấu
+BAD_QUERIES = [
+    # Plan là 'SCAN sensor_data USING COVERING INDEX ...': quét hết index, không phải SEARCH
+    ('date_function', 'SELECT power FROM sensor_data WHERE date(timestamp) = ?', ('2024-01-01',)),
+    ('unindexed_column', 'SELECT timestamp FROM sensor_data WHERE power > ?', (10,)),
+    ('full_scan', 'SELECT COUNT(*) FROM sensor_data', ()),
+    ('small_table_scan', 'SELECT * FROM alerts_log WHERE message = ?', ('x',)),
+]
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='solar-plans-')
+    os.chdir(workdir)       # DB_PATH là đường dẫn tương đối
+    import solar_server
+    solar_server.init_db()
+    conn = solar_server.get_db()
+    try:
+        scans = solar_server.find_table_scans(conn)
+        flagged = {name for name, _ in solar_server.find_table_scans(conn, BAD_QUERIES)}
+    finally:
+        conn.close()
+
+    ok = True
+    for name, detail in scans:
+        print(f"❌ {name}: {detail}")
+        ok = False
+    for name, sql, _ in BAD_QUERIES:
+        if name not in flagged:
+            print(f"❌ Không phát hiện quét toàn bảng: {name} ({sql})")
+            ok = False
+    if ok:
+        print(f"✅ {len(solar_server.HOT_QUERIES)} hot queries dùng index, "
+              f"{len(BAD_QUERIES)} truy vấn mẫu bị phát hiện")
+    return ok
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
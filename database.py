@@ -0,0 +1,227 @@
+"""Quản lý kết nối SQLite dùng chung cho Solar Tracker server"""
+import sqlite3
+import threading
+import time
+import queue
+
+# PRAGMA áp dụng một lần cho mỗi kết nối vật lý khi được tạo
+DEFAULT_PRAGMAS = (
+    # Phải đặt trước khi tạo bảng đầu tiên (và trước journal_mode), database cũ
+    # cần VACUUM một lần để chuyển sang INCREMENTAL
+    ('auto_vacuum', 'INCREMENTAL'),
+    ('journal_mode', 'WAL'),        # Reader không chặn writer
+    ('synchronous', 'NORMAL'),      # Đủ an toàn với WAL, ít fsync hơn FULL
+    ('mmap_size', 268435456),       # 256 MB
+    ('cache_size', -16000),         # ~16 MB page cache
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000)
+)
+
+def cooperative_offload(threads=None):
+    """Hàm offload cho ConnectionPool khi process chạy gevent (đã monkey patch), None nếu không
+
+    Lệnh SQLite chạy trong C và giữ thread: dưới gevent chúng được đẩy sang
+    threadpool thật của hub để các greenlet khác vẫn chạy trong lúc chờ database.
+    """
+    try:
+        from gevent import get_hub, monkey
+    except ImportError:
+        return None
+    if not monkey.is_module_patched('socket'):
+        return None
+    threadpool = get_hub().threadpool
+    if threads:
+        threadpool.maxsize = max(threadpool.maxsize, threads)
+    def offload(func, *args):
+        return threadpool.apply(func, args)
+    return offload
+
+class OffloadedCursor:
+    """Proxy quanh sqlite3.Cursor: execute / fetch chạy qua offload"""
+
+    def __init__(self, cursor, offload):
+        self._cursor = cursor
+        self._offload = offload
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, *args):
+        self._offload(self._cursor.execute, *args)
+        return self
+
+    def executemany(self, *args):
+        self._offload(self._cursor.executemany, *args)
+        return self
+
+    def fetchone(self):
+        return self._offload(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._offload(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._offload(self._cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            rows = self._offload(self._cursor.fetchmany, 256)
+            if not rows:
+                return
+            yield from rows
+
+class PooledConnection:
+    """Proxy quanh sqlite3.Connection, close() trả kết nối về pool thay vì đóng"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        attr = getattr(self._conn, name)
+        offload = self._pool.offload
+        if offload is None:
+            return attr
+        if name in ('execute', 'executemany'):
+            return lambda *args: OffloadedCursor(offload(attr, *args), offload)
+        if name == 'cursor':
+            return lambda *args: OffloadedCursor(attr(*args), offload)
+        if name in ('commit', 'rollback', 'executescript'):
+            return lambda *args: offload(attr, *args)
+        return attr
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._pool.offload is not None:
+            return self._pool.offload(self._conn.__exit__, exc_type, exc, tb)
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __del__(self):
+        # Lưới an toàn cho các nhánh return sớm quên gọi close()
+        if getattr(self, '_conn', None) is not None:
+            self._pool.note_leak()
+            self.close()
+
+class ConnectionPool:
+    """Pool kết nối SQLite với thống kê hit/miss và thời gian chờ"""
+
+    def __init__(self, path, size=8, timeout=10, cached_statements=256, pragmas=DEFAULT_PRAGMAS, offload=None):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.pragmas = pragmas
+        self.offload = offload            # offload(func, *args): chạy lệnh SQLite trên thread thật (gevent)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'leaked': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0
+        }
+
+    def _create(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def connect(self):
+        """Lấy một kết nối từ pool, tạo mới nếu pool chưa đầy"""
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.stats['hits'] += 1
+            return PooledConnection(self, conn)
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+                self.stats['misses'] += 1
+        if can_create:
+            try:
+                conn = self.offload(self._create) if self.offload is not None else self._create()
+                return PooledConnection(self, conn)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Pool đã đầy: chờ kết nối được trả về
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise sqlite3.OperationalError(f'connection pool exhausted ({self.size} connections)')
+        waited_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats['waits'] += 1
+            self.stats['total_wait_ms'] += waited_ms
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], waited_ms)
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Trả kết nối về pool, rollback transaction còn dở"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def note_leak(self):
+        with self._lock:
+            self.stats['leaked'] += 1
+
+    def close_all(self):
+        """Đóng toàn bộ kết nối đang rảnh"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['created'] = self._created
+        stats['size'] = self.size
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['created'] - stats['idle']
+        requests_total = stats['hits'] + stats['misses'] + stats['waits']
+        stats['hit_ratio'] = round(stats['hits'] / requests_total, 4) if requests_total else 0.0
+        stats['avg_wait_ms'] = round(stats['total_wait_ms'] / stats['waits'], 3) if stats['waits'] else 0.0
+        stats['total_wait_ms'] = round(stats['total_wait_ms'], 3)
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        return stats
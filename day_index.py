@@ -0,0 +1,63 @@
+"""Chỉ mục các ngày có dữ liệu cảm biến
+
+Mỗi (device_id, ngày UTC) là một dòng trong bảng data_days: số mẫu, timestamp mẫu
+đầu và mẫu cuối. Bảng được cập nhật trong cùng transaction với lô insert
+sensor_data nên danh sách ngày và độ phủ dữ liệu không cần quét sensor_data.
+
+Retention không xóa bảng này: ngày đã bị xóa dữ liệu thô vẫn còn trong file
+archive và bảng rollup.
+"""
+
+def create_day_index_table(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS data_days
+                      (device_id TEXT NOT NULL,
+                       day TEXT NOT NULL,
+                       samples INTEGER NOT NULL,
+                       first_ts TEXT,
+                       last_ts TEXT,
+                       PRIMARY KEY (device_id, day)) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_data_days_day ON data_days(day)')
+
+_UPSERT_SQL = '''INSERT INTO data_days (device_id, day, samples, first_ts, last_ts)
+                 VALUES (?, ?, ?, ?, ?)
+                 ON CONFLICT(device_id, day) DO UPDATE SET
+                     samples = samples + excluded.samples,
+                     first_ts = MIN(COALESCE(first_ts, excluded.first_ts), excluded.first_ts),
+                     last_ts = MAX(COALESCE(last_ts, excluded.last_ts), excluded.last_ts)'''
+
+def apply_day_index(conn, rows, ts_idx=0, device_idx=1):
+    """Cộng một lô dòng sensor_data vào data_days (gọi trong transaction ghi lô)"""
+    days = {}
+    for row in rows:
+        ts = row[ts_idx]
+        key = (row[device_idx], ts[:10])
+        acc = days.get(key)
+        if acc is None:
+            days[key] = [1, ts, ts]
+            continue
+        acc[0] += 1
+        if ts < acc[1]:
+            acc[1] = ts
+        if ts > acc[2]:
+            acc[2] = ts
+    conn.executemany(_UPSERT_SQL, [(device_id, day, *acc) for (device_id, day), acc in days.items()])
+
+def rebuild_day_index(conn):
+    """Dựng lại data_days, trả về số ngày
+
+    Ngày còn dữ liệu thô lấy từ sensor_data; ngày cũ hơn (đã bị retention xóa)
+    lấy số mẫu từ sensor_rollup_day, không có mẫu đầu/cuối.
+    """
+    since = conn.execute('SELECT MIN(timestamp) FROM sensor_data').fetchone()[0]
+    with conn:
+        conn.execute('DELETE FROM data_days')
+        if since is not None:
+            conn.execute('''INSERT INTO data_days (device_id, day, samples, first_ts, last_ts)
+                            SELECT device_id, substr(timestamp, 1, 10), COUNT(*), MIN(timestamp), MAX(timestamp)
+                            FROM sensor_data GROUP BY 1, 2''')
+        conn.execute('''INSERT OR IGNORE INTO data_days (device_id, day, samples)
+                        SELECT device_id, substr(bucket, 1, 10), count FROM sensor_rollup_day''')
+    return conn.execute('SELECT COUNT(*) FROM data_days').fetchone()[0]
+
+def day_index_empty(conn):
+    return conn.execute('SELECT 1 FROM data_days LIMIT 1').fetchone() is None
@@ -0,0 +1,140 @@
+"""Giảm số điểm cho biểu đồ mà vẫn giữ hình dạng (đỉnh/đáy) của chuỗi
+
+Đọc dòng theo kiểu stream (iterator trên cursor), bộ nhớ chỉ phụ thuộc số điểm
+đầu ra và kích thước một bucket, không phụ thuộc tổng số dòng trong cửa sổ.
+
+- lttb:   Largest-Triangle-Three-Buckets, một điểm mỗi bucket
+- minmax: dòng nhỏ nhất và lớn nhất của mỗi bucket, theo thứ tự thời gian
+
+Bucket chia theo thời gian (cột x, epoch giây), dòng phải được sắp tăng dần theo x.
+NumPy (nếu có) dùng để tính diện tích tam giác cho cả bucket một lần.
+"""
+from itertools import chain, islice
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+METHODS = ('lttb', 'minmax')
+
+def iter_cursor(cursor, size=2000):
+    """Duyệt cursor theo từng khối fetchmany thay vì fetchall"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+def _value(row, idx):
+    v = row[idx]
+    return 0.0 if v is None else float(v)
+
+def _pick_lttb(prev, candidates, ax, ay, x_idx, y_idx):
+    """Dòng trong candidates tạo tam giác lớn nhất với prev và điểm (ax, ay)"""
+    px, py = _value(prev, x_idx), _value(prev, y_idx)
+    if np is not None and len(candidates) > 8:
+        xs = np.fromiter((_value(r, x_idx) for r in candidates), float, len(candidates))
+        ys = np.fromiter((_value(r, y_idx) for r in candidates), float, len(candidates))
+        areas = np.abs((px - ax) * (ys - py) - (px - xs) * (ay - py))
+        return candidates[int(areas.argmax())]
+    best, best_area = candidates[0], -1.0
+    for row in candidates:
+        area = abs((px - ax) * (_value(row, y_idx) - py) - (px - _value(row, x_idx)) * (ay - py))
+        if area > best_area:
+            best, best_area = row, area
+    return best
+
+def _mean_point(rows, x_idx, y_idx):
+    n = len(rows)
+    return (sum(_value(r, x_idx) for r in rows) / n,
+            sum(_value(r, y_idx) for r in rows) / n)
+
+def lttb(rows, n_out, x_end, x_idx, y_idx):
+    """LTTB trên stream dòng, giữ dòng đầu và dòng cuối; x_end là mốc cuối cửa sổ"""
+    first = next(rows, None)
+    if first is None:
+        return []
+    if n_out <= 2:
+        last = first
+        for last in rows:
+            pass
+        return [first] if last is first else [first, last]
+    x0 = _value(first, x_idx)
+    inner = n_out - 2
+    width = max(x_end - x0, 1.0) / inner
+
+    selected = [first]
+    prev = first
+    candidates = None           # bucket đang chờ chọn điểm
+    building, building_idx = [], None
+    last = None                 # giữ lại dòng cuối cùng, không đưa vào bucket
+    for row in rows:
+        if last is not None:
+            k = min(int((_value(last, x_idx) - x0) / width), inner - 1)
+            if k != building_idx and building:
+                if candidates:
+                    prev = _pick_lttb(prev, candidates, *_mean_point(building, x_idx, y_idx), x_idx, y_idx)
+                    selected.append(prev)
+                candidates, building = building, []
+            building_idx = k
+            building.append(last)
+        last = row
+
+    if last is None:
+        return selected
+    if building:
+        if candidates:
+            prev = _pick_lttb(prev, candidates, *_mean_point(building, x_idx, y_idx), x_idx, y_idx)
+            selected.append(prev)
+        candidates = building
+    if candidates:
+        selected.append(_pick_lttb(prev, candidates, _value(last, x_idx), _value(last, y_idx), x_idx, y_idx))
+    selected.append(last)
+    return selected
+
+def minmax(rows, n_out, x_end, x_idx, y_idx):
+    """Dòng min và max của y trong mỗi bucket (n_out // 2 bucket), theo thứ tự thời gian"""
+    first = next(rows, None)
+    if first is None:
+        return []
+    x0 = _value(first, x_idx)
+    n_buckets = max(1, n_out // 2)
+    width = max(x_end - x0, 1.0) / n_buckets
+
+    selected = []
+    bucket_idx = None
+    lo = hi = None
+    for row in chain((first,), rows):
+        k = min(int((_value(row, x_idx) - x0) / width), n_buckets - 1)
+        if k != bucket_idx:
+            if lo is not None:
+                selected.extend(_ordered(lo, hi, x_idx))
+            bucket_idx, lo, hi = k, row, row
+            continue
+        y = _value(row, y_idx)
+        if y < _value(lo, y_idx):
+            lo = row
+        if y > _value(hi, y_idx):
+            hi = row
+    if lo is not None:
+        selected.extend(_ordered(lo, hi, x_idx))
+    return selected
+
+def _ordered(lo, hi, x_idx):
+    if lo is hi:
+        return (lo,)
+    return (lo, hi) if _value(lo, x_idx) <= _value(hi, x_idx) else (hi, lo)
+
+def downsample(rows, n_out, x_end, x_idx, y_idx, method='lttb'):
+    """Giảm stream dòng (đã sắp theo x) xuống tối đa n_out dòng, ít dòng hơn thì giữ nguyên"""
+    if method not in METHODS:
+        raise ValueError(f'unknown downsample method {method}')
+    rows = iter(rows)
+    head = list(islice(rows, n_out + 1))
+    if len(head) <= n_out:
+        return head
+    rows = chain(head, rows)
+    if method == 'minmax':
+        return minmax(rows, n_out, x_end, x_idx, y_idx)
+    return lttb(rows, n_out, x_end, x_idx, y_idx)
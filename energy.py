@@ -0,0 +1,191 @@
+"""Tích lũy năng lượng theo ngày (Wh) ngay khi ghi sensor data
+
+Năng lượng giữa hai mẫu liên tiếp của cùng tracker tính theo hình thang
+(P1 + P2) / 2 * dt, với dt là khoảng thời gian thực giữa hai timestamp (3 s bình
+thường, 10 s ở chế độ tiết kiệm, dài hơn khi mất gói). Khoảng vượt max_gap được
+tính là mất dữ liệu: chỉ cộng max_gap giây và đếm vào gaps.
+
+Mỗi (device_id, ngày UTC) là một dòng trong bảng daily_energy; mẫu cuối cùng của
+tracker cũng được lưu ở đó để tiếp tục tích phân sau khi server khởi động lại.
+Mẫu đến muộn (cũ hơn mẫu cuối đã tích phân) làm ngày của nó được tính lại từ
+sensor_data trong cùng transaction.
+"""
+import calendar
+import threading
+import time
+from collections import ChainMap
+from contextlib import contextmanager
+
+from rollups import metric_value
+
+def _epoch(timestamp):
+    return calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+
+def _next_day(day):
+    return time.strftime('%Y-%m-%d', time.gmtime(_epoch(day + ' 00:00:00') + 86400))
+
+def create_energy_table(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_energy
+                      (device_id TEXT NOT NULL,
+                       day TEXT NOT NULL,
+                       energy_wh REAL NOT NULL DEFAULT 0,
+                       samples INTEGER NOT NULL DEFAULT 0,
+                       gaps INTEGER NOT NULL DEFAULT 0,
+                       last_epoch INTEGER,
+                       last_power REAL,
+                       PRIMARY KEY (device_id, day)) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_daily_energy_day ON daily_energy(day)')
+
+_UPSERT_SQL = '''INSERT INTO daily_energy (device_id, day, energy_wh, samples, gaps, last_epoch, last_power)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                 ON CONFLICT(device_id, day) DO UPDATE SET
+                     energy_wh = energy_wh + excluded.energy_wh,
+                     samples = samples + excluded.samples,
+                     gaps = gaps + excluded.gaps,
+                     last_power = CASE WHEN excluded.last_epoch >= last_epoch
+                                       THEN excluded.last_power ELSE last_power END,
+                     last_epoch = MAX(last_epoch, excluded.last_epoch)'''
+
+class EnergyAccumulator:
+    """Giữ mẫu cuối của từng tracker, cộng năng lượng của mỗi lô vào daily_energy"""
+
+    def __init__(self, max_gap=30):
+        self.max_gap = max_gap
+        self._last = {}         # device_id -> (epoch, power), chỉ gồm lô đã commit
+        self._pending = None    # mẫu cuối của lô trong transaction đang mở
+        self._lock = threading.Lock()
+
+    def load(self, conn):
+        """Khôi phục mẫu cuối của từng tracker từ database (khi khởi động)"""
+        rows = conn.execute('''SELECT device_id, last_epoch, last_power FROM daily_energy e
+                               WHERE day = (SELECT MAX(day) FROM daily_energy WHERE device_id = e.device_id)''')
+        with self._lock:
+            self._last = {device_id: (epoch, power) for device_id, epoch, power in rows if epoch is not None}
+
+    def integrate(self, samples, last=None, late=None):
+        """Tích phân các mẫu (device_id, timestamp, power) đã sắp theo thời gian
+
+        Trả về {(device_id, ngày): [energy_wh, samples, gaps, last_epoch, last_power]},
+        cập nhật dict last (mặc định là trạng thái của accumulator). Mẫu cũ hơn mẫu
+        cuối không được tích phân lùi thời gian mà được đếm vào late[(device_id, ngày)].
+        """
+        last = self._last if last is None else last
+        result = {}
+        for device_id, timestamp, power in samples:
+            power = metric_value(power)
+            epoch = _epoch(timestamp)
+            prev = last.get(device_id)
+            if prev is not None and epoch <= prev[0]:
+                if epoch < prev[0] and late is not None:
+                    key = (device_id, timestamp[:10])
+                    late[key] = late.get(key, 0) + 1
+                continue
+            key = (device_id, timestamp[:10])
+            acc = result.get(key)
+            if acc is None:
+                acc = result[key] = [0.0, 0, 0, epoch, power]
+            if prev is not None:
+                dt = epoch - prev[0]
+                if dt > self.max_gap:
+                    dt = self.max_gap
+                    acc[2] += 1
+                acc[0] += (prev[1] + power) / 2 * dt / 3600
+            acc[1] += 1
+            acc[3], acc[4] = epoch, power
+            last[device_id] = (epoch, power)
+        return result
+
+    @contextmanager
+    def transaction(self):
+        """Bọc transaction ghi lô (with energy_accumulator.transaction(), conn:)
+
+        Giữ lock từ trước khi lấy lock ghi của database nên các lô tích phân nối tiếp
+        nhau; mẫu cuối của lô chỉ được đưa vào accumulator khi transaction đã commit.
+        """
+        with self._lock:
+            self._pending = {}
+            try:
+                yield
+                self._last.update(self._pending)
+            finally:
+                self._pending = None
+
+    def apply(self, conn, rows, ts_idx, device_idx, power_idx):
+        """Cộng một lô dòng sensor_data (đã insert) vào daily_energy, gọi trong transaction()"""
+        samples = sorted((row[device_idx], row[ts_idx], row[power_idx]) for row in rows)
+        late = {}
+        result = self.integrate(samples, ChainMap(self._pending, self._last), late)
+        conn.executemany(_UPSERT_SQL, [(device_id, day, *acc) for (device_id, day), acc in result.items()])
+        for (device_id, day), count in sorted(late.items()):
+            self._recompute_day(conn, device_id, day, count)
+
+    def _recompute_day(self, conn, device_id, day, late_count):
+        """Tính lại một (device_id, ngày) từ sensor_data sau khi có mẫu đến muộn
+
+        Ngày mà dữ liệu thô đã bị retention dọn (không kể các mẫu muộn, sensor_data ít
+        dòng hơn số mẫu đã tích phân) giữ nguyên giá trị cũ: tính lại chỉ còn các mẫu muộn.
+        """
+        stored = conn.execute('SELECT samples FROM daily_energy WHERE device_id = ? AND day = ?',
+                              (device_id, day)).fetchone()
+        rows = conn.execute('''SELECT device_id, timestamp, power FROM sensor_data
+                               WHERE device_id = ? AND timestamp >= ? AND timestamp < ?
+                               ORDER BY timestamp''',
+                            (device_id, day + ' 00:00:00', _next_day(day) + ' 00:00:00')).fetchall()
+        if stored is not None and len(rows) - late_count < stored[0]:
+            return False
+        prev = conn.execute('''SELECT last_epoch, last_power FROM daily_energy
+                               WHERE device_id = ? AND day < ? ORDER BY day DESC LIMIT 1''',
+                            (device_id, day)).fetchone()
+        last = {device_id: tuple(prev)} if prev is not None and prev[0] is not None else {}
+        acc = self.integrate(rows, last).get((device_id, day))
+        conn.execute('DELETE FROM daily_energy WHERE device_id = ? AND day = ?', (device_id, day))
+        if acc is not None:
+            conn.execute(_UPSERT_SQL, (device_id, day, *acc))
+        return True
+
+    def rebuild(self, conn, since=None, fetch_size=5000):
+        """Tính lại daily_energy từ sensor_data (mặc định từ ngày của dòng thô cũ nhất), trả về số ngày
+
+        Ngày cũ hơn (dữ liệu thô đã bị retention xóa) giữ nguyên. Nên chạy khi ingest
+        đang dừng (khởi động / CLI): lô ghi trong lúc quét có thể bị tính thiếu.
+        """
+        if since is None:
+            since = conn.execute('SELECT MIN(timestamp) FROM sensor_data').fetchone()[0]
+            if since is None:
+                return 0
+        start_day = since[:10]
+        # Nối tiếp từ mẫu cuối của ngày trước đó (nếu còn) để không mất khoảng qua nửa đêm
+        last = {device_id: (epoch, power) for device_id, epoch, power in conn.execute(
+            '''SELECT device_id, last_epoch, last_power FROM daily_energy e
+               WHERE day = (SELECT MAX(day) FROM daily_energy WHERE device_id = e.device_id AND day < ?)''',
+            (start_day,)) if epoch is not None}
+        totals = {}
+        cursor = conn.execute('''SELECT device_id, timestamp, power FROM sensor_data
+                                 WHERE timestamp >= ? ORDER BY device_id, timestamp''',
+                              (start_day + ' 00:00:00',))
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for key, acc in self.integrate(rows, last).items():
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = acc
+                else:
+                    total[0] += acc[0]
+                    total[1] += acc[1]
+                    total[2] += acc[2]
+                    total[3], total[4] = acc[3], acc[4]
+
+        # Lấy lock của accumulator trước lock ghi của database, cùng thứ tự với transaction()
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM daily_energy WHERE day >= ?', (start_day,))
+                conn.executemany(_UPSERT_SQL, [(device_id, day, *acc) for (device_id, day), acc in totals.items()])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            self._last.update(last)
+        return len(totals)
@@ -0,0 +1,122 @@
+"""Gửi trạng thái realtime qua Socket.IO theo room, gom cập nhật và chỉ gửi phần thay đổi
+
+- update() chỉ ghi trạng thái mới nhất của room (không emit); nhiều packet trong
+  cùng cửa sổ window giây được gộp thành một frame
+- Mỗi tick, mỗi room có thay đổi nhận đúng một emit 'sensor_delta' gồm các trường
+  khác frame trước của room (luôn kèm device_id); python-socketio mã hóa packet
+  một lần cho mọi client trong room
+- Client mới vào room nhận frame() (frame cuối đã gửi cho room) làm mốc rồi áp
+  các delta tiếp theo, nên mọi client trong room có cùng trạng thái
+- status_update chỉ được gửi khi khác lần gửi trước
+"""
+import threading
+import time
+
+class LiveBroadcaster:
+    """Gom cập nhật theo room, thread nền gửi tối đa một frame mỗi window giây cho mỗi room"""
+
+    def __init__(self, emit, window=0.25):
+        self.emit = emit                  # emit(event, data, room)
+        self.window = window
+        self._rooms = {}                  # room -> {'sent', 'pending', 'status_sent', 'status_pending'}
+        self._dirty = set()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {
+            'updates': 0,
+            'coalesced': 0,               # cập nhật bị thay bởi cập nhật mới hơn trước khi gửi
+            'frames': 0,
+            'status_frames': 0,
+            'fields_sent': 0,
+            'fields_total': 0,            # số trường nếu gửi nguyên trạng thái mỗi frame
+            'ticks': 0,
+            'last_flush_ms': None,
+            'max_flush_ms': 0.0
+        }
+
+    def _room(self, room):
+        state = self._rooms.get(room)
+        if state is None:
+            state = self._rooms[room] = {'sent': None, 'pending': None,
+                                         'status_sent': None, 'status_pending': None}
+        return state
+
+    def update(self, room, sensors=None, status=None):
+        """Ghi trạng thái mới nhất của room (sensors: dict cảm biến, status: dict status_update)"""
+        with self._lock:
+            state = self._room(room)
+            self.stats['updates'] += 1
+            if sensors is not None:
+                if state['pending'] is not None:
+                    self.stats['coalesced'] += 1
+                state['pending'] = dict(sensors)
+            if status is not None:
+                state['status_pending'] = dict(status)
+            self._dirty.add(room)
+        self._wakeup.set()
+
+    def frame(self, room):
+        """Frame cuối đã gửi cho room (mốc cho client mới vào), None nếu chưa gửi"""
+        with self._lock:
+            state = self._rooms.get(room)
+            return state['sent'] if state else None
+
+    def flush(self):
+        """Gửi frame cho các room có thay đổi, trả về số emit"""
+        started = time.perf_counter()
+        frames = []
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for room in dirty:
+                state = self._rooms[room]
+                pending, sent = state['pending'], state['sent']
+                if pending is not None:
+                    if sent is None:
+                        delta = pending
+                    else:
+                        delta = {key: value for key, value in pending.items() if sent.get(key) != value}
+                    if delta:
+                        delta['device_id'] = pending.get('device_id')
+                        frames.append(('sensor_delta', delta, room))
+                        self.stats['frames'] += 1
+                        self.stats['fields_sent'] += len(delta)
+                        self.stats['fields_total'] += len(pending)
+                    state['sent'], state['pending'] = pending, None
+                status = state['status_pending']
+                if status is not None:
+                    if status != state['status_sent']:
+                        frames.append(('status_update', status, room))
+                        self.stats['status_frames'] += 1
+                    state['status_sent'], state['status_pending'] = status, None
+        # Emit ngoài lock: update() từ luồng ingest không phải chờ socket
+        for event, data, room in frames:
+            self.emit(event, data, room)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        with self._lock:
+            self.stats['ticks'] += 1
+            self.stats['last_flush_ms'] = elapsed_ms
+            self.stats['max_flush_ms'] = max(self.stats['max_flush_ms'], elapsed_ms)
+        return len(frames)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='live-broadcast', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            # Cập nhật đầu tiên sau một khoảng yên lặng được gửi ngay, các cập nhật
+            # tiếp theo trong window giây được gộp vào frame sau
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Live broadcast error: {e}")
+            time.sleep(self.window)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, rooms=len(self._rooms), pending=len(self._dirty))
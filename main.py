@@ -1,11 +1,33 @@
 from machine import Pin, PWM, I2C, ADC
-import time, math, network, urequests, json
+import machine, ubinascii
+import time, math, network, urequests, json, socket, select
 from ads1x15 import ADS1115
 
+try:
+    import telemetry_codec
+    binary_available = True
+except ImportError:
+    binary_available = False
+
 # ================== CONFIG ==================
 SSID = "awd"
 PASSWORD = "nguyen12"
 SERVER_URL = "http://192.168.137.1:5000"
+USE_BINARY_TELEMETRY = True  # Gui goi nhi phan (telemetry_codec) thay vi JSON
+# Dinh danh tracker trong he thong nhieu thiet bi (16 ky tu hex tu chip RP2040)
+DEVICE_ID = ubinascii.hexlify(machine.unique_id()).decode()
+DEVICE_ID_BYTES = DEVICE_ID.encode()
+
+# ================== DEVICE LINK CONFIG ==================
+USE_DEVICE_LINK = True       # Ket noi TCP lau dai, HTTP chi dung khi mat ket noi
+SERVER_HOST = SERVER_URL.split("//")[1].split(":")[0]
+SERVER_PORT = int(SERVER_URL.rsplit(":", 1)[1])
+USE_LONG_POLL = True         # Lay lenh HTTP bang long-poll thay vi hoi moi giay
+LONG_POLL_WAIT = 20          # Giay server giu request /api/get-command
+LINK_PORT = 5001
+LINK_PING_INTERVAL = 20      # Giay, giu ket noi khi khong co telemetry
+LINK_BACKOFF_MIN = 1
+LINK_BACKOFF_MAX = 60
 
 # ================== PANEL CONFIG ==================
 PANEL_V_RATED = 6.0
@@ -52,15 +74,191 @@ def send_sensor_data(data):
         print("❌ Loi gui data:", e)
         return False
 
+def send_sensor_binary(buf):
+    try:
+        res = urequests.post(f"{SERVER_URL}/api/sensor-data/bin", data=buf,
+                             headers={"Content-Type": "application/octet-stream"}, timeout=3)
+        res.close()
+        return True
+    except Exception as e:
+        print("❌ Loi gui data:", e)
+        return False
+
 def get_control_command():
     try:
-        res = urequests.get(f"{SERVER_URL}/api/get-command", timeout=3)
+        res = urequests.get(f"{SERVER_URL}/api/get-command?device_id={DEVICE_ID}", timeout=3)
         data = res.json()
         res.close()
         return data if data.get("command") else None
     except:
         return None
 
+# ================== DEVICE LINK (TCP) ==================
+class DeviceLink:
+    """Ket noi TCP lau dai toi server, tu ket noi lai voi backoff"""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.poller = None
+        self.rx = b""
+        self.pending = []
+        self.backoff = LINK_BACKOFF_MIN
+        self.next_attempt = 0
+        self.last_tx = 0
+    
+    def connected(self):
+        return self.sock is not None
+    
+    def maintain(self, now):
+        if self.sock is None:
+            if now >= self.next_attempt:
+                self._connect(now)
+        elif now - self.last_tx >= LINK_PING_INTERVAL:
+            self.send(telemetry_codec.FRAME_PING, b"", now)
+    
+    def _connect(self, now):
+        try:
+            addr = socket.getaddrinfo(self.host, self.port)[0][-1]
+            s = socket.socket()
+            s.settimeout(3)
+            s.connect(addr)
+            self.sock = s
+            self.poller = select.poll()
+            self.poller.register(s, select.POLLIN)
+            self.rx = b""
+            self.backoff = LINK_BACKOFF_MIN
+            self.last_tx = now
+            print("🔗 Device link OK")
+        except Exception as e:
+            print("❌ Device link loi:", e)
+            self._drop(now)
+    
+    def _drop(self, now):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except:
+                pass
+        self.sock = None
+        self.poller = None
+        self.next_attempt = now + self.backoff
+        self.backoff = min(self.backoff * 2, LINK_BACKOFF_MAX)
+    
+    def send(self, frame_type, payload, now):
+        if self.sock is None:
+            return False
+        try:
+            self.sock.write(telemetry_codec.encode_frame(frame_type, payload))
+            self.last_tx = now
+            return True
+        except Exception as e:
+            print("❌ Device link gui loi:", e)
+            self._drop(now)
+            return False
+    
+    def poll_command(self, now):
+        """Doc frame dang cho (khong block), tra ve lenh tiep theo hoac None"""
+        if self.sock is None:
+            return None
+        try:
+            while self.poller.poll(0):
+                chunk = self.sock.recv(256)
+                if not chunk:
+                    raise OSError("server closed")
+                self.rx += chunk
+        except Exception as e:
+            print("❌ Device link mat ket noi:", e)
+            self._drop(now)
+            return None
+        if self.rx:
+            frames, self.rx = telemetry_codec.parse_frames(self.rx)
+            for frame_type, payload in frames:
+                if frame_type == telemetry_codec.FRAME_COMMAND:
+                    self.pending.append(json.loads(payload))
+        return self.pending.pop(0) if self.pending else None
+
+# ================== LONG-POLL LENH ==================
+class CommandPoller:
+    """Long-poll /api/get-command bang socket khong block de khong dung vong tracking"""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.poller = None
+        self.rx = b""
+        self.started = 0
+        self.backoff = LINK_BACKOFF_MIN
+        self.next_attempt = 0
+    
+    def poll(self, now, start_new=True):
+        """Tra ve lenh neu request dang cho da co ket qua, tu mo request moi khi can"""
+        if self.sock is None:
+            if start_new and now >= self.next_attempt:
+                self._start(now)
+            return None
+        if now - self.started > LONG_POLL_WAIT + 5:
+            # Server khong tra loi dung han, mo request moi
+            self._close()
+            return None
+        try:
+            while self.poller.poll(0):
+                chunk = self.sock.recv(512)
+                if not chunk:
+                    return self._finish(now)
+                self.rx += chunk
+        except Exception as e:
+            print("❌ Loi long-poll:", e)
+            self._fail(now)
+        return None
+    
+    def _start(self, now):
+        try:
+            addr = socket.getaddrinfo(self.host, self.port)[0][-1]
+            s = socket.socket()
+            s.settimeout(3)
+            s.connect(addr)
+            req = "GET /api/get-command?device_id={}&wait={} HTTP/1.0\r\nHost: {}\r\n\r\n".format(
+                DEVICE_ID, LONG_POLL_WAIT, self.host)
+            s.write(req.encode())
+            self.sock = s
+            self.poller = select.poll()
+            self.poller.register(s, select.POLLIN)
+            self.rx = b""
+            self.started = now
+        except Exception as e:
+            print("❌ Loi long-poll:", e)
+            self._fail(now)
+    
+    def _finish(self, now):
+        data = self.rx
+        self._close()
+        self.backoff = LINK_BACKOFF_MIN
+        try:
+            head, body = data.split(b"\r\n\r\n", 1)
+            if b" 200 " not in head.split(b"\r\n", 1)[0]:
+                raise ValueError(head.split(b"\r\n", 1)[0])
+            cmd = json.loads(body)
+        except Exception as e:
+            print("❌ Loi long-poll:", e)
+            self.next_attempt = now + self.backoff
+            return None
+        return cmd if cmd.get("command") else None
+    
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except:
+                pass
+        self.sock = None
+        self.poller = None
+    
+    def _fail(self, now):
+        self._close()
+        self.next_attempt = now + self.backoff
+        self.backoff = min(self.backoff * 2, LINK_BACKOFF_MAX)
+
 # ================== LCD CLASS ==================
 class I2cLcd:
     def __init__(self, i2c, addr, lines, cols):
@@ -299,8 +497,33 @@ def compute_tracking_smooth(smoothed_values):
     
     return speed_azimuth, speed_elevation
 
+# ================== COMMANDS ==================
+def apply_command(cmd):
+    """Thuc hien lenh tu web"""
+    global auto_mode, energy_saving
+    c = cmd["command"]
+    if c == "SET_MODE":
+        auto_mode = (cmd["mode"] == "AUTO")
+        print("Chuyen che do:", "AUTO" if auto_mode else "MANUAL")
+    elif c == "SET_ANGLE" and not auto_mode and not energy_saving:
+        # Manual mode - dieu khien vi tri truc tiep
+        az = cmd.get("azimuth", current_angles[0])
+        el = cmd.get("elevation", current_angles[1])
+
+        current_angles[0] = max(0.0, min(180.0, az))
+        current_angles[1] = max(0.0, min(180.0, el))
+
+        set_servo_angle(servos[0], current_angles[0])
+        set_servo_angle(servos[1], current_angles[1])
+
+        print(f"🎯 Manual: AZ={current_angles[0]:.1f}°, EL={current_angles[1]:.1f}°")
+    elif c == "SET_ENERGY_MODE":
+        energy_saving = cmd.get("energy_saving", False)
+        print("Nang luong:", "TIET KIEM" if energy_saving else "BINH THUONG")
+
 # ================== MAIN ==================
 print("🚀 Bat dau he thong...")
+print("🆔 Device ID:", DEVICE_ID)
 print(f"⚙️ Tracking: α={SMOOTHING_ALPHA}, Speed={MOVEMENT_SPEED}, Min_diff={MIN_LIGHT_DIFF}")
 
 if lcd_available:
@@ -336,6 +559,9 @@ last_send = 0
 last_cmd = 0
 last_lcd = 0
 prev_energy_saving = energy_saving  # de detect chuyen trang thai tiet kiem
+telemetry_buf = bytearray(telemetry_codec.PACKET_SIZE) if binary_available else None
+link = DeviceLink(SERVER_HOST, LINK_PORT) if USE_DEVICE_LINK and binary_available else None
+command_poller = CommandPoller(SERVER_HOST, SERVER_PORT) if USE_LONG_POLL else None
 
 led = Pin("LED", Pin.OUT)
 
@@ -352,29 +578,26 @@ try:
         battery_soc = calculate_battery_soc(battery_voltage)
         remaining_capacity = estimate_remaining_capacity(battery_soc)
         
+        # ================== KET NOI LAU DAI ==================
+        if wifi_ok and link is not None:
+            link.maintain(now)
+        
         # ================== LAY LENH WEB ==================
-        if wifi_ok and now - last_cmd >= 1:
+        link_up = link is not None and link.connected()
+        if link_up:
+            # Lenh duoc server day xuong qua ket noi TCP
+            cmd = link.poll_command(now)
+            if cmd:
+                apply_command(cmd)
+        if wifi_ok and command_poller is not None:
+            # Khi co link van doc not request long-poll dang cho de khong mat lenh
+            cmd = command_poller.poll(now, start_new=not link_up)
+            if cmd:
+                apply_command(cmd)
+        elif wifi_ok and not link_up and now - last_cmd >= 1:
             cmd = get_control_command()
             if cmd:
-                c = cmd["command"]
-                if c == "SET_MODE":
-                    auto_mode = (cmd["mode"] == "AUTO")
-                    print("Chuyen che do:", "AUTO" if auto_mode else "MANUAL")
-                elif c == "SET_ANGLE" and not auto_mode and not energy_saving:
-                    # Manual mode - dieu khien vi tri truc tiep
-                    az = cmd.get("azimuth", current_angles[0])
-                    el = cmd.get("elevation", current_angles[1])
-
-                    current_angles[0] = max(0.0, min(180.0, az))
-                    current_angles[1] = max(0.0, min(180.0, el))
-
-                    set_servo_angle(servos[0], current_angles[0])
-                    set_servo_angle(servos[1], current_angles[1])
-
-                    print(f"🎯 Manual: AZ={current_angles[0]:.1f}°, EL={current_angles[1]:.1f}°")
-                elif c == "SET_ENERGY_MODE":
-                    energy_saving = cmd.get("energy_saving", False)
-                    print("Nang luong:", "TIET KIEM" if energy_saving else "BINH THUONG")
+                apply_command(cmd)
             last_cmd = now
 
         # ================== CHUYEN TRANG THAI TIET KIEM ==================
@@ -471,25 +694,51 @@ try:
             efficiency = calculate_efficiency(voltage, current)
             light_intensity = calculate_light_intensity(smoothed_values if not energy_saving else light_values)
             
-            packet = {
-                "azimuth": round(current_angles[0], 1),
-                "elevation": round(current_angles[1], 1),
-                "voltage": round(voltage, 2),
-                "current": current,
-                "power": round(power, 2),
-                "efficiency": round(efficiency, 1),
-                "light_intensity": light_intensity,
-                "light_sensors": smoothed_values if not energy_saving else light_values,
-                "battery_voltage": battery_voltage,
-                "battery_soc": battery_soc,
-                "remaining_capacity_ah": round(remaining_capacity, 2),
-                "battery_capacity_ah": BATTERY_CAPACITY_AH,
-                "mode": "AUTO" if auto_mode else "MANUAL",
-                "energy_saving": energy_saving,
-                "timestamp": now
-            }
+            light_sensors = smoothed_values if not energy_saving else light_values
+            
+            binary = USE_BINARY_TELEMETRY and binary_available
+            if binary:
+                # Ghi vao buffer co san, khong tao dict/chuoi JSON moi lan gui
+                try:
+                    telemetry_codec.pack_telemetry(
+                        telemetry_buf, current_angles[0], current_angles[1],
+                        voltage, current, power, efficiency, light_intensity,
+                        light_sensors, battery_voltage, battery_soc,
+                        remaining_capacity, BATTERY_CAPACITY_AH,
+                        auto_mode, energy_saving, now, DEVICE_ID_BYTES
+                    )
+                except ValueError as e:
+                    # Gia tri ngoai layout nhi phan (vd ADC am): gui JSON giu nguyen so do
+                    print("⚠️ Telemetry nhi phan:", e)
+                    binary = False
+            if binary:
+                sent = False
+                if link is not None and link.connected():
+                    sent = link.send(telemetry_codec.FRAME_TELEMETRY, telemetry_buf, now)
+                if not sent:
+                    sent = send_sensor_binary(telemetry_buf)
+            else:
+                packet = {
+                    "device_id": DEVICE_ID,
+                    "azimuth": round(current_angles[0], 1),
+                    "elevation": round(current_angles[1], 1),
+                    "voltage": round(voltage, 2),
+                    "current": current,
+                    "power": round(power, 2),
+                    "efficiency": round(efficiency, 1),
+                    "light_intensity": light_intensity,
+                    "light_sensors": light_sensors,
+                    "battery_voltage": battery_voltage,
+                    "battery_soc": battery_soc,
+                    "remaining_capacity_ah": round(remaining_capacity, 2),
+                    "battery_capacity_ah": BATTERY_CAPACITY_AH,
+                    "mode": "AUTO" if auto_mode else "MANUAL",
+                    "energy_saving": energy_saving,
+                    "timestamp": now
+                }
+                sent = send_sensor_data(packet)
             
-            if send_sensor_data(packet):
+            if sent:
                 print(
                     "📤 Gui: AZ={:.1f}° EL={:.1f}° P={:.1f}W Bat={}%".format(
                         current_angles[0], current_angles[1], power, battery_soc
@@ -0,0 +1,275 @@
+"""Hàng đợi gửi thông báo Slack (webhook) chạy nền
+
+- enqueue() không chặn: message được ghi vào bảng notification_outbox rồi đưa
+  vào hàng đợi giới hạn; một worker gửi qua requests.Session giữ kết nối
+- Lỗi tạm thời (mạng, 429, 5xx) được gửi lại với backoff lũy thừa + jitter,
+  429 tôn trọng Retry-After; URL sai / 4xx khác bỏ luôn
+- Message cùng coalesce_key trong coalesce_window giây được gộp thành một
+- Message chưa gửi được còn trong outbox và được nạp lại khi khởi động
+"""
+import json
+import heapq
+import queue
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+def create_outbox_table(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS notification_outbox
+                      (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       webhook_url TEXT NOT NULL,
+                       payload_json TEXT NOT NULL,
+                       coalesce_key TEXT,
+                       attempts INTEGER NOT NULL DEFAULT 0,
+                       next_attempt REAL,
+                       last_error TEXT,
+                       created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+
+def merge_payloads(payloads, limit=100):
+    """Gộp nhiều payload Slack: text của message đầu + số message gộp, nối attachments"""
+    if len(payloads) == 1:
+        return payloads[0]
+    merged = dict(payloads[0])
+    merged['text'] = f"{payloads[0].get('text', '')} (+{len(payloads) - 1} thông báo tương tự)"
+    attachments = [a for p in payloads for a in p.get('attachments') or []]
+    if attachments:
+        merged['attachments'] = attachments[:limit]   # Giới hạn attachments của Slack
+    return merged
+
+class _PermanentError(Exception):
+    pass
+
+class SlackNotifier:
+    """Worker gửi webhook: hàng đợi giới hạn, retry, gộp message, outbox bền vững"""
+
+    def __init__(self, connect, queue_size=1000, timeout=10, max_attempts=8, backoff_base=2.0,
+                 backoff_max=300.0, coalesce_window=5.0, coalesce_max=20, pool_size=4, session=None):
+        self.connect = connect            # trả về kết nối database (có bảng notification_outbox)
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.coalesce_window = coalesce_window
+        self.coalesce_max = coalesce_max
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._groups = {}                 # (url, key) -> (hạn gửi, [message])
+        self._retry = []                  # heap (hạn gửi, seq, [message])
+        self._seq = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+        self.stats = {
+            'queued': 0,
+            'sent': 0,
+            'messages_sent': 0,
+            'coalesced': 0,
+            'retries': 0,
+            'failed': 0,
+            'dropped': 0,
+            'restored': 0,
+            'last_error': None,
+            'total_send_ms': 0.0,
+            'max_send_ms': 0.0
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def enqueue(self, webhook_url, payload, coalesce_key=None):
+        """Đưa message vào hàng đợi, False nếu hàng đợi đầy"""
+        if self._queue.full():
+            self._count('dropped')
+            return False
+        conn = self.connect()
+        try:
+            with conn:
+                message_id = conn.execute('''INSERT INTO notification_outbox (webhook_url, payload_json, coalesce_key)
+                                             VALUES (?, ?, ?)''',
+                                          (webhook_url, json.dumps(payload), coalesce_key)).lastrowid
+        finally:
+            conn.close()
+        message = {'id': message_id, 'url': webhook_url, 'payload': payload,
+                   'key': coalesce_key, 'attempts': 0}
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self._delete([message])
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def restore(self):
+        """Nạp message còn trong outbox (lần chạy trước chưa gửi được), trả về số message"""
+        conn = self.connect()
+        try:
+            rows = conn.execute('''SELECT id, webhook_url, payload_json, coalesce_key, attempts, next_attempt
+                                   FROM notification_outbox ORDER BY id LIMIT ?''',
+                                (self._queue.maxsize,)).fetchall()
+        finally:
+            conn.close()
+        now, wall = time.monotonic(), time.time()
+        for message_id, url, payload_json, key, attempts, next_attempt in rows:
+            message = {'id': message_id, 'url': url, 'payload': json.loads(payload_json),
+                       'key': key, 'attempts': attempts}
+            due = now + max(0.0, (next_attempt or wall) - wall)
+            self._schedule(due, [message])
+        self._count('restored', len(rows))
+        return len(rows)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.restore()
+        self._thread = threading.Thread(target=self._run, name='slack-notifier', daemon=True)
+        self._thread.start()
+
+    def pending(self):
+        # list() chụp nhanh dict/heap của worker (một thao tác dưới GIL)
+        return self._queue.qsize() + sum(len(m) for _, m in list(self._groups.values())) + \
+            sum(len(m) for _, _, m in list(self._retry))
+
+    def _schedule(self, due, messages):
+        self._seq += 1
+        heapq.heappush(self._retry, (due, self._seq, messages))
+
+    def _run(self):
+        while True:
+            try:
+                self._step()
+            except Exception as e:
+                print(f"❌ Notifier error: {e}")
+                time.sleep(1)
+
+    def _step(self):
+        now = time.monotonic()
+        wakeups = [due for due, _ in self._groups.values()]
+        if self._retry:
+            wakeups.append(self._retry[0][0])
+        timeout = max(0.0, min(wakeups) - now) if wakeups else 1.0
+        try:
+            self._accept(self._queue.get(timeout=timeout))
+            # Lấy hết message đang chờ trước khi gửi để gộp được cả loạt
+            while True:
+                self._accept(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        self._flush_due(time.monotonic())
+
+    def _accept(self, message):
+        if message['key'] is None or self.coalesce_window <= 0:
+            self._schedule(0, [message])
+            return
+        group_key = (message['url'], message['key'])
+        due, messages = self._groups.get(group_key, (time.monotonic() + self.coalesce_window, []))
+        messages.append(message)
+        self._groups[group_key] = (due, messages)
+        if len(messages) >= self.coalesce_max:
+            self._groups[group_key] = (0, messages)
+
+    def _flush_due(self, now):
+        for group_key, (due, messages) in list(self._groups.items()):
+            if due <= now:
+                del self._groups[group_key]
+                self._schedule(0, messages)
+        while self._retry and self._retry[0][0] <= now:
+            _, _, messages = heapq.heappop(self._retry)
+            self._send(messages)
+
+    def _post(self, url, payload):
+        """Gửi một request: None nếu thành công, (Retry-After hoặc -1, lỗi) nếu lỗi tạm thời"""
+        try:
+            response = self.session.post(url, data=json.dumps(payload),
+                                         headers={'Content-Type': 'application/json'},
+                                         timeout=self.timeout)
+        except ValueError as e:
+            # MissingSchema / InvalidURL: cấu hình sai, gửi lại cũng không được
+            raise _PermanentError(str(e))
+        except requests.RequestException as e:
+            return -1, str(e)
+        if response.status_code == 200:
+            return None
+        if response.status_code == 429:
+            try:
+                return float(response.headers.get('Retry-After', -1)), 'HTTP 429'
+            except ValueError:
+                return -1, 'HTTP 429'
+        if response.status_code >= 500:
+            return -1, f'HTTP {response.status_code}'
+        raise _PermanentError(f'HTTP {response.status_code}')
+
+    def _send(self, messages):
+        for i in range(0, len(messages), self.coalesce_max):
+            self._send_batch(messages[i:i + self.coalesce_max])
+
+    def _send_batch(self, messages):
+        started = time.perf_counter()
+        try:
+            result = self._post(messages[0]['url'], merge_payloads([m['payload'] for m in messages]))
+        except _PermanentError as e:
+            self._fail(messages, str(e))
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats['total_send_ms'] += elapsed_ms
+            self.stats['max_send_ms'] = max(self.stats['max_send_ms'], elapsed_ms)
+        if result is None:
+            self._delete(messages)
+            with self._lock:
+                self.stats['sent'] += 1
+                self.stats['messages_sent'] += len(messages)
+                self.stats['coalesced'] += len(messages) - 1
+            return
+
+        retry_after, error = result
+        attempts = max(m['attempts'] for m in messages) + 1
+        if attempts >= self.max_attempts:
+            self._fail(messages, error)
+            return
+        for m in messages:
+            m['attempts'] = attempts
+        delay = retry_after if retry_after >= 0 else \
+            min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+        self._schedule(time.monotonic() + delay, messages)
+        with self._lock:
+            self.stats['retries'] += 1
+            self.stats['last_error'] = error
+        conn = self.connect()
+        try:
+            with conn:
+                conn.executemany('''UPDATE notification_outbox SET attempts = ?, next_attempt = ?, last_error = ?
+                                    WHERE id = ?''',
+                                 [(attempts, time.time() + delay, error, m['id']) for m in messages])
+        finally:
+            conn.close()
+
+    def _fail(self, messages, error):
+        print(f"❌ Slack message dropped after {max(m['attempts'] for m in messages) + 1} attempt(s): {error}")
+        self._delete(messages)
+        with self._lock:
+            self.stats['failed'] += len(messages)
+            self.stats['last_error'] = error
+
+    def _delete(self, messages):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.executemany('DELETE FROM notification_outbox WHERE id = ?', [(m['id'],) for m in messages])
+        finally:
+            conn.close()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['pending'] = self.pending()
+        stats['avg_send_ms'] = round(stats['total_send_ms'] / stats['sent'], 1) if stats['sent'] else None
+        return stats
@@ -0,0 +1,129 @@
+"""Cache response trong process cho các API đọc nhiều (biểu đồ, báo cáo, danh sách ngày)
+
+- LRU giới hạn theo tổng số byte và số entry, mỗi entry có TTL
+- Mỗi entry gắn các tag (vd. 'sensor:<device>:<ngày>'); invalidate(tag) chỉ xóa
+  các entry phụ thuộc vào tag đó
+- Thống kê hit/miss theo từng endpoint
+"""
+import threading
+import time
+from collections import OrderedDict
+
+class ResponseCache:
+    """Cache body response (bytes) theo key, LRU + TTL + invalidation theo tag"""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, max_entries=2000, default_ttl=300):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()   # key -> (body, expires_at, tags)
+        self._tags = {}                 # tag -> set(key)
+        self._bytes = 0
+        self._generation = 0            # tăng mỗi lần invalidate
+        self._tag_generation = {}       # tag -> generation lần invalidate gần nhất
+        self._cleared_at = 0
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.stats = {
+            'evictions': 0,
+            'expired': 0,
+            'invalidations': 0,
+            'invalidated_entries': 0,
+            'stale_skips': 0
+        }
+
+    def _endpoint_stats(self, endpoint):
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = {'hits': 0, 'misses': 0}
+        return stats
+
+    def _remove(self, key):
+        body, _, tags = self._entries.pop(key)
+        self._bytes -= len(body)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, endpoint, key):
+        """Trả về body đã cache, None nếu không có hoặc đã hết hạn"""
+        with self._lock:
+            stats = self._endpoint_stats(endpoint)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            stats['hits'] += 1
+            return entry[0]
+
+    def generation(self):
+        """Mốc lấy trước khi tính response, truyền lại cho set()"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, body, tags=(), ttl=None, generation=None):
+        """Lưu body; bỏ qua nếu một tag của nó bị invalidate kể từ mốc generation
+        (response được tính trên dữ liệu có thể đã cũ)"""
+        if len(body) > self.max_bytes:
+            return False
+        tags = frozenset(tags)
+        with self._lock:
+            if generation is not None and (
+                    generation < self._cleared_at or
+                    any(self._tag_generation.get(tag, 0) > generation for tag in tags)):
+                self.stats['stale_skips'] += 1
+                return False
+            if key in self._entries:
+                self._remove(key)
+            expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+            self._entries[key] = (body, expires_at, tags)
+            self._bytes += len(body)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+            return True
+
+    def invalidate(self, *tags):
+        """Xóa mọi entry gắn một trong các tag, trả về số entry bị xóa"""
+        removed = 0
+        with self._lock:
+            self._generation += 1
+            self.stats['invalidations'] += 1
+            for tag in tags:
+                self._tag_generation[tag] = self._generation
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+            self.stats['invalidated_entries'] += removed
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared_at = self._generation
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+            endpoints = {}
+            for endpoint, counts in self._endpoints.items():
+                total = counts['hits'] + counts['misses']
+                endpoints[endpoint] = dict(counts, hit_ratio=round(counts['hits'] / total, 4) if total else 0.0)
+            stats['endpoints'] = endpoints
+        return stats
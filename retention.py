@@ -0,0 +1,114 @@
+"""Chính sách lưu giữ dữ liệu: xóa dữ liệu cũ theo lô nhỏ và trả dung lượng về hệ điều hành
+
+Mỗi chính sách là (bảng, cột thời gian, cột khóa, mốc cắt). Dòng có cột thời gian
+< mốc cắt bị xóa theo từng lô trong transaction riêng, nghỉ giữa các lô để writer
+của ingest không phải chờ lock lâu. Sau khi xóa chạy PRAGMA incremental_vacuum
+(cần auto_vacuum = INCREMENTAL).
+
+Chế độ dry-run chỉ đếm số dòng và ước lượng số byte sẽ thu hồi.
+"""
+import sqlite3
+import time
+
+class RetentionPolicy:
+    """Xóa dòng của table có time_column < cutoff, theo lô khóa key_column
+
+    key_column phải xác định duy nhất một dòng: rowid, hoặc tuple các cột của
+    PRIMARY KEY với bảng WITHOUT ROWID (xóa bằng row value IN)
+    """
+
+    def __init__(self, table, time_column, cutoff, key_column='rowid'):
+        self.table = table
+        self.time_column = time_column
+        self.cutoff = cutoff
+        self.key_columns = (key_column,) if isinstance(key_column, str) else tuple(key_column)
+
+    def count_sql(self):
+        return f'SELECT COUNT(*) FROM {self.table} WHERE {self.time_column} < ?'
+
+    def delete_sql(self):
+        keys = ', '.join(self.key_columns)
+        target = keys if len(self.key_columns) == 1 else f'({keys})'
+        return (f'DELETE FROM {self.table} WHERE {target} IN '
+                f'(SELECT {keys} FROM {self.table} '
+                f'WHERE {self.time_column} < ? LIMIT ?)')
+
+def table_bytes(conn, table):
+    """Số byte bảng và các index của nó chiếm trên đĩa, None nếu SQLite không có dbstat"""
+    try:
+        row = conn.execute('''SELECT SUM(pgsize) FROM dbstat
+                              WHERE name = ? OR name IN
+                              (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?)''',
+                           (table, table)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] or 0
+
+def estimate_reclaim(conn, policy):
+    """(số dòng sẽ xóa, số byte ước lượng thu hồi) cho một chính sách"""
+    rows = conn.execute(policy.count_sql(), (policy.cutoff,)).fetchone()[0]
+    if not rows:
+        return 0, 0
+    total_rows = conn.execute(f'SELECT COUNT(*) FROM {policy.table}').fetchone()[0]
+    size = table_bytes(conn, policy.table)
+    if size is None or not total_rows:
+        return rows, None
+    return rows, int(size * rows / total_rows)
+
+def prune(connect, policy, batch_size=2000, pause=0.05, max_rows=None):
+    """Xóa theo lô, mỗi lô một transaction; trả về số dòng đã xóa"""
+    deleted = 0
+    while max_rows is None or deleted < max_rows:
+        limit = batch_size if max_rows is None else min(batch_size, max_rows - deleted)
+        conn = connect()
+        try:
+            with conn:
+                count = conn.execute(policy.delete_sql(), (policy.cutoff, limit)).rowcount
+        finally:
+            conn.close()
+        deleted += count
+        if count < limit:
+            break
+        time.sleep(pause)
+    return deleted
+
+def incremental_vacuum(conn, pages=None):
+    """Trả các trang trống về hệ điều hành, trả về số trang đã giải phóng (0 nếu chưa bật auto_vacuum)"""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 0
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    # executescript chạy pragma tới hết; execute() của sqlite3 chỉ step một lần (một trang)
+    conn.executescript(f'PRAGMA incremental_vacuum({int(pages) if pages else 0});')
+    return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+def run_retention(connect, policies, dry_run=False, batch_size=2000, pause=0.05,
+                  max_rows=None, vacuum_pages=None):
+    """Chạy các chính sách, trả về báo cáo {'tables': {bảng: {...}}, ...}"""
+    started = time.perf_counter()
+    report = {'dry_run': dry_run, 'tables': {}}
+    remaining = max_rows
+    for policy in policies:
+        conn = connect()
+        try:
+            rows, size = estimate_reclaim(conn, policy)
+        finally:
+            conn.close()
+        entry = {'cutoff': policy.cutoff, 'rows': rows, 'estimated_bytes': size}
+        if not dry_run and rows and (remaining is None or remaining > 0):
+            entry['deleted'] = prune(connect, policy, batch_size, pause, remaining)
+            if remaining is not None:
+                remaining -= entry['deleted']
+        report['tables'][policy.table] = entry
+
+    report['rows'] = sum(t['rows'] for t in report['tables'].values())
+    report['estimated_bytes'] = sum(t['estimated_bytes'] or 0 for t in report['tables'].values())
+    if not dry_run:
+        report['deleted'] = sum(t.get('deleted', 0) for t in report['tables'].values())
+        conn = connect()
+        try:
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            report['vacuumed_bytes'] = incremental_vacuum(conn, vacuum_pages) * page_size
+        finally:
+            conn.close()
+    report['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return report
@@ -0,0 +1,148 @@
+"""Bảng tổng hợp (rollup) sensor data theo bucket thời gian
+
+Mỗi mức có một bảng sensor_rollup_<mức>, mỗi dòng là một (device_id, bucket)
+với count và min/max/sum của từng metric. Bucket là thời điểm bắt đầu (UTC,
+cùng định dạng cột timestamp 'YYYY-MM-DD HH:MM:SS'), trung bình = sum / count.
+
+Các bảng được cập nhật trong cùng transaction với lô insert sensor_data và có
+thể dựng lại từ dữ liệu thô bằng rebuild_rollups().
+"""
+
+ROLLUP_METRICS = ('current', 'voltage', 'power', 'efficiency', 'battery_voltage', 'battery_soc')
+
+# (tên mức, độ dài bucket (giây), tính bucket trong Python, biểu thức SQL tương đương)
+# Cắt chuỗi timestamp thay vì parse datetime: nhanh và cho kết quả giống hệt phía SQL
+ROLLUP_LEVELS = (
+    ('1min', 60,
+     lambda ts: ts[:16] + ':00',
+     "substr(timestamp, 1, 16) || ':00'"),
+    ('15min', 900,
+     lambda ts: '%s%02d:00' % (ts[:14], int(ts[14:16]) // 15 * 15),
+     "substr(timestamp, 1, 14) || printf('%02d', CAST(substr(timestamp, 15, 2) AS INTEGER) / 15 * 15) || ':00'"),
+    ('hour', 3600,
+     lambda ts: ts[:13] + ':00:00',
+     "substr(timestamp, 1, 13) || ':00:00'"),
+    ('day', 86400,
+     lambda ts: ts[:10] + ' 00:00:00',
+     "substr(timestamp, 1, 10) || ' 00:00:00'"),
+)
+LEVEL_SECONDS = {name: seconds for name, seconds, _, _ in ROLLUP_LEVELS}
+
+_VALUE_COLUMNS = ['count'] + [f'{m}_{agg}' for m in ROLLUP_METRICS for agg in ('min', 'max', 'sum')]
+
+def rollup_table(level):
+    if level not in LEVEL_SECONDS:
+        raise ValueError(f'unknown rollup level {level}')
+    return f'sensor_rollup_{level}'
+
+def bucket_start(timestamp, level):
+    """Bucket chứa timestamp ở mức level"""
+    for name, _, bucket, _ in ROLLUP_LEVELS:
+        if name == level:
+            return bucket(timestamp)
+    raise ValueError(f'unknown rollup level {level}')
+
+def pick_level(window_seconds, min_points):
+    """Mức thô nhất vẫn cho ít nhất min_points bucket trong cửa sổ, None nếu cần dữ liệu thô"""
+    for name, seconds, _, _ in reversed(ROLLUP_LEVELS):
+        if window_seconds / seconds >= min_points:
+            return name
+    return None
+
+def create_rollup_tables(cursor):
+    metric_columns = ', '.join(f'{m}_{agg} REAL' for m in ROLLUP_METRICS for agg in ('min', 'max', 'sum'))
+    for name, _, _, _ in ROLLUP_LEVELS:
+        table = rollup_table(name)
+        cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table}
+                           (device_id TEXT NOT NULL,
+                            bucket TEXT NOT NULL,
+                            count INTEGER NOT NULL,
+                            {metric_columns},
+                            PRIMARY KEY (device_id, bucket)) WITHOUT ROWID''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket)')
+
+def _upsert_sql(table):
+    updates = ['count = count + excluded.count']
+    for m in ROLLUP_METRICS:
+        updates.append(f'{m}_min = MIN({m}_min, excluded.{m}_min)')
+        updates.append(f'{m}_max = MAX({m}_max, excluded.{m}_max)')
+        updates.append(f'{m}_sum = {m}_sum + excluded.{m}_sum')
+    return (f"INSERT INTO {table} (device_id, bucket, {', '.join(_VALUE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * (len(_VALUE_COLUMNS) + 2))}) "
+            f"ON CONFLICT(device_id, bucket) DO UPDATE SET {', '.join(updates)}")
+
+_UPSERT_SQL = {name: _upsert_sql(rollup_table(name)) for name, _, _, _ in ROLLUP_LEVELS}
+
+def metric_value(value):
+    """Giá trị metric dạng số: chuỗi số được đổi sang float, None / giá trị khác thành 0
+
+    Các phép gộp theo lô chạy trong transaction ghi lô: một giá trị sai không được làm
+    hỏng (rollback) cả lô.
+    """
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+def aggregate_rows(rows, columns):
+    """Gom các dòng sensor_data (tuple theo columns) thành {mức: {(device_id, bucket): giá trị}}"""
+    ts_idx = columns.index('timestamp')
+    device_idx = columns.index('device_id')
+    metric_idx = [columns.index(m) for m in ROLLUP_METRICS]
+    result = {name: {} for name, _, _, _ in ROLLUP_LEVELS}
+    for row in rows:
+        ts = row[ts_idx]
+        values = [metric_value(row[i]) for i in metric_idx]
+        for name, _, bucket, _ in ROLLUP_LEVELS:
+            key = (row[device_idx], bucket(ts))
+            acc = result[name].get(key)
+            if acc is None:
+                acc = [1]
+                for v in values:
+                    acc.extend((v, v, v))
+                result[name][key] = acc
+                continue
+            acc[0] += 1
+            for i, v in enumerate(values):
+                j = 1 + i * 3
+                if v < acc[j]:
+                    acc[j] = v
+                if v > acc[j + 1]:
+                    acc[j + 1] = v
+                acc[j + 2] += v
+    return result
+
+def apply_rollups(conn, rows, columns):
+    """Cộng dồn một lô dòng sensor_data vào các bảng rollup (gọi trong transaction ghi lô)"""
+    for name, buckets in aggregate_rows(rows, columns).items():
+        conn.executemany(_UPSERT_SQL[name],
+                         [(device_id, bucket, *acc) for (device_id, bucket), acc in buckets.items()])
+
+def rebuild_rollups(conn, since=None):
+    """Dựng lại các bảng rollup từ sensor_data, trả về số dòng
+
+    Mặc định từ dòng thô cũ nhất: bucket cũ hơn (dữ liệu thô đã bị retention xóa)
+    được giữ nguyên.
+    """
+    if since is None:
+        since = conn.execute('SELECT MIN(timestamp) FROM sensor_data').fetchone()[0]
+        if since is None:
+            return 0
+    aggregates = ', '.join(f'MIN({m}), MAX({m}), TOTAL({m})' for m in ROLLUP_METRICS)
+    total = 0
+    with conn:
+        for name, _, bucket, bucket_sql in ROLLUP_LEVELS:
+            table = rollup_table(name)
+            start = bucket(since)
+            conn.execute(f'DELETE FROM {table} WHERE bucket >= ?', (start,))
+            cur = conn.execute(f'''INSERT INTO {table} (device_id, bucket, {', '.join(_VALUE_COLUMNS)})
+                                   SELECT device_id, {bucket_sql}, COUNT(*), {aggregates}
+                                   FROM sensor_data WHERE timestamp >= ?
+                                   GROUP BY 1, 2''', (start,))
+            total += cur.rowcount
+    return total
+
+def rollups_empty(conn):
+    return conn.execute(f"SELECT 1 FROM {rollup_table('day')} LIMIT 1").fetchone() is None
@@ -0,0 +1,217 @@
+"""Bộ lập lịch task nền: heap theo thời điểm đến hạn + thread pool
+
+- every(): task chạy theo chu kỳ (đồng hồ monotonic)
+- daily(): task theo giờ đồng hồ (giờ địa phương 'HH:MM', tùy chọn thứ trong tuần)
+- Lỡ lịch (vòng lặp trễ, server tắt đúng lúc đến hạn) thì chạy bù một lần nếu
+  còn trong cửa sổ catch_up; lần chạy cuối của task daily được lưu trong bảng
+  scheduled_runs để chạy bù sau khi khởi động lại
+- Task chạy trên thread pool: task chậm không làm trễ task khác; một task không
+  chạy chồng lên chính nó (lần đến hạn trùng được tính là overrun)
+"""
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+def create_scheduler_table(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS scheduled_runs
+                      (name TEXT PRIMARY KEY,
+                       last_run REAL NOT NULL)''')
+
+class Task:
+    """Một task: chu kỳ (interval giây) hoặc giờ cố định (at 'HH:MM')"""
+
+    def __init__(self, name, func, interval=None, at=None, weekdays=None, catch_up=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.weekdays = set(weekdays) if weekdays else None     # 0 = thứ Hai
+        self.catch_up = catch_up
+        if at is not None:
+            hour, minute = (int(part) for part in at.split(':'))
+            self.at = (hour, minute)
+        else:
+            self.at = None
+        self.running = False
+        self.last_run = None              # epoch lần chạy gần nhất (wall clock)
+        self.next_run = None
+        self.stats = {
+            'runs': 0,
+            'errors': 0,
+            'last_error': None,
+            'overruns': 0,                # đến hạn khi lần trước chưa xong
+            'missed': 0,                  # lần đến hạn bị bỏ (quá cửa sổ catch_up / gộp)
+            'last_duration_ms': None,
+            'max_duration_ms': 0.0,
+            'total_duration_ms': 0.0,
+            'last_late_ms': None,         # bắt đầu trễ so với lịch
+            'max_late_ms': 0.0
+        }
+
+    def next_occurrence(self, after):
+        """Lần đến hạn đầu tiên sau thời điểm after (epoch) của task daily"""
+        t = datetime.fromtimestamp(after).replace(hour=self.at[0], minute=self.at[1], second=0, microsecond=0)
+        if t.timestamp() <= after:
+            t += timedelta(days=1)
+        while self.weekdays is not None and t.weekday() not in self.weekdays:
+            t += timedelta(days=1)
+        return t.timestamp()
+
+    def previous_occurrence(self, before):
+        """Lần đến hạn gần nhất không muộn hơn before"""
+        t = datetime.fromtimestamp(before).replace(hour=self.at[0], minute=self.at[1], second=0, microsecond=0)
+        if t.timestamp() > before:
+            t -= timedelta(days=1)
+        while self.weekdays is not None and t.weekday() not in self.weekdays:
+            t -= timedelta(days=1)
+        return t.timestamp()
+
+class Scheduler:
+    """Heap các task theo hạn chạy (monotonic), một thread điều phối và thread pool thực thi"""
+
+    def __init__(self, workers=4, connect=None):
+        self.workers = workers
+        self.connect = connect            # lưu lần chạy của task daily (None: không lưu)
+        self._tasks = {}
+        self._heap = []                   # (hạn monotonic, seq, tên task)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._executor = None
+        self._thread = None
+
+    def every(self, name, interval, func, delay=0.0):
+        """Chạy func mỗi interval giây, lần đầu sau delay giây"""
+        task = self._tasks[name] = Task(name, func, interval=interval)
+        self._push(task, time.monotonic() + delay)
+        return task
+
+    def daily(self, name, at, func, weekdays=None, catch_up=3600):
+        """Chạy func lúc at ('HH:MM' giờ địa phương); lỡ lịch thì chạy bù nếu trễ chưa quá catch_up giây"""
+        task = self._tasks[name] = Task(name, func, at=at, weekdays=weekdays, catch_up=catch_up)
+        self._push(task, self._wall_to_monotonic(task.next_occurrence(time.time())))
+        return task
+
+    @staticmethod
+    def _wall_to_monotonic(wall):
+        return time.monotonic() + (wall - time.time())
+
+    def _push(self, task, due):
+        with self._cond:
+            self._seq += 1
+            task.next_run = due
+            heapq.heappush(self._heap, (due, self._seq, task.name))
+            self._cond.notify()
+
+    def _load_last_runs(self):
+        if self.connect is None:
+            return
+        conn = self.connect()
+        try:
+            rows = conn.execute('SELECT name, last_run FROM scheduled_runs').fetchall()
+        finally:
+            conn.close()
+        now = time.time()
+        for name, last_run in rows:
+            task = self._tasks.get(name)
+            if task is None or task.at is None:
+                continue
+            task.last_run = last_run
+            # Server tắt đúng lúc đến hạn: chạy bù ngay nếu còn trong cửa sổ catch_up
+            previous = task.previous_occurrence(now)
+            if last_run < previous and now - previous <= task.catch_up:
+                self._push(task, self._wall_to_monotonic(previous))
+
+    def _save_last_run(self, task):
+        if self.connect is None or task.at is None:
+            return
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('''INSERT INTO scheduled_runs (name, last_run) VALUES (?, ?)
+                                ON CONFLICT(name) DO UPDATE SET last_run = excluded.last_run''',
+                             (task.name, task.last_run))
+        finally:
+            conn.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._load_last_runs()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='task')
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                due, seq, name = heapq.heappop(self._heap)
+                task = self._tasks[name]
+                if task.next_run != due:
+                    continue                  # Mục heap cũ (task đã được xếp lịch lại)
+            try:
+                self._dispatch(task, due)
+            except RuntimeError:
+                return                        # Thread pool đã đóng (interpreter đang thoát)
+
+    def _dispatch(self, task, due):
+        now = time.monotonic()
+        late = now - due
+        # Xếp lịch lần sau trước khi chạy: lịch không phụ thuộc thời gian chạy của task
+        if task.interval is not None:
+            skipped = int(late // task.interval)
+            task.stats['missed'] += skipped
+            self._push(task, due + (skipped + 1) * task.interval)
+        else:
+            wall_due = time.time() - late
+            self._push(task, self._wall_to_monotonic(task.next_occurrence(max(time.time(), wall_due + 1))))
+            if late > task.catch_up:
+                task.stats['missed'] += 1
+                return
+
+        if task.running:
+            task.stats['overruns'] += 1
+            return
+        task.running = True
+        task.stats['last_late_ms'] = round(late * 1000, 1)
+        task.stats['max_late_ms'] = max(task.stats['max_late_ms'], task.stats['last_late_ms'])
+        self._executor.submit(self._execute, task)
+
+    def _execute(self, task):
+        started = time.perf_counter()
+        task.last_run = time.time()
+        try:
+            task.func()
+        except Exception as e:
+            task.stats['errors'] += 1
+            task.stats['last_error'] = f'{type(e).__name__}: {e}'
+            print(f"❌ Scheduled task {task.name} error: {e}")
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            task.stats['runs'] += 1
+            task.stats['last_duration_ms'] = round(duration_ms, 1)
+            task.stats['max_duration_ms'] = max(task.stats['max_duration_ms'], round(duration_ms, 1))
+            task.stats['total_duration_ms'] += duration_ms
+            task.running = False
+        try:
+            self._save_last_run(task)
+        except Exception as e:
+            print(f"❌ Scheduler state error: {e}")
+
+    def get_stats(self):
+        now_mono, now_wall = time.monotonic(), time.time()
+        result = {}
+        for name, task in list(self._tasks.items()):
+            stats = dict(task.stats)
+            stats['avg_duration_ms'] = round(stats.pop('total_duration_ms') / stats['runs'], 1) if stats['runs'] else None
+            stats['running'] = task.running
+            stats['schedule'] = f'every {task.interval}s' if task.interval is not None else \
+                'daily %02d:%02d' % task.at
+            stats['last_run'] = datetime.fromtimestamp(task.last_run).strftime('%Y-%m-%d %H:%M:%S') \
+                if task.last_run else None
+            stats['next_run'] = datetime.fromtimestamp(now_wall + task.next_run - now_mono).strftime(
+                '%Y-%m-%d %H:%M:%S') if task.next_run is not None else None
+            result[name] = stats
+        return result
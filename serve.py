@@ -0,0 +1,44 @@
+"""Chạy Solar Tracker server ở chế độ production: gevent thay cho Werkzeug dev server
+
+- monkey.patch_all() trước mọi import: socket (requests tới Slack / Open-Meteo,
+  device link TCP), threading, queue, time.sleep trở thành cooperative, mỗi kết
+  nối HTTP / Socket.IO / long-poll là một greenlet thay vì một thread
+- Lệnh SQLite chạy trên threadpool thật của gevent (database.cooperative_offload)
+- Một process duy nhất: trạng thái realtime, hàng đợi lệnh, room Socket.IO nằm
+  trong bộ nhớ của process (và SQLite chỉ có một writer)
+
+Chạy: python serve.py [--host 0.0.0.0] [--port 5000]
+Hoặc: gunicorn -k geventwebsocket.gunicorn.workers.GeventWebSocketWorker -w 1 -b 0.0.0.0:5000 'serve:create_app()'
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import os
+
+os.environ['SOLAR_ASYNC_MODE'] = 'gevent'
+
+import solar_server
+from solar_server import app, socketio, SERVER_CONFIG
+
+_started = False
+
+def create_app():
+    """Khởi tạo database, chạy các greenlet nền (một lần) và trả về WSGI app"""
+    global _started
+    if not _started:
+        solar_server.init_db()
+        solar_server.start_services()
+        _started = True
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solar Tracker server (gevent)')
+    parser.add_argument('--host', default=SERVER_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=SERVER_CONFIG['port'])
+    args = parser.parse_args()
+    SERVER_CONFIG['host'], SERVER_CONFIG['port'] = args.host, args.port
+
+    create_app()
+    solar_server.print_banner()
+    socketio.run(app, host=args.host, port=args.port, log_output=False)
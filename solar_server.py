@@ -1,24 +1,95 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from flask_socketio import SocketIO
+from flask import (Flask, render_template, request, jsonify, session, redirect, url_for,
+                   Response, stream_with_context)
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 import threading
 import time
 import sqlite3
-import requests
 import json
-from datetime import datetime, timedelta
+import queue
+import atexit
+import calendar
+import csv
+import io
+import zlib
+import sys
+import socket
+from datetime import datetime, timedelta, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
+from collections import deque
+import heapq
+import itertools
 import os
+import re
+from database import ConnectionPool, cooperative_offload
+from rollups import (create_rollup_tables, apply_rollups, rebuild_rollups, rollups_empty,
+                     rollup_table, pick_level, bucket_start)
+from downsample import downsample, iter_cursor, METHODS as DOWNSAMPLE_METHODS
+from response_cache import ResponseCache
+from retention import RetentionPolicy, run_retention
+from archive import ColumnarArchive, ARCHIVE_COLUMNS
+from energy import create_energy_table, EnergyAccumulator
+from weather_client import WeatherClient
+from notifier import SlackNotifier, create_outbox_table
+from scheduler import Scheduler, create_scheduler_table
+from alert_engine import AlertRule, AlertEngine
+from live_broadcaster import LiveBroadcaster
+from auth_cache import AccountCache
+from day_index import create_day_index_table, apply_day_index, rebuild_day_index, day_index_empty
+from telemetry_codec import (decode_packet, encode_frame, parse_frames,
+                             FRAME_TELEMETRY, FRAME_COMMAND, FRAME_PING)
+
+# ================== SERVER CONFIGURATION ==================
+# async_mode phải cố định trước khi tạo SocketIO: 'threading' khi chạy
+# python solar_server.py (Werkzeug dev server), 'gevent' khi chạy python serve.py
+# (monkey patch trước khi import module này)
+SERVER_CONFIG = {
+    'host': '0.0.0.0',
+    'port': 5000,
+    'async_mode': os.environ.get('SOLAR_ASYNC_MODE', 'threading')
+}
+
 app = Flask(__name__)
 app.secret_key = 'solar_tracker_secret_key_2024'
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SERVER_CONFIG['async_mode'])
 
 # ================== SLACK CONFIGURATION ==================
 SLACK_WEBHOOK_URL = "your url"  # #social
 SLACK_ALERT_WEBHOOK_URL = "your url"  # #cảnh-báo
 SLACK_CHANNEL = "#báo-cáo"
 SLACK_ALERT_CHANNEL = "#cảnh-báo"
+# Hàng đợi gửi Slack chạy nền (notifier.py)
+NOTIFY_CONFIG = {
+    'queue_size': 1000,
+    'timeout': 10,               # Timeout mỗi request webhook (giây)
+    'max_attempts': 8,           # Bỏ message sau số lần gửi lỗi này
+    'backoff_base': 2.0,         # Giây chờ lần retry đầu, nhân đôi mỗi lần (có jitter)
+    'backoff_max': 300.0,
+    'coalesce_window': 5.0,      # Gộp cảnh báo cùng loại trong cửa sổ này thành một message
+    'coalesce_max': 20,
+    'pool_size': 4
+}
 DB_PATH = 'dataa.db'
+DEFAULT_DEVICE_ID = 'default'   # Thiết bị của packet không có device_id (firmware cũ)
+
+# ================== DATABASE CONFIG ==================
+DB_CONFIG = {
+    'pool_size': 8,              # Số kết nối SQLite tối đa
+    'timeout': 10,               # Giây chờ kết nối rảnh / khóa database
+    'cached_statements': 256     # Số prepared statement cache mỗi kết nối
+}
+
+db_pool = ConnectionPool(
+    DB_PATH,
+    size=DB_CONFIG['pool_size'],
+    timeout=DB_CONFIG['timeout'],
+    cached_statements=DB_CONFIG['cached_statements'],
+    offload=cooperative_offload(DB_CONFIG['pool_size'])     # Chỉ bật khi chạy gevent
+)
+
+def get_db():
+    """Lấy kết nối database từ pool (conn.close() trả kết nối về pool)"""
+    return db_pool.connect()
 
 # ================== USER ROLES CONFIGURATION ==================
 USER_ROLES = {
@@ -44,12 +115,27 @@ USER_ROLES = {
     }
 }
 
+# Quyền của từng role dạng frozenset, tính một lần (kiểm tra quyền O(1))
+ROLE_PERMISSIONS = {role: frozenset(info['permissions']) for role, info in USER_ROLES.items()}
+
+def role_permissions(role):
+    """Tập quyền của role (role lạ = guest)"""
+    return ROLE_PERMISSIONS.get(role, ROLE_PERMISSIONS['guest'])
+
+AUTH_CONFIG = {
+    'account_ttl': 30            # Giây cache trạng thái tài khoản (sửa ngoài API có hiệu lực sau tối đa chừng này)
+}
+
 # ================== WEATHER API CONFIG ==================
 WEATHER_CONFIG = {
     'latitude': 10.8231,    # TP.HCM
     'longitude': 106.6297,  # TP.HCM
     'timezone': 'Asia/Ho_Chi_Minh',
-    'update_interval': 1800  # 30 phút
+    'update_interval': 1800, # 30 phút, cũng là TTL cache của weather_client
+    'max_stale': 6 * 3600,   # Upstream lỗi: vẫn dùng dữ liệu cũ tối đa 6 giờ
+    'timeout': 10,
+    'backoff_base': 30,      # Giây chờ sau lần lỗi đầu, nhân đôi mỗi lần lỗi
+    'backoff_max': 1800
 }
 
 # ================== ALERT CONFIGURATION ==================
@@ -59,22 +145,150 @@ ALERT_CONFIG = {
     'no_power_threshold': 1.0,   # Cảnh báo khi không có công suất (W)
     'offline_threshold': 300,    # Cảnh báo khi PICO offline 5 phút
     'efficiency_low': 30,        # Cảnh báo hiệu suất thấp (%)
-    'check_interval': 60         # Kiểm tra cảnh báo mỗi 60 giây
+    'debounce': 6,               # Giây điều kiện phải kéo dài trước khi gửi (~2 packet)
+    'timer_tick': 1.0            # Độ phân giải timer wheel phát hiện offline (giây)
+}
+
+# ================== SCHEDULER CONFIGURATION ==================
+SCHEDULER_CONFIG = {
+    'workers': 4,                        # Thread pool chạy task (scheduler.py)
+    'daily_report_at': '18:00',          # Giờ địa phương
+    'daily_report_catch_up': 6 * 3600,   # Lỡ 18:00 (server tắt) vẫn gửi bù trong 6 giờ
+    'weather_broadcast_interval': 60,    # Gửi thời tiết mới nhất qua socket (giây)
+    'status_interval': 10                # Kiểm tra tracker mất kết nối (giây)
+}
+
+# ================== SOCKET BROADCAST CONFIGURATION ==================
+BROADCAST_CONFIG = {
+    'window': 0.25               # Gộp cập nhật realtime trong cửa sổ này, mỗi room tối đa một frame (giây)
+}
+
+# ================== DEVICE LINK CONFIGURATION ==================
+LINK_CONFIG = {
+    'enabled': True,
+    'host': '0.0.0.0',
+    'port': 5001,                # Cổng TCP cho kết nối lâu dài với PICO
+    'idle_timeout': 90           # Đóng kết nối nếu không nhận frame nào (giây)
+}
+
+# ================== COMMAND CONFIGURATION ==================
+COMMAND_CONFIG = {
+    'long_poll_max_wait': 25     # Thời gian giữ request /api/get-command?wait= tối đa (giây)
+}
+
+# ================== INGEST CONFIGURATION ==================
+INGEST_CONFIG = {
+    'queue_size': 10000,         # Số packet tối đa chờ ghi trong bộ nhớ
+    'batch_size': 200,           # Ghi ngay khi gom đủ số packet này
+    'flush_interval': 1.0,       # Hoặc sau tối đa số giây này (cũng là chu kỳ đóng cửa sổ gộp)
+    'max_batch_packets': 5000    # Số packet tối đa mỗi request /api/sensor-data/batch
+}
+
+# ================== AUDIT LOG CONFIGURATION ==================
+AUDIT_CONFIG = {
+    'queue_size': 5000,          # Sự kiện chờ ghi user_activity_log tối đa, đầy thì bỏ sự kiện mới
+    'batch_size': 200,           # Ghi ngay khi gom đủ số sự kiện này
+    'flush_interval': 1.0,       # Hoặc sau tối đa số giây này (cũng là chu kỳ đóng cửa sổ gộp)
+    'collapse_window': 60,       # Gộp sự kiện từ chối truy cập trùng (user, nội dung) trong cửa sổ này (giây)
+    'collapse_max_keys': 10000   # Số nhóm đang gộp tối đa
+}
+
+# Cấu hình biểu đồ
+CHART_CONFIG = {
+    'max_points': 2000,          # Giới hạn trên của ?points
+    'default_method': 'lttb',    # lttb | minmax
+    'oversample': 4,             # Đọc bảng rollup có ít nhất points x oversample bucket
+    'fetch_size': 2000           # Số dòng mỗi lần fetchmany
+}
+
+# ================== RETENTION CONFIGURATION ==================
+RETENTION_CONFIG = {
+    'enabled': True,
+    'dry_run': False,            # Chỉ báo cáo, không xóa
+    'interval': 3600,            # Giây giữa hai lần chạy (scheduler)
+    'raw_days': 30,              # sensor_data thô; dữ liệu cũ hơn còn trong bảng rollup
+    'rollup_days': {             # None = giữ mãi
+        '1min': 90,
+        '15min': 365,
+        'hour': 1095,
+        'day': None
+    },
+    'weather_days': 90,
+    'alerts_days': 180,
+    'activity_days': 365,
+    'batch_size': 2000,          # Số dòng mỗi transaction xóa
+    'batch_pause': 0.05,         # Nghỉ giữa các lô để ingest lấy được lock ghi
+    'max_rows_per_run': 200000,
+    'vacuum_pages': 5000         # Số trang tối đa trả về mỗi lần incremental_vacuum
+}
+
+# ================== EXPORT CONFIGURATION ==================
+EXPORT_CONFIG = {
+    'chunk_size': 5000,          # Số dòng mỗi chunk HTTP
+    'page_seconds': 3600,        # Mỗi trang đọc sensor_data là một truy vấn ngắn trên khoảng thời gian này
+    'gzip_level': 6
+}
+
+# ================== ENERGY CONFIGURATION ==================
+ENERGY_CONFIG = {
+    'max_gap': 30                # Giây; khoảng dài hơn giữa hai mẫu coi là mất dữ liệu
+}
+
+# ================== ARCHIVE CONFIGURATION ==================
+ARCHIVE_CONFIG = {
+    'enabled': True,             # Xuất ngày đã đóng ra file cột (archive.py) trước khi retention xóa
+    'path': 'archive'
 }
 
-# Biến lưu trạng thái cảnh báo đã gửi
-alert_states = {
-    'battery_low_sent': False,
-    'battery_critical_sent': False,
-    'pico_offline_sent': False,
-    'no_power_sent': False,
-    'low_efficiency_sent': False
+# ================== RESPONSE CACHE CONFIGURATION ==================
+CACHE_CONFIG = {
+    'max_bytes': 8 * 1024 * 1024,    # Tổng dung lượng body được cache
+    'max_entries': 1000,
+    'ttl': {                          # Giây; dữ liệu mới vẫn invalidate ngay theo tag
+        'history_chart': 60,
+        'daily_chart': 3600,
+        'available_dates': 3600,
+        'daily_report': 300,
+        'alerts_count': 30            # Các bộ đếm 24h/1h trôi theo thời gian
+    }
 }
 
+# Luật cảnh báo, đánh giá trên từng packet (alert_engine.py)
+ALERT_RULES = [
+    AlertRule('battery_critical', 'PIN YẾU KHẨN CẤP', 'critical',
+              'battery_soc', '<', ALERT_CONFIG['battery_critical'], clear=ALERT_CONFIG['battery_critical'] + 5,
+              debounce=ALERT_CONFIG['debounce'],
+              message="⚠️ PIN YẾU KHẨN CẤP: {battery_soc:.1f}%",
+              fields={"Mức pin": "{battery_soc:.1f}%", "Trạng thái": "KHẨN CẤP"},
+              activates=('battery_low',)),    # Không gửi thêm cảnh báo pin yếu
+    AlertRule('battery_low', 'PIN YẾU', 'warning',
+              'battery_soc', '<', ALERT_CONFIG['battery_low'], clear=ALERT_CONFIG['battery_low'] + 5,
+              debounce=ALERT_CONFIG['debounce'],
+              message="🔋 PIN YẾU: {battery_soc:.1f}%",
+              fields={"Mức pin": "{battery_soc:.1f}%", "Ngưỡng": "{threshold}%"}),
+    AlertRule('no_power', 'KHÔNG CÓ CÔNG SUẤT', 'warning',
+              'power', '<', ALERT_CONFIG['no_power_threshold'],
+              debounce=ALERT_CONFIG['debounce'],
+              message="⚡ KHÔNG CÓ CÔNG SUẤT: {power:.1f}W",
+              fields={"Công suất": "{power:.1f}W", "Ngưỡng": "{threshold}W"}),
+    AlertRule('low_efficiency', 'HIỆU SUẤT THẤP', 'warning',
+              'efficiency', '<', ALERT_CONFIG['efficiency_low'],
+              when={'power': ('>', 5)},       # Chỉ cảnh báo khi có công suất
+              debounce=ALERT_CONFIG['debounce'],
+              message="📉 HIỆU SUẤT THẤP: {efficiency:.1f}%",
+              fields={"Hiệu suất": "{efficiency:.1f}%", "Công suất": "{power:.1f}W", "Ngưỡng": "{threshold}%"}),
+]
+
+OFFLINE_RULE = AlertRule('pico_offline', 'PICO OFFLINE', 'critical',
+                         None, '>', ALERT_CONFIG['offline_threshold'],
+                         message="🔌 PICO OFFLINE: {offline_minutes} phút",
+                         fields={"Thời gian offline": "{offline_minutes} phút",
+                                 "Dữ liệu cuối": "{last_data_time}"})
+
 # ================== DATABASE SETUP ==================
 def init_db():
     """Khởi tạo database SQLite"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     # Bảng sensor data
@@ -88,9 +302,45 @@ def init_db():
                   battery_voltage REAL,
                   battery_soc REAL,
                   remaining_capacity_ah REAL,
-                  battery_capacity_ah REAL)
+                  battery_capacity_ah REAL,
+                  device_id TEXT DEFAULT 'default')
                ''')
     
+    # Migration: database cũ chưa có cột device_id
+    sensor_columns = [row[1] for row in c.execute('PRAGMA table_info(sensor_data)')]
+    if 'device_id' not in sensor_columns:
+        c.execute(f"ALTER TABLE sensor_data ADD COLUMN device_id TEXT DEFAULT '{DEFAULT_DEVICE_ID}'")
+    
+    # Index cho truy vấn theo khoảng thời gian: phủ (covering) các cột biểu đồ/báo cáo
+    # để truy vấn chỉ đọc index, không phải quay lại bảng
+    c.execute('DROP INDEX IF EXISTS idx_sensor_data_device_ts')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_sensor_data_ts_cover
+                 ON sensor_data(timestamp, current, voltage, power, efficiency,
+                                battery_voltage, battery_soc)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_sensor_data_device_ts_cover
+                 ON sensor_data(device_id, timestamp, current, voltage, power, efficiency,
+                                battery_voltage, battery_soc)''')
+    
+    # Bảng rollup 1min/15min/hour/day cho biểu đồ và báo cáo
+    create_rollup_tables(c)
+    # Năng lượng theo ngày tích lũy lúc ghi (energy.py)
+    create_energy_table(c)
+    # Danh sách ngày có dữ liệu (day_index.py)
+    create_day_index_table(c)
+    # Message Slack chưa gửi được (notifier.py)
+    create_outbox_table(c)
+    # Lần chạy cuối của task theo giờ (scheduler.py)
+    create_scheduler_table(c)
+    
+    # Bảng devices - danh sách tracker đã từng gửi dữ liệu
+    c.execute('''CREATE TABLE IF NOT EXISTS devices
+                 (device_id TEXT PRIMARY KEY,
+                  first_seen DATETIME,
+                  last_seen DATETIME)''')
+    c.execute('''INSERT OR IGNORE INTO devices (device_id, first_seen, last_seen)
+                 SELECT device_id, MIN(timestamp), MAX(timestamp)
+                 FROM sensor_data GROUP BY device_id''')
+    
     # Bảng weather data
     c.execute('''CREATE TABLE IF NOT EXISTS weather_data
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -105,6 +355,7 @@ def init_db():
                   is_day BOOLEAN,
                   forecast_json TEXT)
                ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_weather_data_ts ON weather_data(timestamp)')
     
     # Bảng alerts log
     c.execute('''CREATE TABLE IF NOT EXISTS alerts_log
@@ -117,6 +368,7 @@ def init_db():
                   acknowledged_by TEXT,
                   acknowledged_at DATETIME)
                ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_alerts_log_ts ON alerts_log(timestamp)')
     
     # Bảng users - UPDATED với thêm trường role
     c.execute('''CREATE TABLE IF NOT EXISTS users
@@ -175,11 +427,357 @@ def init_db():
                   user_agent TEXT,
                   timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                   FOREIGN KEY (user_id) REFERENCES users(id))''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_user_activity_log_ts ON user_activity_log(timestamp)')
     
     conn.commit()
+    
+    if c.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        print("⚠️ auto_vacuum chưa là INCREMENTAL, chạy 'python solar_server.py --vacuum' một lần để retention trả lại dung lượng")
+    
+    # Database cũ chưa có rollup: dựng lại từ dữ liệu thô
+    if rollups_empty(conn) and c.execute('SELECT 1 FROM sensor_data LIMIT 1').fetchone():
+        print(f"🔄 Rebuilding rollups: {rebuild_rollups(conn)} buckets")
+    if (c.execute('SELECT 1 FROM daily_energy LIMIT 1').fetchone() is None
+            and c.execute('SELECT 1 FROM sensor_data LIMIT 1').fetchone()):
+        print(f"🔄 Rebuilding daily energy: {energy_accumulator.rebuild(conn)} days")
+    energy_accumulator.load(conn)
+    load_weather_snapshot(conn)
+    if day_index_empty(conn) and not rollups_empty(conn):
+        print(f"🔄 Rebuilding day index: {rebuild_day_index(conn)} days")
+    
+    for name, detail in find_table_scans(conn):
+        print(f"⚠️ Query plan: {name} quét toàn bảng ({detail})")
     conn.close()
     print("✅ Database initialized with role-based user management")
 
+# ================== HOT QUERIES ==================
+# Timestamp lưu dạng chuỗi UTC 'YYYY-MM-DD HH:MM:SS': so sánh khoảng trực tiếp trên cột
+# (không bọc date()/datetime()) để SQLite dùng được index
+
+HISTORY_CHART_SQL = '''SELECT 
+                 datetime(timestamp, 'localtime') as local_time,
+                 current, voltage, power, efficiency, battery_voltage, battery_soc,
+                 CAST(strftime('%s', timestamp) AS INTEGER) as epoch
+                 FROM sensor_data 
+                 WHERE timestamp >= ?{device_sql}
+                 ORDER BY timestamp ASC'''
+
+DAY_CHART_SQL = '''SELECT 
+                 datetime(timestamp, 'localtime') as local_time,
+                 current, voltage, power, efficiency, battery_voltage, battery_soc,
+                 CAST(strftime('%s', timestamp) AS INTEGER) as epoch
+                 FROM sensor_data 
+                 WHERE timestamp >= ? AND timestamp < ?{device_sql}
+                 ORDER BY timestamp ASC'''
+
+# Bảng rollup (xem rollups.py): trung bình của bucket = sum / count,
+# gộp các tracker trong cùng bucket khi không lọc theo device
+ROLLUP_HISTORY_CHART_SQL = '''SELECT 
+                 datetime(bucket, 'localtime') as local_time,
+                 SUM(current_sum) / SUM(count), SUM(voltage_sum) / SUM(count),
+                 SUM(power_sum) / SUM(count), SUM(efficiency_sum) / SUM(count),
+                 SUM(battery_voltage_sum) / SUM(count), SUM(battery_soc_sum) / SUM(count),
+                 CAST(strftime('%s', bucket) AS INTEGER) as epoch
+                 FROM {table} 
+                 WHERE bucket >= ?{device_sql}
+                 GROUP BY bucket
+                 ORDER BY bucket ASC'''
+
+ROLLUP_DAY_CHART_SQL = '''SELECT 
+                 datetime(bucket, 'localtime') as local_time,
+                 SUM(current_sum) / SUM(count), SUM(voltage_sum) / SUM(count),
+                 SUM(power_sum) / SUM(count), SUM(efficiency_sum) / SUM(count),
+                 SUM(battery_voltage_sum) / SUM(count), SUM(battery_soc_sum) / SUM(count),
+                 CAST(strftime('%s', bucket) AS INTEGER) as epoch
+                 FROM {table} 
+                 WHERE bucket >= ? AND bucket < ?{device_sql}
+                 GROUP BY bucket
+                 ORDER BY bucket ASC'''
+
+DAILY_STATS_SQL = '''SELECT 
+                 MAX(power_max) as max_power,
+                 SUM(power_sum) / SUM(count) as avg_power,
+                 (SELECT COALESCE(SUM(energy_wh), 0) FROM daily_energy
+                  WHERE day = ?{device_sql}) as total_energy,
+                 SUM(efficiency_sum) / SUM(count) as avg_efficiency,
+                 SUM(battery_soc_sum) / SUM(count) as avg_battery_soc,
+                 COALESCE(SUM(count), 0) as data_points
+                 FROM sensor_rollup_day 
+                 WHERE bucket = ?{device_sql}'''
+
+AVAILABLE_DATES_SQL = '''SELECT DISTINCT day FROM data_days{device_sql}
+                 ORDER BY day DESC'''
+
+# Độ phủ theo ngày: số mẫu, mẫu đầu/cuối, số lần mất dữ liệu (daily_energy.gaps)
+DAY_COVERAGE_SQL = '''SELECT d.day, SUM(d.samples), MIN(d.first_ts), MAX(d.last_ts),
+                 COALESCE(SUM(e.gaps), 0)
+                 FROM data_days d
+                 LEFT JOIN daily_energy e ON e.device_id = d.device_id AND e.day = d.day{device_sql}
+                 GROUP BY d.day
+                 ORDER BY d.day DESC'''
+
+LATEST_WEATHER_SQL = '''SELECT temperature, humidity, wind_speed, cloud_cover, 
+                 weather_code, sunrise, sunset, is_day, timestamp, forecast_json 
+                 FROM weather_data 
+                 ORDER BY timestamp DESC LIMIT 1'''
+
+# Các truy vấn nóng cần luôn đi qua index: (tên, SQL, tham số mẫu)
+HOT_QUERIES = [
+    ('history_chart', HISTORY_CHART_SQL.format(device_sql=''), ('2024-01-01 00:00:00',)),
+    ('history_chart_device', HISTORY_CHART_SQL.format(device_sql=' AND device_id = ?'),
+     ('2024-01-01 00:00:00', 'default')),
+    ('day_chart', DAY_CHART_SQL.format(device_sql=''), ('2024-01-01', '2024-01-02')),
+    ('day_chart_device', DAY_CHART_SQL.format(device_sql=' AND device_id = ?'),
+     ('2024-01-01', '2024-01-02', 'default')),
+    ('rollup_history_chart', ROLLUP_HISTORY_CHART_SQL.format(table='sensor_rollup_hour', device_sql=''),
+     ('2024-01-01 00:00:00',)),
+    ('rollup_history_chart_device',
+     ROLLUP_HISTORY_CHART_SQL.format(table='sensor_rollup_hour', device_sql=' AND device_id = ?'),
+     ('2024-01-01 00:00:00', 'default')),
+    ('rollup_day_chart', ROLLUP_DAY_CHART_SQL.format(table='sensor_rollup_hour', device_sql=''),
+     ('2024-01-01', '2024-01-02')),
+    ('rollup_day_chart_device',
+     ROLLUP_DAY_CHART_SQL.format(table='sensor_rollup_hour', device_sql=' AND device_id = ?'),
+     ('2024-01-01', '2024-01-02', 'default')),
+    ('daily_stats', DAILY_STATS_SQL.format(device_sql=''), ('2024-01-01', '2024-01-01 00:00:00')),
+    ('daily_stats_device', DAILY_STATS_SQL.format(device_sql=' AND device_id = ?'),
+     ('2024-01-01', 'default', '2024-01-01 00:00:00', 'default')),
+    ('available_dates', AVAILABLE_DATES_SQL.format(device_sql=''), ()),
+    ('available_dates_device', AVAILABLE_DATES_SQL.format(device_sql=' WHERE device_id = ?'), ('default',)),
+    ('day_coverage_device', DAY_COVERAGE_SQL.format(device_sql=' WHERE d.device_id = ?'), ('default',)),
+    ('latest_weather', LATEST_WEATHER_SQL, ()),
+    ('alerts_since', "SELECT COUNT(*) FROM alerts_log WHERE timestamp > datetime('now', '-24 hours')", ()),
+]
+
+def day_bounds(date_str):
+    """Khoảng [đầu ngày, đầu ngày sau) thay cho date(timestamp) = ?, ValueError nếu sai định dạng"""
+    day = datetime.strptime(date_str, '%Y-%m-%d')
+    return (day.strftime('%Y-%m-%d %H:%M:%S'),
+            (day + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S'))
+
+def utc_now():
+    """Thời điểm UTC hiện tại, naive như giá trị datetime.strptime() của cột timestamp"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def utc_cutoff(**delta):
+    """Mốc UTC cách hiện tại một khoảng, cùng định dạng cột timestamp"""
+    return (utc_now() - timedelta(**delta)).strftime('%Y-%m-%d %H:%M:%S')
+
+def chart_points_args(default_points):
+    """Đọc ?points và ?method, trả về (points, method), ValueError nếu method sai"""
+    points = request.args.get('points', default_points, type=int)
+    points = max(3, min(points, CHART_CONFIG['max_points']))
+    method = request.args.get('method', CHART_CONFIG['default_method'])
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(method)
+    return points, method
+
+def query_chart_rows(c, start, end, points, method, device_id=None):
+    """Truy vấn biểu đồ trong [start, end) (end=None: tới hiện tại) rồi giảm còn tối đa points dòng
+
+    Đọc bảng rollup thô nhất vẫn đủ chi tiết cho points, dữ liệu thô nếu cửa sổ quá ngắn.
+    Dòng được stream từ cursor qua bộ giảm điểm (downsample.py), không fetchall.
+    """
+    device_sql, device_params = device_clause(device_id)
+    window_end = datetime.strptime(end, '%Y-%m-%d %H:%M:%S') if end else utc_now()
+    window = (window_end - datetime.strptime(start, '%Y-%m-%d %H:%M:%S')).total_seconds()
+    level = pick_level(window, points * CHART_CONFIG['oversample'])
+    if level is None:
+        rows = iter_raw_chart_rows(c, start, end, device_id)
+    else:
+        if end:
+            c.execute(ROLLUP_DAY_CHART_SQL.format(table=rollup_table(level), device_sql=device_sql),
+                      (bucket_start(start, level), end) + device_params)
+        else:
+            c.execute(ROLLUP_HISTORY_CHART_SQL.format(table=rollup_table(level), device_sql=device_sql),
+                      (bucket_start(start, level),) + device_params)
+        rows = iter_cursor(c, CHART_CONFIG['fetch_size'])
+    # Cột cuối là epoch (x), chọn điểm theo power (cột 3)
+    selected = downsample(rows, points, calendar.timegm(window_end.timetuple()), 7, 3, method)
+    # Dòng đọc từ file lưu trữ chưa có nhãn thời gian: chỉ tạo cho các điểm được giữ lại
+    return [row if row[0] is not None else
+            (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row[7])),) + row[1:]
+            for row in selected]
+
+def iter_raw_chart_rows(c, start, end, device_id=None):
+    """Dòng thô trong [start, end): ngày đã lưu trữ đọc từ file cột (mmap), còn lại từ SQLite"""
+    device_sql, device_params = device_clause(device_id)
+    
+    def sqlite_rows(seg_start, seg_end):
+        if seg_end:
+            c.execute(DAY_CHART_SQL.format(device_sql=device_sql), (seg_start, seg_end) + device_params)
+        else:
+            c.execute(HISTORY_CHART_SQL.format(device_sql=device_sql), (seg_start,) + device_params)
+        return iter_cursor(c, CHART_CONFIG['fetch_size'])
+    
+    segment_start = start
+    for day in utc_days(start, end):
+        day_start, day_end = day_bounds(day)
+        if not archived_day(c, device_id, day):
+            continue
+        if segment_start < day_start:
+            yield from sqlite_rows(segment_start, day_start)
+        days = archive.open_days(device_id, day)
+        try:
+            lo = utc_epoch(max(start, day_start))
+            hi = utc_epoch(min(end, day_end) if end else day_end)
+            yield from heapq.merge(*(d.iter_rows(lo, hi) for d in days), key=lambda row: row[7])
+        finally:
+            for d in days:
+                d.close()
+        segment_start = day_end
+    if end is None or segment_start < end:
+        yield from sqlite_rows(segment_start, end)
+
+def utc_epoch(timestamp):
+    return calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+
+# ================== COLUMNAR ARCHIVE ==================
+archive = ColumnarArchive(ARCHIVE_CONFIG['path'])
+# Xuất file ngày và gộp dòng đến muộn không chạy xen nhau: dòng muộn hoặc đã nằm
+# trong dữ liệu thô lúc xuất, hoặc được gộp vào file sau khi xuất xong
+archive_lock = threading.Lock()
+
+def archived_day(c, device_id, day):
+    """Ngày đã đóng và mọi tracker có dữ liệu ngày đó (hoặc tracker device_id) đã có file lưu trữ"""
+    if not ARCHIVE_CONFIG['enabled'] or day >= utc_now().strftime('%Y-%m-%d'):
+        return False
+    if device_id:
+        return archive.has_day(device_id, day)
+    c.execute('SELECT device_id FROM sensor_rollup_day WHERE bucket = ?', (day + ' 00:00:00',))
+    devices = [row[0] for row in c.fetchall()]
+    return bool(devices) and all(archive.has_day(d, day) for d in devices)
+
+def pending_archive_days(conn):
+    """[(device_id, ngày)] đã đóng, còn dữ liệu thô nhưng chưa có file lưu trữ"""
+    oldest = conn.execute('SELECT MIN(timestamp) FROM sensor_data').fetchone()[0]
+    if oldest is None:
+        return []
+    rows = conn.execute('SELECT device_id, substr(bucket, 1, 10) FROM sensor_rollup_day '
+                        'WHERE bucket >= ? AND bucket < ? ORDER BY bucket',
+                        (oldest[:10] + ' 00:00:00', utc_now().strftime('%Y-%m-%d 00:00:00'))).fetchall()
+    return [(device_id, day) for device_id, day in rows if not archive.has_day(device_id, day)]
+
+def archive_closed_days():
+    """Xuất các ngày đã đóng chưa lưu trữ ra file cột, trả về số file đã ghi"""
+    conn = get_db()
+    written = 0
+    try:
+        for device_id, day in pending_archive_days(conn):
+            with archive_lock:
+                if archive.has_day(device_id, day):
+                    continue
+                rows = archive.write_day(conn, device_id, day, day_bounds(day))
+            if rows:
+                written += 1
+                print(f"🗄️ Archived {device_id} {day}: {rows} rows")
+    finally:
+        conn.close()
+    return written
+
+def merge_late_archive_rows(rows):
+    """Dữ liệu đến muộn cho ngày đã lưu trữ: gộp vào file ngày (không xuất lại từ SQLite
+    vì dữ liệu thô của ngày đó có thể đã bị retention dọn). Gọi khi giữ archive_lock"""
+    today = utc_now().strftime('%Y-%m-%d')
+    indexes = [SENSOR_COLUMNS.index(name) for name, _ in ARCHIVE_COLUMNS[:-1]]
+    late = {}
+    for row in rows:
+        if row[0][:10] < today:
+            late.setdefault((row[1], row[0][:10]), []).append(
+                tuple(row[i] for i in indexes) + (utc_epoch(row[0]),))
+    for (device_id, day), day_rows in late.items():
+        if archive.merge_rows(device_id, day, day_rows):
+            print(f"🗄️ Archive {device_id} {day}: merged {len(day_rows)} late rows")
+
+# Bảng lớn: truy vấn phải tìm qua index (SEARCH ... INDEX), mọi bước SCAN đều là lỗi,
+# kể cả quét hết một covering index (vd. WHERE date(timestamp) = ?)
+LARGE_TABLES = ('sensor_data',)
+
+def plan_problems(sql, details):
+    """Các bước plan không đạt của một truy vấn (details: cột detail của EXPLAIN QUERY PLAN)"""
+    problems = []
+    for detail in details:
+        words = detail.split()
+        if words[0] != 'SCAN' or 'CONSTANT ROW' in detail:
+            continue
+        if words[1] in LARGE_TABLES or 'INDEX' not in detail:
+            problems.append(detail)
+    for table in LARGE_TABLES:
+        if re.search(rf'\b{table}\b', sql) and not any(
+                detail.startswith(f'SEARCH {table} ') and ('INDEX' in detail or 'PRIMARY KEY' in detail)
+                for detail in details):
+            problems.append(f'no index SEARCH on {table}')
+    return problems
+
+def find_table_scans(conn, queries=None):
+    """EXPLAIN QUERY PLAN các truy vấn nóng, trả về [(tên, bước plan)] không dùng index"""
+    scans = []
+    for name, sql, params in HOT_QUERIES if queries is None else queries:
+        details = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        scans.extend((name, problem) for problem in plan_problems(sql, details))
+    return scans
+
+def retention_policies():
+    """Danh sách RetentionPolicy theo RETENTION_CONFIG"""
+    # Mốc cắt tròn đầu ngày UTC: ngày cũ nhất còn dữ liệu thô luôn đầy đủ,
+    # rebuild_rollups() từ dữ liệu thô không làm hỏng bucket ngày đó
+    def cutoff(days):
+        return utc_cutoff(days=days)[:10] + ' 00:00:00'
+    
+    raw_cutoff = cutoff(RETENTION_CONFIG['raw_days'])
+    if ARCHIVE_CONFIG['enabled']:
+        # Không xóa dữ liệu thô của ngày chưa được lưu trữ
+        conn = get_db()
+        try:
+            pending = pending_archive_days(conn)
+        finally:
+            conn.close()
+        if pending:
+            raw_cutoff = min(raw_cutoff, pending[0][1] + ' 00:00:00')
+    
+    policies = [
+        RetentionPolicy('sensor_data', 'timestamp', raw_cutoff),
+        RetentionPolicy('weather_data', 'timestamp', cutoff(RETENTION_CONFIG['weather_days'])),
+        RetentionPolicy('alerts_log', 'timestamp', cutoff(RETENTION_CONFIG['alerts_days'])),
+        RetentionPolicy('user_activity_log', 'timestamp', cutoff(RETENTION_CONFIG['activity_days']))
+    ]
+    for level, days in RETENTION_CONFIG['rollup_days'].items():
+        if days is not None:
+            policies.append(RetentionPolicy(rollup_table(level), 'bucket', cutoff(days), ('device_id', 'bucket')))
+    return policies
+
+retention_stats = {'runs': 0, 'last_run': None, 'last_report': None}
+
+def apply_retention(dry_run=None):
+    """Chạy retention, trả về báo cáo (dry_run=None: theo RETENTION_CONFIG)"""
+    if dry_run is None:
+        dry_run = RETENTION_CONFIG['dry_run']
+    report = run_retention(get_db, retention_policies(), dry_run,
+                           RETENTION_CONFIG['batch_size'], RETENTION_CONFIG['batch_pause'],
+                           RETENTION_CONFIG['max_rows_per_run'], RETENTION_CONFIG['vacuum_pages'])
+    if not dry_run:
+        retention_stats['runs'] += 1
+        retention_stats['last_run'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        retention_stats['last_report'] = report
+        if report['deleted']:
+            # Dữ liệu ngày cũ thay đổi: không cần invalidate chi tiết theo tag
+            response_cache.clear()
+            print(f"🧹 Retention: xóa {report['deleted']} dòng, trả lại {report['vacuumed_bytes']} bytes")
+    return report
+
+def check_query_plans():
+    """In kết quả kiểm tra plan, trả về True nếu không truy vấn nóng nào quét toàn bảng"""
+    conn = get_db()
+    try:
+        scans = find_table_scans(conn)
+    finally:
+        conn.close()
+    for name, detail in scans:
+        print(f"❌ Query plan regression: {name} -> {detail}")
+    if not scans:
+        print(f"✅ Query plans OK ({len(HOT_QUERIES)} hot queries use indexes)")
+    return not scans
+
 # ================== PERMISSION DECORATORS ==================
 def permission_required(permission):
     """Decorator kiểm tra quyền truy cập"""
@@ -189,10 +787,7 @@ def permission_required(permission):
             if 'user_id' not in session:
                 return redirect(url_for('login'))
             
-            user_role = session.get('role', 'guest')
-            user_permissions = USER_ROLES.get(user_role, USER_ROLES['guest'])['permissions']
-            
-            if permission not in user_permissions:
+            if permission not in role_permissions(session.get('role', 'guest')):
                 # Log unauthorized access attempt
                 log_user_activity(
                     session.get('user_id'),
@@ -253,28 +848,148 @@ def role_required(min_role_level):
         return decorated_function
     return decorator
 
+# ================== RESPONSE CACHE ==================
+# Tag: 'sensor:<device|*>:<ngày UTC>' cho dữ liệu cảm biến của một ngày,
+# 'dates:<device|*>' cho danh sách ngày, 'alerts' cho alerts_log
+response_cache = ResponseCache(CACHE_CONFIG['max_bytes'], CACHE_CONFIG['max_entries'])
+known_data_days = set()   # (device_id, ngày) đã có dữ liệu, để biết khi nào danh sách ngày đổi
+
+def utc_days(start, end=None):
+    """Các ngày 'YYYY-MM-DD' trong [start, end] (chuỗi timestamp UTC, end=None: hiện tại)"""
+    day = datetime.strptime(start[:10], '%Y-%m-%d')
+    last = end[:10] if end else utc_now().strftime('%Y-%m-%d')
+    days = []
+    while day.strftime('%Y-%m-%d') <= last:
+        days.append(day.strftime('%Y-%m-%d'))
+        day += timedelta(days=1)
+    return days
+
+def sensor_cache_tags(device_id, days):
+    return [f'sensor:{device_id or "*"}:{day}' for day in days]
+
+def invalidate_sensor_cache(rows):
+    """Invalidate các response phụ thuộc vào ngày/tracker của lô vừa ghi"""
+    tags = set()
+    for row in rows:
+        device_id, day = row[1], row[0][:10]
+        tags.add(f'sensor:{device_id}:{day}')
+        tags.add(f'sensor:*:{day}')
+        if (device_id, day) not in known_data_days:
+            known_data_days.add((device_id, day))
+            tags.add(f'dates:{device_id}')
+            tags.add('dates:*')
+    response_cache.invalidate(*tags)
+
+def cached_response(endpoint, tags_func):
+    """Decorator cache body JSON của route theo (endpoint, query string đã chuẩn hóa)
+
+    Đặt sau login_required/permission_required để vẫn kiểm tra quyền mỗi request.
+    Chỉ cache response 200.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            params = tuple(sorted((k, v) for k, v in request.args.items(multi=True) if v != ''))
+            key = (endpoint, params)
+            body = response_cache.get(endpoint, key)
+            if body is not None:
+                return app.response_class(body, mimetype='application/json')
+            
+            generation = response_cache.generation()
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response_cache.set(key, response.get_data(), tags_func(),
+                                   CACHE_CONFIG['ttl'].get(endpoint), generation)
+            return response
+        return decorated_function
+    return decorator
+
+def history_chart_tags():
+    hours = request.args.get('hours', 24, type=int)
+    return sensor_cache_tags(request.args.get('device'), utc_days(utc_cutoff(hours=hours)))
+
+def daily_chart_tags():
+    return sensor_cache_tags(request.args.get('device'),
+                             [request.args.get('date', datetime.now().strftime('%Y-%m-%d'))])
+
+def daily_report_tags():
+    return sensor_cache_tags(request.args.get('device'), [datetime.now().strftime('%Y-%m-%d')])
+
+def available_dates_tags():
+    tags = [f'dates:{request.args.get("device") or "*"}']
+    if request.args.get('detail'):
+        # Số mẫu / mẫu cuối của hôm nay đổi theo từng lô ghi
+        tags += sensor_cache_tags(request.args.get('device'), utc_days(utc_cutoff()))
+    return tags
+
 # ================== LOGGING FUNCTIONS ==================
+# Client gọi lại liên tục vào route bị từ chối: chỉ ghi sự kiện đầu tiên của mỗi
+# (user, loại, nội dung) trong collapse_window giây, số lần lặp lại được ghi khi hết cửa sổ
+COLLAPSED_ACTIVITIES = ('unauthorized_access', 'insufficient_role')
+audit_collapse = {}          # (user_id, loại, nội dung) -> [hạn cửa sổ, số lần gộp, username, ip, user_agent, epoch hết cửa sổ]
+audit_collapse_lock = threading.Lock()
+audit_stats = {'collapsed': 0}
+
+def activity_row(user_id, username, activity_type, description, ip_address, user_agent, at=None):
+    """Một dòng user_activity_log, timestamp UTC lúc xảy ra (at: epoch, mặc định bây giờ), không phải lúc ghi"""
+    return (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(at)), user_id, username, activity_type,
+            description, ip_address, user_agent)
+
+def sweep_collapsed_activity(now):
+    """Đóng các cửa sổ gộp đã hết hạn, trả về dòng tổng kết (timestamp lúc hết cửa sổ);
+    gọi khi đang giữ audit_collapse_lock"""
+    rows = []
+    # Cửa sổ cùng độ dài: thứ tự chèn của dict cũng là thứ tự hết hạn
+    while audit_collapse:
+        key = next(iter(audit_collapse))
+        entry = audit_collapse[key]
+        if entry[0] > now and len(audit_collapse) < AUDIT_CONFIG['collapse_max_keys']:
+            break
+        del audit_collapse[key]
+        if entry[1]:
+            user_id, activity_type, description = key
+            rows.append(activity_row(user_id, entry[2], activity_type,
+                                     f"{description} (lặp lại thêm {entry[1]} lần trong "
+                                     f"{AUDIT_CONFIG['collapse_window']}s)", entry[3], entry[4],
+                                     min(entry[5], time.time())))
+    return rows
+
+def sweep_expired_activity():
+    """Tick của audit_writer: đóng cửa sổ gộp hết hạn cả khi không có sự kiện mới"""
+    with audit_collapse_lock:
+        return sweep_collapsed_activity(time.monotonic())
+
 def log_user_activity(user_id, username, activity_type, description, ip_address, user_agent):
-    """Ghi log hoạt động của người dùng"""
+    """Đưa log hoạt động của người dùng vào hàng đợi ghi nền, False nếu hàng đợi đầy"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        c.execute('''INSERT INTO user_activity_log 
-                    (user_id, username, activity_type, description, ip_address, user_agent)
-                    VALUES (?, ?, ?, ?, ?, ?)''',
-                 (user_id, username, activity_type, description, ip_address, user_agent))
-        
-        conn.commit()
-        conn.close()
-        return True
+        if activity_type in COLLAPSED_ACTIVITIES:
+            key = (user_id, activity_type, description)
+            now = time.monotonic()
+            with audit_collapse_lock:
+                summaries = sweep_collapsed_activity(now)
+                entry = audit_collapse.get(key)
+                if entry is not None:
+                    entry[1] += 1
+                    audit_stats['collapsed'] += 1
+                else:
+                    audit_collapse[key] = [now + AUDIT_CONFIG['collapse_window'], 0,
+                                           username, ip_address, user_agent,
+                                           time.time() + AUDIT_CONFIG['collapse_window']]
+            for row in summaries:
+                audit_writer.put(row)
+            if entry is not None:
+                return True
+        return audit_writer.put(activity_row(user_id, username, activity_type, description,
+                                             ip_address, user_agent))
     except Exception as e:
         print(f"❌ Error logging user activity: {e}")
         return False
 
 # ================== SLACK INTEGRATION ==================
-def send_slack_message(webhook_url, channel, message, attachments=None, is_alert=False):
-    """Gửi message đến Slack"""
+slack_notifier = SlackNotifier(get_db, **NOTIFY_CONFIG)
+
+def send_slack_message(webhook_url, channel, message, attachments=None, is_alert=False, coalesce_key=None):
+    """Đưa message Slack vào hàng đợi gửi nền, False nếu hàng đợi đầy"""
     try:
         username = "🚨 Solar Tracker Alert Bot" if is_alert else "🌞 Solar Tracker Bot"
         icon_emoji = ":warning:" if is_alert else ":sunny:"
@@ -289,33 +1004,19 @@ def send_slack_message(webhook_url, channel, message, attachments=None, is_alert
         if attachments:
             payload["attachments"] = attachments
             
-        response = requests.post(
-            webhook_url,
-            data=json.dumps(payload),
-            headers={'Content-Type': 'application/json'},
-            timeout=10
-        )
-        return response.status_code == 200
+        return slack_notifier.enqueue(webhook_url, payload, coalesce_key)
     except Exception as e:
         print(f"❌ Slack error: {e}")
         return False
 
 def send_daily_slack_report():
     """Gửi báo cáo hàng ngày qua Slack"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     today = datetime.now().strftime('%Y-%m-%d')
     
-    c.execute('''SELECT 
-                 MAX(power) as max_power,
-                 AVG(power) as avg_power,
-                 SUM(power * 3 / 3600) as total_energy,
-                 AVG(efficiency) as avg_efficiency,
-                 AVG(battery_soc) as avg_battery_soc,
-                 COUNT(*) as data_points
-                 FROM sensor_data 
-                 WHERE date(timestamp) = ?''', (today,))
+    c.execute(DAILY_STATS_SQL.format(device_sql=''), (today, day_bounds(today)[0]))
     
     result = c.fetchone()
     conn.close()
@@ -340,10 +1041,10 @@ def send_daily_slack_report():
         
         success = send_slack_message(SLACK_WEBHOOK_URL, SLACK_CHANNEL, message, attachments)
         if success:
-            print("✅ Đã gửi báo cáo Slack")
+            print("✅ Đã đưa báo cáo Slack vào hàng đợi")
             return True
         else:
-            print("❌ Gửi báo cáo Slack thất bại")
+            print("❌ Hàng đợi Slack đầy, bỏ báo cáo")
             return False
     return False
 
@@ -381,15 +1082,16 @@ def send_alert_slack(message, alert_type, data=None, severity="warning"):
             SLACK_ALERT_CHANNEL, 
             message, 
             attachments, 
-            is_alert=True
+            is_alert=True,
+            coalesce_key=alert_type
         )
         
         if success:
-            # Lưu log cảnh báo vào database
+            # Lưu log cảnh báo vào database (notifier gửi lại nếu Slack lỗi tạm thời)
             save_alert_log(alert_type, message, severity, data)
-            print(f"✅ Đã gửi cảnh báo: {alert_type}")
+            print(f"✅ Đã đưa cảnh báo vào hàng đợi: {alert_type}")
         else:
-            print(f"❌ Gửi cảnh báo thất bại: {alert_type}")
+            print(f"❌ Hàng đợi Slack đầy, bỏ cảnh báo: {alert_type}")
             
         return success
     except Exception as e:
@@ -399,7 +1101,7 @@ def send_alert_slack(message, alert_type, data=None, severity="warning"):
 def save_alert_log(alert_type, message, severity, data=None):
     """Lưu log cảnh báo vào database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         
         data_json = json.dumps(data) if data else None
@@ -411,6 +1113,7 @@ def save_alert_log(alert_type, message, severity, data=None):
         
         conn.commit()
         conn.close()
+        response_cache.invalidate('alerts')
         return True
     except Exception as e:
         print(f"❌ Save alert log error: {e}")
@@ -418,68 +1121,76 @@ def save_alert_log(alert_type, message, severity, data=None):
 
 # ================== WEATHER FUNCTIONS ==================
 
-def get_weather_data_openmeteo():
-    """Lấy dữ liệu thời tiết từ Open-Meteo (MIỄN PHÍ)"""
-    try:
-        url = "https://api.open-meteo.com/v1/forecast"
-        
-        params = {
-            'latitude': WEATHER_CONFIG['latitude'],
-            'longitude': WEATHER_CONFIG['longitude'],
-            'timezone': WEATHER_CONFIG['timezone'],
-            'current_weather': 'true',
-            'hourly': 'temperature_2m,relative_humidity_2m,cloud_cover,wind_speed_10m',
-            'daily': 'sunrise,sunset',
-            'forecast_days': 1
+def parse_openmeteo(data):
+    """Chuyển payload Open-Meteo thành weather_data (độ ẩm / mây theo giờ hiện tại)"""
+    current = data.get('current_weather', {})
+    hourly = data.get('hourly', {})
+    daily = data.get('daily', {})
+    
+    # Tìm index của giờ hiện tại
+    current_hour_index = None
+    if 'time' in hourly:
+        current_hour = datetime.now().strftime('%H')
+        for i, time_str in enumerate(hourly['time']):
+            if time_str.startswith(datetime.now().strftime('%Y-%m-%dT')):
+                time_hour = time_str[11:13]
+                if time_hour == current_hour:
+                    current_hour_index = i
+                    break
+    
+    # Chuẩn bị weather data
+    weather_data = {
+        'temperature': current.get('temperature', 0),
+        'wind_speed': current.get('windspeed', 0),
+        'wind_direction': current.get('winddirection', 0),
+        'weather_code': current.get('weathercode', 0),
+        'is_day': current.get('is_day', 1) == 1,
+        'time': current.get('time', ''),
+        'humidity': hourly.get('relative_humidity_2m', [0])[current_hour_index] if current_hour_index is not None else 0,
+        'cloud_cover': hourly.get('cloud_cover', [0])[current_hour_index] if current_hour_index is not None else 0,
+        'sunrise': daily.get('sunrise', [''])[0] if daily.get('sunrise') else '',
+        'sunset': daily.get('sunset', [''])[0] if daily.get('sunset') else '',
+        'hourly_forecast': {
+            'times': hourly.get('time', [])[:24],
+            'temperatures': hourly.get('temperature_2m', [])[:24],
+            'humidities': hourly.get('relative_humidity_2m', [])[:24],
+            'clouds': hourly.get('cloud_cover', [])[:24],
+            'winds': hourly.get('wind_speed_10m', [])[:24]
         }
-        
-        response = requests.get(url, params=params, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            current = data.get('current_weather', {})
-            hourly = data.get('hourly', {})
-            daily = data.get('daily', {})
-            
-            # Tìm index của giờ hiện tại
-            current_hour_index = None
-            if 'time' in hourly:
-                current_hour = datetime.now().strftime('%H')
-                for i, time_str in enumerate(hourly['time']):
-                    if time_str.startswith(datetime.now().strftime('%Y-%m-%dT')):
-                        time_hour = time_str[11:13]
-                        if time_hour == current_hour:
-                            current_hour_index = i
-                            break
-            
-            # Chuẩn bị weather data
-            weather_data = {
-                'temperature': current.get('temperature', 0),
-                'wind_speed': current.get('windspeed', 0),
-                'wind_direction': current.get('winddirection', 0),
-                'weather_code': current.get('weathercode', 0),
-                'is_day': current.get('is_day', 1) == 1,
-                'time': current.get('time', ''),
-                'humidity': hourly.get('relative_humidity_2m', [0])[current_hour_index] if current_hour_index is not None else 0,
-                'cloud_cover': hourly.get('cloud_cover', [0])[current_hour_index] if current_hour_index is not None else 0,
-                'sunrise': daily.get('sunrise', [''])[0] if daily.get('sunrise') else '',
-                'sunset': daily.get('sunset', [''])[0] if daily.get('sunset') else '',
-                'hourly_forecast': {
-                    'times': hourly.get('time', [])[:24],
-                    'temperatures': hourly.get('temperature_2m', [])[:24],
-                    'humidities': hourly.get('relative_humidity_2m', [])[:24],
-                    'clouds': hourly.get('cloud_cover', [])[:24],
-                    'winds': hourly.get('wind_speed_10m', [])[:24]
-                }
-            }
-            
-            # Lưu vào database
-            save_weather_data(weather_data)
-            
-            print(f"🌤️  Weather updated: {weather_data['temperature']}°C, {weather_data['humidity']}%")
-            return weather_data
-            
+    }
+    return weather_data
+
+def on_weather_update(payload):
+    """weather_client nhận payload mới: lưu một dòng weather_data"""
+    weather_data = parse_openmeteo(payload)
+    save_weather_data(weather_data)
+    print(f"🌤️  Weather updated: {weather_data['temperature']}°C, {weather_data['humidity']}%")
+
+weather_client = WeatherClient(
+    "https://api.open-meteo.com/v1/forecast",
+    {
+        'latitude': WEATHER_CONFIG['latitude'],
+        'longitude': WEATHER_CONFIG['longitude'],
+        'timezone': WEATHER_CONFIG['timezone'],
+        'current_weather': 'true',
+        'hourly': 'temperature_2m,relative_humidity_2m,cloud_cover,wind_speed_10m',
+        'daily': 'sunrise,sunset',
+        'forecast_days': 1
+    },
+    ttl=WEATHER_CONFIG['update_interval'],
+    max_stale=WEATHER_CONFIG['max_stale'],
+    timeout=WEATHER_CONFIG['timeout'],
+    backoff_base=WEATHER_CONFIG['backoff_base'],
+    backoff_max=WEATHER_CONFIG['backoff_max'],
+    on_update=on_weather_update
+)
+
+def get_weather_data_openmeteo(force=False):
+    """Lấy dữ liệu thời tiết từ Open-Meteo (MIỄN PHÍ) qua cache của weather_client"""
+    try:
+        payload = weather_client.get(force=force)
+        if payload is not None:
+            return parse_openmeteo(payload)
     except Exception as e:
         print(f"❌ Weather API error: {e}")
     
@@ -498,14 +1209,16 @@ def get_weather_data_openmeteo():
 def save_weather_data(weather_data):
     """Lưu dữ liệu thời tiết vào database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         
+        timestamp = utc_now().strftime('%Y-%m-%d %H:%M:%S')
         c.execute('''INSERT INTO weather_data 
-                    (temperature, humidity, wind_speed, cloud_cover, 
+                    (timestamp, temperature, humidity, wind_speed, cloud_cover, 
                      weather_code, sunrise, sunset, is_day, forecast_json)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                 (weather_data['temperature'],
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                 (timestamp,
+                  weather_data['temperature'],
                   weather_data['humidity'],
                   weather_data['wind_speed'],
                   weather_data['cloud_cover'],
@@ -517,11 +1230,77 @@ def save_weather_data(weather_data):
         
         conn.commit()
         conn.close()
+        set_weather_snapshot(weather_data, timestamp)
         return True
     except Exception as e:
         print(f"❌ Save weather error: {e}")
         return False
 
+# Bản chụp thời tiết mới nhất, parse sẵn một lần khi lưu: dashboard, socket connect,
+# API và broadcast đọc từ đây thay vì truy vấn weather_data. Luôn thay nguyên dict
+# (gán tham chiếu là nguyên tử), người đọc lấy tham chiếu một lần rồi dùng
+weather_snapshot = None
+
+def format_forecast(forecast_data, hours=12):
+    """hourly_forecast (các list theo giờ) -> danh sách dự báo cho /api/weather/forecast"""
+    times = forecast_data.get('times', [])
+    temps = forecast_data.get('temperatures', [])
+    humids = forecast_data.get('humidities', [])
+    clouds = forecast_data.get('clouds', [])
+    winds = forecast_data.get('winds', [])
+    
+    formatted_forecast = []
+    for i in range(min(hours, len(times))):
+        time_str = times[i]
+        formatted_forecast.append({
+            'time': time_str[11:16] if 'T' in time_str else time_str,
+            'temperature': temps[i] if i < len(temps) else 0,
+            'humidity': humids[i] if i < len(humids) else 0,
+            'cloud_cover': clouds[i] if i < len(clouds) else 0,
+            'wind_speed': winds[i] if i < len(winds) else 0
+        })
+    return formatted_forecast
+
+def set_weather_snapshot(weather_data, last_update):
+    """Thay bản chụp bằng dữ liệu vừa lưu (last_update: timestamp UTC của dòng weather_data)"""
+    global weather_snapshot
+    code = weather_data.get('weather_code', 0)
+    is_day = bool(weather_data.get('is_day', True))
+    weather_snapshot = {
+        'current': {
+            'temperature': weather_data['temperature'],
+            'humidity': weather_data['humidity'],
+            'wind_speed': weather_data['wind_speed'],
+            'cloud_cover': weather_data['cloud_cover'],
+            'weather_code': code,
+            'sunrise': weather_data.get('sunrise', ''),
+            'sunset': weather_data.get('sunset', ''),
+            'is_day': is_day,
+            'last_update': last_update,
+            'description': get_weather_code_description(code),
+            'icon': get_weather_icon(code, is_day),
+            'source': 'database'
+        },
+        'forecast': format_forecast(weather_data.get('hourly_forecast') or {})
+    }
+
+def load_weather_snapshot(conn):
+    """Nạp bản chụp từ dòng weather_data mới nhất (khi khởi động)"""
+    row = conn.execute(LATEST_WEATHER_SQL).fetchone()
+    if row is None:
+        return
+    set_weather_snapshot({
+        'temperature': row[0],
+        'humidity': row[1],
+        'wind_speed': row[2],
+        'cloud_cover': row[3],
+        'weather_code': row[4],
+        'sunrise': row[5],
+        'sunset': row[6],
+        'is_day': row[7] == 1,
+        'hourly_forecast': json.loads(row[9]) if row[9] else {}
+    }, row[8])
+
 def get_weather_code_description(code):
     """Chuyển mã thời tiết thành mô tả"""
     weather_codes = {
@@ -555,137 +1334,57 @@ def get_weather_icon(code, is_day):
         return "🌈"
 
 # ================== ALERT FUNCTIONS ==================
-def check_alerts():
-    """Kiểm tra và gửi cảnh báo"""
+def notify_alert(device_id, alert):
+    """Gửi cảnh báo engine vừa bật (qua hàng đợi Slack, không chặn ingest)"""
+    message, data = alert['message'], alert['data']
+    if device_id != DEFAULT_DEVICE_ID:
+        message = f"[{device_id}] {message}"
+        data = dict(data, **{"Thiết bị": device_id})
+    send_alert_slack(message, alert['title'], data, alert['severity'])
+
+alert_engine = AlertEngine(ALERT_RULES, OFFLINE_RULE, notify_alert, ALERT_CONFIG['timer_tick'])
+
+def watch_known_devices():
+    """Đặt hẹn giờ offline cho các tracker đã biết (sau khởi động, mỗi tracker có đủ offline_threshold để gửi lại)"""
     try:
-        # Lấy dữ liệu mới nhất
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''SELECT battery_soc, power, efficiency, timestamp
-                     FROM sensor_data 
-                     ORDER BY timestamp DESC LIMIT 1''')
-        row = c.fetchone()
+        conn = get_db()
+        rows = conn.execute('SELECT device_id, last_seen FROM devices').fetchall()
         conn.close()
-        
-        if not row:
-            return
-        
-        battery_soc, power, efficiency, timestamp = row
-        
-        # Kiểm tra thời gian dữ liệu
-        data_time_utc = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-        
-        # Chuyển UTC sang timezone Việt Nam
-        # Vietnam timezone = UTC + 7
-        data_time_vn = data_time_utc + timedelta(hours=7, minutes=22)
-        current_time_vn = datetime.now()  # Server time (nên là VN time)
-        
-        # Tính thời gian offline với timezone VN
-        time_diff = (current_time_vn - data_time_vn).total_seconds()
-        
-        # 1. Cảnh báo pin yếu
-        if battery_soc < ALERT_CONFIG['battery_critical']:
-            if not alert_states['battery_critical_sent']:
-                message = f"⚠️ PIN YẾU KHẨN CẤP: {battery_soc:.1f}%"
-                send_alert_slack(
-                    message, 
-                    "PIN YẾU KHẨN CẤP",
-                    {"Mức pin": f"{battery_soc:.1f}%", "Trạng thái": "KHẨN CẤP"},
-                    "critical"
-                )
-                alert_states['battery_critical_sent'] = True
-                alert_states['battery_low_sent'] = True  # Đánh dấu cảnh báo thấp đã gửi
-        elif battery_soc < ALERT_CONFIG['battery_low']:
-            if not alert_states['battery_low_sent']:
-                message = f"🔋 PIN YẾU: {battery_soc:.1f}%"
-                send_alert_slack(
-                    message, 
-                    "PIN YẾU",
-                    {"Mức pin": f"{battery_soc:.1f}%", "Ngưỡng": f"{ALERT_CONFIG['battery_low']}%"},
-                    "warning"
-                )
-                alert_states['battery_low_sent'] = True
-        else:
-            # Reset trạng thái nếu pin đã sạc lại
-            if battery_soc > ALERT_CONFIG['battery_low'] + 5:
-                alert_states['battery_low_sent'] = False
-            if battery_soc > ALERT_CONFIG['battery_critical'] + 5:
-                alert_states['battery_critical_sent'] = False
-        
-        # 2. Cảnh báo không có công suất
-        if power < ALERT_CONFIG['no_power_threshold']:
-            if not alert_states['no_power_sent']:
-                message = f"⚡ KHÔNG CÓ CÔNG SUẤT: {power:.1f}W"
-                send_alert_slack(
-                    message, 
-                    "KHÔNG CÓ CÔNG SUẤT",
-                    {"Công suất": f"{power:.1f}W", "Ngưỡng": f"{ALERT_CONFIG['no_power_threshold']}W"},
-                    "warning"
-                )
-                alert_states['no_power_sent'] = True
-        else:
-            alert_states['no_power_sent'] = False
-        
-        # 3. Cảnh báo hiệu suất thấp
-        if efficiency < ALERT_CONFIG['efficiency_low'] and power > 5:  # Chỉ cảnh báo khi có công suất
-            if not alert_states['low_efficiency_sent']:
-                message = f"📉 HIỆU SUẤT THẤP: {efficiency:.1f}%"
-                send_alert_slack(
-                    message, 
-                    "HIỆU SUẤT THẤP",
-                    {"Hiệu suất": f"{efficiency:.1f}%", "Công suất": f"{power:.1f}W", "Ngưỡng": f"{ALERT_CONFIG['efficiency_low']}%"},
-                    "warning"
-                )
-                alert_states['low_efficiency_sent'] = True
-        else:
-            alert_states['low_efficiency_sent'] = False
-        
-        # 4. Cảnh báo PICO offline
-        if time_diff > ALERT_CONFIG['offline_threshold']:
-            if not alert_states['pico_offline_sent']:
-                # SỬA: Format thời gian cho dễ đọc
-                offline_minutes = int(time_diff / 60)
-                last_data_time = data_time_vn.strftime('%H:%M:%S %d/%m/%Y')
-                
-                message = f"🔌 PICO OFFLINE: {offline_minutes} phút"
-                send_alert_slack(
-                    message, 
-                    "PICO OFFLINE",
-                    {
-                        "Thời gian offline": f"{offline_minutes} phút", 
-                        "Dữ liệu cuối": last_data_time,
-                        "Giờ VN": f"{data_time_vn.hour:02d}:{data_time_vn.minute:02d}:{data_time_vn.second:02d}"
-                    },
-                    "critical"
-                )
-                alert_states['pico_offline_sent'] = True
-        else:
-            alert_states['pico_offline_sent'] = False
-            
     except Exception as e:
-        print(f"❌ Check alerts error: {e}")
+        print(f"❌ Watch devices error: {e}")
+        return
+    for device_id, last_seen in rows:
+        alert_engine.watch(device_id, utc_epoch(last_seen) if last_seen else None)
 
 # ================== AUTHENTICATION ==================
+def load_account_active(user_id):
+    """Tài khoản còn active không (False nếu user đã bị xóa)"""
+    conn = get_db()
+    try:
+        row = conn.execute('SELECT is_active FROM users WHERE id = ?', (user_id,)).fetchone()
+    finally:
+        conn.close()
+    return row is not None and bool(row[0])
+
+account_cache = AccountCache(load_account_active, AUTH_CONFIG['account_ttl'])
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
         
-        # Kiểm tra xem tài khoản còn active không
+        # Kiểm tra xem tài khoản còn active không (account_cache, update_user / delete_user invalidate ngay)
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute('SELECT is_active FROM users WHERE id = ?', (session.get('user_id'),))
-            result = c.fetchone()
-            conn.close()
-            
-            if result and (result[0] is None or result[0] == 0 or result[0] is False):
-                # Tài khoản đã bị vô hiệu hóa
-                session.clear()
-                return redirect(url_for('login'))
-        except:
-            pass
+            active = account_cache.is_active(session.get('user_id'))
+        except Exception as e:
+            # Không đọc được users và chưa có giá trị cache: từ chối thay vì cho qua
+            print(f"❌ Account check error: {e}")
+            active = False
+        if not active:
+            # Tài khoản đã bị vô hiệu hóa, bị xóa hoặc không kiểm tra được
+            session.clear()
+            return redirect(url_for('login'))
         
         return f(*args, **kwargs)
     return decorated_function
@@ -699,7 +1398,7 @@ def login():
         print(f"=== LOGIN ATTEMPT ===")
         print(f"Username: {username}")
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         c.execute('''SELECT id, username, password_hash, role, full_name, is_active 
                      FROM users WHERE username = ?''', (username,))
@@ -730,7 +1429,7 @@ def login():
             # Kiểm tra is_active
         
             # Cập nhật last_login
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_db()
             c = conn.cursor()
             c.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user[0],))
             conn.commit()
@@ -773,7 +1472,7 @@ def register():
         if len(password) < 6:
             return render_template('register.html', error='Mật khẩu phải có ít nhất 6 ký tự!')
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         
         try:
@@ -823,7 +1522,7 @@ def logout():
 @role_required(100)  # Chỉ admin
 def user_management():
     """Quản lý người dùng"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''SELECT id, username, role, full_name, email, 
@@ -866,7 +1565,7 @@ def user_management():
 @role_required(100)  # Chỉ admin
 def get_users():
     """API lấy danh sách users"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''SELECT id, username, role, full_name, email, 
@@ -908,7 +1607,7 @@ def create_user():
         if role not in USER_ROLES:
             return jsonify({'status': 'error', 'message': 'Role không hợp lệ!'}), 400
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         
         password_hash = generate_password_hash(password)
@@ -957,7 +1656,7 @@ def update_user(user_id):
             if new_role and USER_ROLES.get(new_role, {}).get('level', 0) < USER_ROLES[current_role]['level']:
                 return jsonify({'status': 'error', 'message': 'Không thể tự hạ cấp role của chính mình!'}), 403
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         
         # Build update query
@@ -998,6 +1697,7 @@ def update_user(user_id):
             c.execute(query, update_values)
             
             conn.commit()
+            account_cache.invalidate(user_id)
         
         # Get updated user info
         c.execute('SELECT username, role FROM users WHERE id = ?', (user_id,))
@@ -1034,7 +1734,7 @@ def delete_user(user_id):
         if user_id == session.get('user_id'):
             return jsonify({'status': 'error', 'message': 'Không thể xóa tài khoản của chính mình!'}), 403
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         
         # Get user info for logging
@@ -1049,6 +1749,7 @@ def delete_user(user_id):
         c.execute('DELETE FROM users WHERE id = ?', (user_id,))
         conn.commit()
         conn.close()
+        account_cache.invalidate(user_id)
         
         # Log activity
         log_user_activity(
@@ -1075,7 +1776,7 @@ def get_user_activity():
     """API lấy log hoạt động người dùng"""
     limit = request.args.get('limit', 100, type=int)
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''SELECT 
@@ -1100,41 +1801,343 @@ def get_user_activity():
 
 
 # ================== SYSTEM STATE ==================
+DEFAULT_SENSORS = {
+    'azimuth': 90.0, 'elevation': 90.0, 'current': 0.0, 'voltage': 0.0, 
+    'power': 0.0, 'mode': 'AUTO', 'energy_saving': False, 'efficiency': 0.0, 
+    'light_intensity': 0.0, 'timestamp': time.time(),
+    'battery_voltage': 0.0, 'battery_soc': 0, 'remaining_capacity_ah': 0.0,
+    'battery_capacity_ah': 3.0
+}
+
+# Không có packet mới quá số giây này thì tracker bị coi là offline
+LIVE_OFFLINE_SECONDS = 30
+
+# Packet mới nhất của bất kỳ tracker nào (dashboard không chọn thiết bị)
 system_state = {
-    'sensors': {
-        'azimuth': 90.0, 'elevation': 90.0, 'current': 0.0, 'voltage': 0.0, 
-        'power': 0.0, 'mode': 'AUTO', 'energy_saving': False, 'efficiency': 0.0, 
-        'light_intensity': 0.0, 'timestamp': time.time(),
-        'battery_voltage': 0.0, 'battery_soc': 0, 'remaining_capacity_ah': 0.0,
-        'battery_capacity_ah': 3.0
-    },
+    'sensors': dict(DEFAULT_SENSORS),
     'pico_online': False,
     'last_pico_update': None
 }
 
-command_queue = []
+# Trạng thái realtime theo từng tracker: device_id -> dict cùng dạng system_state
+device_states = {}
+
+def empty_device_state(device_id):
+    """Trạng thái của tracker chưa gửi dữ liệu"""
+    return {
+        'sensors': dict(DEFAULT_SENSORS, device_id=device_id),
+        'pico_online': False,
+        'last_pico_update': None
+    }
+
+def get_device_state(device_id):
+    """Lấy (hoặc tạo) trạng thái realtime của một tracker"""
+    state = device_states.get(device_id)
+    if state is None:
+        state = device_states.setdefault(device_id, empty_device_state(device_id))
+    return state
+
+def device_room(device_id):
+    """Tên room Socket.IO của một tracker (None = mọi tracker)"""
+    return f'device:{device_id or "*"}'
+
+ALL_DEVICES_ROOM = device_room(None)
+
+# Dashboard nhận 'sensor_delta' (các trường đổi so với frame trước của room) thay vì
+# nguyên trạng thái mỗi packet
+live_broadcaster = LiveBroadcaster(lambda event, data, room: socketio.emit(event, data, to=room),
+                                   BROADCAST_CONFIG['window'])
+
+def room_frame(device_id, state):
+    """Trạng thái gửi cho client mới vào room: frame cuối của room (mốc cho các delta sau)"""
+    return live_broadcaster.frame(device_room(device_id)) or state['sensors']
+
+# Hàng đợi lệnh theo tracker: device_id -> deque[(thời điểm xếp hàng, lệnh)]
+# Mỗi tracker có Condition riêng (chung một lock) để long-poll chỉ đánh thức đúng thiết bị
+command_lock = threading.Lock()
+command_queues = {}
+command_conds = {}
+
+def device_command_slot(device_id):
+    """Trả về (queue, condition) của tracker, gọi khi đang giữ command_lock"""
+    if device_id not in command_queues:
+        command_queues[device_id] = deque()
+        command_conds[device_id] = threading.Condition(command_lock)
+    return command_queues[device_id], command_conds[device_id]
+
+def known_command_device(device_id):
+    """Tracker đã gửi dữ liệu (hoặc đã có hàng đợi lệnh): /api/get-command không cần đăng
+    nhập nên không được tạo hàng đợi / giữ long-poll cho device_id bất kỳ"""
+    if device_id in device_states or device_id in command_queues:
+        return True
+    conn = get_db()
+    try:
+        return conn.execute('SELECT 1 FROM devices WHERE device_id = ?', (device_id,)).fetchone() is not None
+    finally:
+        conn.close()
+
+def resolve_command_target(command):
+    """Tracker nhận lệnh: device_id trong lệnh, hoặc tracker duy nhất đang có
+
+    ValueError nếu lệnh không có device_id khi có nhiều tracker (không đoán hàng đợi)
+    """
+    if command.get('device_id'):
+        return command['device_id']
+    if len(device_states) > 1:
+        raise ValueError(f'Có {len(device_states)} tracker, hãy chọn tracker (device_id) nhận lệnh')
+    if device_states:
+        return next(iter(device_states))
+    return DEFAULT_DEVICE_ID
+
+# Độ trễ từ lúc web gửi lệnh đến lúc PICO nhận, theo kênh giao nhận
+command_stats = {}
+command_stats_lock = threading.Lock()
+
+def record_command_delivery(queued_at, transport):
+    """Ghi nhận độ trễ giao lệnh (ms) cho kênh link / long_poll / poll"""
+    latency_ms = (time.time() - queued_at) * 1000
+    with command_stats_lock:
+        stats = command_stats.setdefault(transport, {
+            'delivered': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0
+        })
+        stats['delivered'] += 1
+        stats['total_ms'] += latency_ms
+        stats['max_ms'] = max(stats['max_ms'], latency_ms)
+        stats['last_ms'] = latency_ms
+
+def get_command_stats():
+    with command_stats_lock:
+        return {
+            transport: {
+                'delivered': stats['delivered'],
+                'avg_ms': round(stats['total_ms'] / stats['delivered'], 3),
+                'max_ms': round(stats['max_ms'], 3),
+                'last_ms': round(stats['last_ms'], 3)
+            }
+            for transport, stats in command_stats.items()
+        }
 
 # ================== DATABASE FUNCTIONS ==================
-def save_sensor_data(data):
-    """Lưu sensor data vào database"""
+SENSOR_COLUMNS = ('timestamp', 'device_id', 'azimuth', 'elevation', 'current', 'voltage',
+                  'power', 'mode', 'energy_saving', 'efficiency', 'light_intensity',
+                  'battery_voltage', 'battery_soc', 'remaining_capacity_ah', 'battery_capacity_ah')
+SENSOR_INSERT_SQL = (f"INSERT INTO sensor_data ({', '.join(SENSOR_COLUMNS)}) "
+                     f"VALUES ({', '.join('?' * len(SENSOR_COLUMNS))})")
+
+# Mẫu cuối của từng tracker để tích phân năng lượng qua các lô ghi
+energy_accumulator = EnergyAccumulator(ENERGY_CONFIG['max_gap'])
+
+def sensor_row(data, timestamp=None):
+    """Chuyển packet thành tuple (theo SENSOR_COLUMNS) để insert vào sensor_data"""
+    # Gắn thời gian nhận (UTC, cùng định dạng CURRENT_TIMESTAMP) ngay khi nhận,
+    # không phải lúc writer flush xuống DB
+    if timestamp is None:
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    return (timestamp, data.get('device_id') or DEFAULT_DEVICE_ID,
+            data['azimuth'], data['elevation'], data['current'], data['voltage'],
+            data['power'], data['mode'], data['energy_saving'],
+            data.get('efficiency', 0), data.get('light_intensity', 0),
+            data.get('battery_voltage', 0), data.get('battery_soc', 0),
+            data.get('remaining_capacity_ah', 0), data.get('battery_capacity_ah', 3.0))
+
+def write_sensor_rows(rows):
+    """Ghi một lô sensor data trong một transaction"""
+    # Mốc thời gian mới nhất của từng tracker trong lô
+    last_seen = {}
+    for row in rows:
+        if row[1] not in last_seen or row[0] > last_seen[row[1]]:
+            last_seen[row[1]] = row[0]
+    
+    # Lô có dòng của ngày đã đóng: commit và gộp vào file lưu trữ dưới archive_lock
+    late = (ARCHIVE_CONFIG['enabled'] and
+            min(row[0] for row in rows)[:10] < utc_now().strftime('%Y-%m-%d'))
+    if late:
+        archive_lock.acquire()
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        c.execute('''INSERT INTO sensor_data 
-                    (azimuth, elevation, current, voltage, power, mode, energy_saving, 
-                     efficiency, light_intensity, battery_voltage, battery_soc, 
-                     remaining_capacity_ah, battery_capacity_ah)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                 (data['azimuth'], data['elevation'], data['current'], data['voltage'],
-                  data['power'], data['mode'], data['energy_saving'], 
-                  data.get('efficiency', 0), data.get('light_intensity', 0),
-                  data.get('battery_voltage', 0), data.get('battery_soc', 0),
-                  data.get('remaining_capacity_ah', 0), data.get('battery_capacity_ah', 3.0)))
-        
-        conn.commit()
+        conn = get_db()
+        try:
+            with energy_accumulator.transaction(), conn:
+                conn.executemany(SENSOR_INSERT_SQL, rows)
+                apply_rollups(conn, rows, SENSOR_COLUMNS)
+                apply_day_index(conn, rows)
+                energy_accumulator.apply(conn, rows, 0, 1, SENSOR_COLUMNS.index('power'))
+                conn.executemany('''INSERT INTO devices (device_id, first_seen, last_seen)
+                                    VALUES (?, ?, ?)
+                                    ON CONFLICT(device_id) DO UPDATE
+                                    SET last_seen = MAX(last_seen, excluded.last_seen)''',
+                                 [(device_id, ts, ts) for device_id, ts in last_seen.items()])
+        finally:
+            conn.close()
+        if late:
+            merge_late_archive_rows(rows)
+    finally:
+        if late:
+            archive_lock.release()
+    invalidate_sensor_cache(rows)
+
+class BatchWriter:
+    """Thread nền gom bản ghi từ hàng đợi và ghi xuống database theo lô"""
+
+    def __init__(self, name, flush_func, queue_size, batch_size, flush_interval, tick=None):
+        self.name = name
+        self.flush_func = flush_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.tick = tick                  # tick() -> bản ghi cần ghi thêm, gọi mỗi flush_interval giây kể cả khi rảnh
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'written': 0,
+            'batches': 0,
+            'errors': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def put(self, item):
+        """Đưa bản ghi vào hàng đợi, trả về False nếu hàng đợi đầy"""
+        if self._thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self.stats['dropped'] += 1
+            return False
+        with self._stats_lock:
+            self.stats['enqueued'] += 1
+        return True
+
+    def stop(self, timeout=5):
+        """Dừng writer sau khi ghi hết dữ liệu còn trong hàng đợi"""
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval if self.tick else None)
+            except queue.Empty:
+                batch = self._tick()
+                if batch:
+                    self._flush(batch)
+                continue
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch + self._tick())
+            if stopping:
+                return
+
+    def _tick(self):
+        if self.tick is None:
+            return []
+        try:
+            return self.tick()
+        except Exception as e:
+            print(f"❌ {self.name} tick error: {e}")
+            return []
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            self.flush_func(batch)
+            ok = True
+        except Exception as e:
+            ok = False
+            print(f"❌ {self.name} flush error ({len(batch)} rows): {e}")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            if ok:
+                self.stats['written'] += len(batch)
+            else:
+                self.stats['errors'] += 1
+            self.stats['batches'] += 1
+            self.stats['last_batch_size'] = len(batch)
+            self.stats['last_flush_ms'] = round(elapsed_ms, 3)
+            self.stats['max_flush_ms'] = round(max(self.stats['max_flush_ms'], elapsed_ms), 3)
+            self.stats['total_flush_ms'] += elapsed_ms
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['queue_size'] = self.queue.maxsize
+        stats['avg_flush_ms'] = round(stats['total_flush_ms'] / stats['batches'], 3) if stats['batches'] else 0.0
+        stats['total_flush_ms'] = round(stats['total_flush_ms'], 3)
+        return stats
+
+sensor_writer = BatchWriter(
+    'sensor-writer',
+    write_sensor_rows,
+    INGEST_CONFIG['queue_size'],
+    INGEST_CONFIG['batch_size'],
+    INGEST_CONFIG['flush_interval']
+)
+atexit.register(sensor_writer.stop)
+
+def write_activity_rows(rows):
+    """Ghi một lô log hoạt động trong một transaction"""
+    conn = get_db()
+    try:
+        with conn:
+            conn.executemany('''INSERT INTO user_activity_log 
+                                (timestamp, user_id, username, activity_type, description, ip_address, user_agent)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+    finally:
         conn.close()
-        print(f"💾 Saved data: {data['power']:.1f}W, Bat:{data.get('battery_soc', 0)}%")
+
+audit_writer = BatchWriter(
+    'audit-writer',
+    write_activity_rows,
+    AUDIT_CONFIG['queue_size'],
+    AUDIT_CONFIG['batch_size'],
+    AUDIT_CONFIG['flush_interval'],
+    tick=sweep_expired_activity
+)
+
+def stop_audit_writer():
+    """Ghi tổng kết các cửa sổ gộp còn mở rồi dừng audit_writer (khi thoát)"""
+    with audit_collapse_lock:
+        summaries = sweep_collapsed_activity(float('inf'))
+    for row in summaries:
+        audit_writer.put(row)
+    audit_writer.stop()
+atexit.register(stop_audit_writer)
+
+def save_sensor_data(data):
+    """Đưa sensor data vào hàng đợi ghi database"""
+    try:
+        if not sensor_writer.put(sensor_row(data)):
+            print("❌ Ingest queue full - dropped sensor packet")
+            return False
         return True
     except Exception as e:
         print(f"❌ Database error: {e}")
@@ -1145,28 +2148,16 @@ def save_sensor_data(data):
 @login_required
 @permission_required('view_dashboard')
 def dashboard():
-    # Lấy thông tin thời tiết
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''SELECT temperature, weather_code, is_day FROM weather_data 
-                     ORDER BY timestamp DESC LIMIT 1''')
-        row = c.fetchone()
-        conn.close()
-        
-        if row:
-            weather_info = {
-                'temperature': row[0],
-                'weather_desc': get_weather_code_description(row[1]),
-                'weather_icon': get_weather_icon(row[1], row[2] == 1)
-            }
-        else:
-            weather_info = {
-                'temperature': 28,
-                'weather_desc': 'Trời quang',
-                'weather_icon': '☀️'
-            }
-    except:
+    # Lấy thông tin thời tiết từ bản chụp trong bộ nhớ
+    snapshot = weather_snapshot
+    if snapshot:
+        current = snapshot['current']
+        weather_info = {
+            'temperature': current['temperature'],
+            'weather_desc': current['description'],
+            'weather_icon': current['icon']
+        }
+    else:
         weather_info = {
             'temperature': 28,
             'weather_desc': 'Trời quang',
@@ -1184,24 +2175,226 @@ def dashboard():
                          permissions=user_permissions,
                          weather=weather_info)
 
+# ================== SENSOR INGEST ==================
+SENSOR_REQUIRED_FIELDS = ('azimuth', 'elevation', 'current', 'voltage', 'power', 'mode', 'energy_saving')
+SENSOR_NUMERIC_FIELDS = ('azimuth', 'elevation', 'current', 'voltage', 'power', 'efficiency',
+                         'light_intensity', 'battery_voltage', 'battery_soc',
+                         'remaining_capacity_ah', 'battery_capacity_ah')
+
+def validate_sensor_packet(data):
+    """Kiểm tra packet sensor, trả về thông báo lỗi hoặc None nếu hợp lệ"""
+    if not isinstance(data, dict):
+        return 'packet must be a JSON object'
+    for field in SENSOR_REQUIRED_FIELDS:
+        if field not in data:
+            return f'missing field: {field}'
+    for field in SENSOR_NUMERIC_FIELDS:
+        value = data.get(field, 0)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f'field {field} must be a number'
+    if data['mode'] not in ('AUTO', 'MANUAL'):
+        return f"invalid mode: {data['mode']}"
+    return None
+
+def packet_timestamp(data):
+    """Lấy thời gian đo (UTC) từ packet nếu là Unix epoch hợp lệ, ngược lại None"""
+    ts = data.get('timestamp')
+    if isinstance(ts, (int, float)) and not isinstance(ts, bool) and 1e9 < ts <= time.time() + 60:
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+    return None
+
+def update_live_state(data, sampled_at=None):
+    """Cập nhật trạng thái realtime của tracker gửi packet, trả về trạng thái đó
+
+    sampled_at: epoch lúc đo của packet gửi theo lô (mặc định lúc nhận). Trạng thái
+    đang giữ mẫu mới hơn thì không bị ghi đè; mẫu cũ không làm tracker thành online.
+    """
+    state = get_device_state(data.get('device_id') or DEFAULT_DEVICE_ID)
+    now = time.time()
+    sampled_at = now if sampled_at is None else min(sampled_at, now)
+    last_update = time.strftime('%H:%M:%S', time.localtime(sampled_at))
+    for target in (state, system_state):
+        if target['last_pico_update'] is not None and target['sensors']['timestamp'] > sampled_at:
+            continue
+        target['sensors'].update(data)
+        target['sensors']['timestamp'] = sampled_at
+        target['pico_online'] = now - sampled_at <= LIVE_OFFLINE_SECONDS
+        target['last_pico_update'] = last_update
+    return state
+
+def emit_live_state(state):
+    """Đưa trạng thái vào live_broadcaster cho room của tracker và room xem mọi tracker"""
+    status = {
+        'device_id': state['sensors']['device_id'],
+        'pico_online': state['pico_online'],
+        'last_update': state['last_pico_update']
+    }
+    for room in (device_room(state['sensors']['device_id']), ALL_DEVICES_ROOM):
+        live_broadcaster.update(room, state['sensors'], status)
+
+def ingest_packet(data):
+    """Pipeline chung cho một packet: trạng thái realtime, lưu DB, socket
+
+    ValueError nếu packet không hợp lệ: packet sai không được vào lô ghi chung, nơi nó
+    làm hỏng cả transaction của các packet hợp lệ khác
+    """
+    error = validate_sensor_packet(data)
+    if error:
+        raise ValueError(error)
+    state = update_live_state(data)
+    save_sensor_data(data)
+    alert_engine.evaluate(state['sensors']['device_id'], state['sensors'])
+    emit_live_state(state)
+
+# ================== DEVICE LINK (TCP) ==================
+class DeviceLinkServer:
+    """Listener TCP giữ một kết nối lâu dài với PICO: telemetry đi lên, lệnh được đẩy xuống"""
+
+    def __init__(self, host, port, idle_timeout):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self._links = {}             # device_id -> (socket, lock), theo telemetry gần nhất
+        self._connections = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {
+            'connections': 0,
+            'frames_in': 0,
+            'frames_out': 0,
+            'commands_pushed': 0,
+            'errors': 0
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._serve, name='device-link', daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server.bind((self.host, self.port))
+        except OSError as e:
+            print(f"❌ Device link disabled, cannot bind {self.host}:{self.port}: {e}")
+            server.close()
+            return
+        server.listen(16)
+        print(f"🔗 Device link listening on {self.host}:{self.port}")
+        while True:
+            conn, addr = server.accept()
+            threading.Thread(target=self._handle, args=(conn, addr), daemon=True).start()
+
+    def _handle(self, conn, addr):
+        conn.settimeout(self.idle_timeout)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        link = (conn, threading.Lock())
+        device_ids = set()
+        with self._lock:
+            self._connections += 1
+            self.stats['connections'] += 1
+        print(f"🔗 PICO linked from {addr[0]}:{addr[1]}")
+        buf = b''
+        try:
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                frames, buf = parse_frames(buf + chunk)
+                for frame_type, payload in frames:
+                    self.stats['frames_in'] += 1
+                    if frame_type == FRAME_TELEMETRY:
+                        packet = decode_packet(payload)
+                        device_id = packet.get('device_id') or DEFAULT_DEVICE_ID
+                        if device_id not in device_ids:
+                            # Kết nối được gắn với tracker qua telemetry đầu tiên
+                            device_ids.add(device_id)
+                            with self._lock:
+                                self._links[device_id] = link
+                        try:
+                            ingest_packet(packet)
+                        except ValueError as e:
+                            # Frame đúng định dạng nhưng giá trị sai: bỏ packet, giữ kết nối
+                            self.stats['errors'] += 1
+                            print(f"⚠️  Device link {device_id}: rejected packet ({e})")
+                    elif frame_type == FRAME_PING:
+                        self._send(link, encode_frame(FRAME_PING))
+        except (OSError, ValueError) as e:
+            self.stats['errors'] += 1
+            print(f"⚠️  Device link {addr[0]} closed: {e}")
+        finally:
+            with self._lock:
+                self._connections -= 1
+                for device_id in device_ids:
+                    if self._links.get(device_id) is link:
+                        del self._links[device_id]
+            conn.close()
+
+    def _send(self, link, frame):
+        conn, lock = link
+        with lock:
+            conn.sendall(frame)
+        self.stats['frames_out'] += 1
+
+    def push_command(self, device_id, command):
+        """Đẩy lệnh xuống tracker qua kết nối của nó, False nếu tracker không có kết nối"""
+        with self._lock:
+            link = self._links.get(device_id)
+        if link is None:
+            return False
+        try:
+            self._send(link, encode_frame(FRAME_COMMAND, json.dumps(command).encode()))
+        except OSError as e:
+            self.stats['errors'] += 1
+            print(f"⚠️  Push command failed, falling back to HTTP queue: {e}")
+            return False
+        self.stats['commands_pushed'] += 1
+        return True
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        with self._lock:
+            stats['active_links'] = self._connections
+            stats['linked_devices'] = len(self._links)
+        return stats
+
+device_link = DeviceLinkServer(LINK_CONFIG['host'], LINK_CONFIG['port'], LINK_CONFIG['idle_timeout'])
+
+def dispatch_command(command):
+    """Gửi lệnh đến PICO: đẩy qua kết nối TCP nếu có, ngược lại xếp hàng cho /api/get-command
+
+    ValueError nếu không xác định được tracker nhận lệnh (resolve_command_target)
+    """
+    queued_at = time.time()
+    device_id = resolve_command_target(command)
+    if LINK_CONFIG['enabled'] and device_link.push_command(device_id, command):
+        record_command_delivery(queued_at, 'link')
+        return 'link'
+    with command_lock:
+        pending, cond = device_command_slot(device_id)
+        pending.append((queued_at, command))
+        cond.notify()
+    return 'queue'
+
+def device_clause(device_id, keyword='AND'):
+    """Điều kiện lọc sensor_data theo tracker, trả về (đoạn SQL, tham số)"""
+    if device_id:
+        return f' {keyword} device_id = ?', (device_id,)
+    return '', ()
+
 # ================== API ROUTES ==================
 @app.route('/api/sensor-data', methods=['POST'])
 def receive_sensor_data():
     """PICO gửi sensor data lên đây"""
     try:
         data = request.json
-        system_state['sensors'].update(data)
-        system_state['sensors']['timestamp'] = time.time()
-        system_state['pico_online'] = True
-        system_state['last_pico_update'] = datetime.now().strftime("%H:%M:%S")
-        
-        save_sensor_data(data)
-        
-        socketio.emit('sensor_update', system_state['sensors'])
-        socketio.emit('status_update', {
-            'pico_online': True,
-            'last_update': system_state['last_pico_update']
-        })
+        try:
+            ingest_packet(data)
+        except ValueError as e:
+            print(f"❌ Rejected sensor packet: {e}")
+            return jsonify({"status": "error", "message": str(e)}), 400
         
         print(f"📊 PICO data: AZ={data.get('azimuth', 0)}°, EL={data.get('elevation', 0)}°, P={data.get('power', 0)}W, Bat={data.get('battery_soc', 0)}%")
         return jsonify({"status": "success"})
@@ -1210,11 +2403,120 @@ def receive_sensor_data():
         print(f"❌ Error receiving data: {e}")
         return jsonify({"status": "error"})
 
+@app.route('/api/sensor-data/bin', methods=['POST'])
+def receive_sensor_data_binary():
+    """PICO gửi sensor data dạng nhị phân (telemetry_codec)"""
+    try:
+        data = decode_packet(request.get_data())
+    except ValueError as e:
+        print(f"❌ Bad binary packet: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    try:
+        ingest_packet(data)
+        return jsonify({"status": "success"})
+    except ValueError as e:
+        print(f"❌ Rejected sensor packet: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        print(f"❌ Error receiving data: {e}")
+        return jsonify({"status": "error"})
+
+def parse_batch_body():
+    """Đọc body batch: JSON array hoặc NDJSON, trả về list (packet, lỗi parse)"""
+    body = request.get_data(as_text=True)
+    content_type = request.content_type or ''
+    if 'ndjson' not in content_type and body.lstrip().startswith('['):
+        packets = json.loads(body)
+        return [(packet, None) for packet in packets]
+    
+    items = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append((json.loads(line), None))
+        except ValueError as e:
+            items.append((None, f'invalid JSON: {e}'))
+    return items
+
+@app.route('/api/sensor-data/batch', methods=['POST'])
+def receive_sensor_batch():
+    """Nhận nhiều packet (JSON array hoặc NDJSON) và ghi trong một transaction"""
+    try:
+        items = parse_batch_body()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'invalid JSON: {e}'}), 400
+    
+    if len(items) > INGEST_CONFIG['max_batch_packets']:
+        return jsonify({
+            'status': 'error',
+            'message': f"Batch quá lớn (tối đa {INGEST_CONFIG['max_batch_packets']} packet)"
+        }), 413
+    
+    results = []
+    rows = []
+    latest = {}
+    for index, (packet, error) in enumerate(items):
+        if error is None:
+            error = validate_sensor_packet(packet)
+        if error:
+            results.append({'index': index, 'status': 'rejected', 'error': error})
+            continue
+        row = sensor_row(packet, packet_timestamp(packet))
+        rows.append(row)
+        results.append({'index': index, 'status': 'accepted'})
+        # Packet đo muộn nhất của từng tracker (packet trong lô không nhất thiết theo thứ tự)
+        if row[1] not in latest or row[0] >= latest[row[1]][0]:
+            latest[row[1]] = (row[0], packet)
+    
+    if rows:
+        try:
+            write_sensor_rows(rows)
+        except Exception as e:
+            print(f"❌ Batch ingest error: {e}")
+            return jsonify({'status': 'error', 'message': f'Lỗi ghi database: {e}'}), 500
+        
+        # Một lần đánh giá cảnh báo và một sự kiện socket cho mỗi tracker trong batch;
+        # packet cũ hơn trạng thái realtime (lô gửi bù) không ghi đè trạng thái đó
+        for device_id, (timestamp, packet) in latest.items():
+            sampled_at = utc_epoch(timestamp)
+            state = get_device_state(device_id)
+            if state['last_pico_update'] is not None and sampled_at < state['sensors']['timestamp']:
+                continue
+            state = update_live_state(packet, sampled_at)
+            alert_engine.evaluate(device_id, state['sensors'], sampled_at)
+            emit_live_state(state)
+    
+    print(f"📦 Batch ingest: {len(rows)} accepted, {len(items) - len(rows)} rejected")
+    return jsonify({
+        'status': 'success',
+        'accepted': len(rows),
+        'rejected': len(items) - len(rows),
+        'results': results
+    })
+
 @app.route('/api/get-command', methods=['GET'])
 def get_command():
-    """PICO lấy lệnh từ web"""
-    if command_queue:
-        command = command_queue.pop(0)
+    """PICO lấy lệnh từ web
+
+    ?device_id=X chọn hàng đợi của tracker (mặc định 'default').
+    ?wait=N (giây) bật long-poll: request được giữ đến khi có lệnh hoặc hết N giây.
+    Tracker chưa từng gửi dữ liệu không có lệnh: trả về ngay, không giữ request.
+    """
+    device_id = request.args.get('device_id') or DEFAULT_DEVICE_ID
+    wait = min(max(request.args.get('wait', 0, type=float), 0), COMMAND_CONFIG['long_poll_max_wait'])
+    if not known_command_device(device_id):
+        return jsonify({"command": None})
+    with command_lock:
+        pending, cond = device_command_slot(device_id)
+        if wait and not pending:
+            cond.wait_for(lambda: pending, timeout=wait)
+        item = pending.popleft() if pending else None
+    
+    if item:
+        queued_at, command = item
+        record_command_delivery(queued_at, 'long_poll' if wait else 'poll')
         print(f"📨 Sending command to PICO: {command}")
         return jsonify(command)
     return jsonify({"command": None})
@@ -1222,44 +2524,30 @@ def get_command():
 @app.route('/api/history-chart')
 @login_required
 @permission_required('view_reports')
+@cached_response('history_chart', history_chart_tags)
 def get_history_chart():
     """Lấy dữ liệu cho biểu đồ time series"""
     hours = request.args.get('hours', 24, type=int)
     
-    # Xác định số điểm dữ liệu
+    # Xác định số điểm dữ liệu (mặc định), có thể ghi đè bằng ?points
     if hours == 1: target_points = 8
     elif hours == 6: target_points = 10
     elif hours == 24: target_points = 12
     elif hours == 168: target_points = 14
     else: target_points = 12
+    try:
+        target_points, method = chart_points_args(target_points)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'method không hợp lệ!'}), 400
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     
-    c.execute(f'''SELECT 
-                 datetime(timestamp, 'localtime') as local_time,
-                 current, voltage, power, efficiency, battery_voltage, battery_soc
-                 FROM sensor_data 
-                 WHERE timestamp > datetime('now', '-{hours} hours')
-                 ORDER BY timestamp ASC''')
-    
-    all_rows = c.fetchall()
-    conn.close()
-    
-    # Lọc dữ liệu
-    filtered_rows = []
-    total_points = len(all_rows)
-    
-    if total_points > target_points:
-        step = max(1, total_points // target_points)
-        for i in range(0, total_points, step):
-            if len(filtered_rows) < target_points:
-                filtered_rows.append(all_rows[i])
-        if total_points > 0 and len(filtered_rows) > 0:
-            filtered_rows[0] = all_rows[0]
-            filtered_rows[-1] = all_rows[-1]
-    else:
-        filtered_rows = all_rows
+    try:
+        filtered_rows = query_chart_rows(c, utc_cutoff(hours=hours), None, target_points, method,
+                                         request.args.get('device'))
+    finally:
+        conn.close()
     
     # Chuẩn bị dữ liệu
     labels = []
@@ -1296,35 +2584,27 @@ def get_history_chart():
 @app.route('/api/daily-chart')
 @login_required
 @permission_required('view_reports')
+@cached_response('daily_chart', daily_chart_tags)
 def get_daily_chart():
     """Lấy dữ liệu cho biểu đồ theo ngày"""
     date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    try:
+        bounds = day_bounds(date_str)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Ngày không hợp lệ!'}), 400
+    try:
+        points, method = chart_points_args(24)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'method không hợp lệ!'}), 400
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     
-    c.execute('''SELECT 
-                 datetime(timestamp, 'localtime') as local_time,
-                 current, voltage, power, efficiency, battery_voltage, battery_soc
-                 FROM sensor_data 
-                 WHERE date(timestamp) = ?
-                 ORDER BY timestamp ASC''', (date_str,))
-    
-    all_rows = c.fetchall()
-    conn.close()
-    
-    # Lọc dữ liệu
-    filtered_rows = []
-    if len(all_rows) > 24:
-        step = max(1, len(all_rows) // 24)
-        for i in range(0, len(all_rows), step):
-            if len(filtered_rows) < 24:
-                filtered_rows.append(all_rows[i])
-        if len(all_rows) > 0:
-            filtered_rows[0] = all_rows[0]
-            filtered_rows[-1] = all_rows[-1]
-    else:
-        filtered_rows = all_rows
+    try:
+        filtered_rows = query_chart_rows(c, bounds[0], bounds[1], points, method,
+                                         request.args.get('device'))
+    finally:
+        conn.close()
     
     # Chuẩn bị dữ liệu
     labels = []
@@ -1362,39 +2642,54 @@ def get_daily_chart():
 @app.route('/api/available-dates')
 @login_required
 @permission_required('view_reports')
+@cached_response('available_dates', available_dates_tags)
 def get_available_dates():
-    """Lấy danh sách các ngày có dữ liệu"""
-    conn = sqlite3.connect(DB_PATH)
+    """Lấy danh sách các ngày có dữ liệu (?detail=1: kèm số mẫu và độ phủ của từng ngày)"""
+    device_sql, device_params = device_clause(request.args.get('device'), 'WHERE')
+    
+    conn = get_db()
     c = conn.cursor()
     
-    c.execute('''SELECT DISTINCT date(timestamp) as date 
-                 FROM sensor_data 
-                 ORDER BY date DESC''')
+    if not request.args.get('detail'):
+        c.execute(AVAILABLE_DATES_SQL.format(device_sql=device_sql), device_params)
+        dates = [row[0] for row in c.fetchall()]
+        conn.close()
+        return jsonify(dates)
     
-    dates = [row[0] for row in c.fetchall()]
+    c.execute(DAY_COVERAGE_SQL.format(device_sql=device_sql.replace('device_id', 'd.device_id')), device_params)
+    rows = c.fetchall()
     conn.close()
     
-    return jsonify(dates)
+    now = utc_epoch(utc_cutoff())
+    days = []
+    for day, samples, first_ts, last_ts, gaps in rows:
+        entry = {'date': day, 'samples': samples, 'first': first_ts, 'last': last_ts,
+                 'gaps': gaps, 'span_hours': None, 'coverage': None}
+        if first_ts and last_ts:
+            # Độ phủ: khoảng mẫu đầu-mẫu cuối trên thời gian đã qua của ngày (UTC)
+            day_start = utc_epoch(day + ' 00:00:00')
+            elapsed = min(now - day_start, 86400)
+            span = utc_epoch(last_ts) - utc_epoch(first_ts)
+            entry['span_hours'] = round(span / 3600, 2)
+            entry['coverage'] = round(min(span / elapsed, 1.0) * 100, 1) if elapsed > 0 else None
+        days.append(entry)
+    return jsonify(days)
 
 @app.route('/api/report/daily')
 @login_required
 @permission_required('view_reports')
+@cached_response('daily_report', daily_report_tags)
 def daily_report():
     """Báo cáo hiệu suất ngày"""
-    conn = sqlite3.connect(DB_PATH)
+    device_sql, device_params = device_clause(request.args.get('device'))
+    
+    conn = get_db()
     c = conn.cursor()
     
     today = datetime.now().strftime('%Y-%m-%d')
     
-    c.execute('''SELECT 
-                 MAX(power) as max_power,
-                 AVG(power) as avg_power,
-                 SUM(power * 3 / 3600) as total_energy,
-                 AVG(efficiency) as avg_efficiency,
-                 AVG(battery_soc) as avg_battery_soc,
-                 COUNT(*) as data_points
-                 FROM sensor_data 
-                 WHERE date(timestamp) = ?''', (today,))
+    c.execute(DAILY_STATS_SQL.format(device_sql=device_sql),
+              (today,) + device_params + (day_bounds(today)[0],) + device_params)
     
     result = c.fetchone()
     conn.close()
@@ -1412,6 +2707,241 @@ def daily_report():
     
     return jsonify(report)
 
+@app.route('/api/devices')
+@login_required
+@permission_required('view_dashboard')
+def get_devices():
+    """Danh sách tracker và trạng thái online"""
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('''SELECT device_id, first_seen, last_seen
+                 FROM devices ORDER BY device_id''')
+    rows = c.fetchall()
+    conn.close()
+    
+    devices = []
+    for row in rows:
+        state = device_states.get(row[0])
+        devices.append({
+            'device_id': row[0],
+            'first_seen': row[1],
+            'last_seen': row[2],
+            'pico_online': state['pico_online'] if state else False,
+            'last_update': state['last_pico_update'] if state else None
+        })
+    return jsonify(devices)
+
+# ================== DATA EXPORT ==================
+export_stats = {'exports': 0, 'active': 0, 'rows': 0, 'bytes': 0, 'last': None}
+export_stats_lock = threading.Lock()
+
+def parse_export_time(value, end=False):
+    """'YYYY-MM-DD' hoặc 'YYYY-MM-DD HH:MM:SS' (UTC) thành chuỗi timestamp, ValueError nếu sai"""
+    if len(value) == 10:
+        bounds = day_bounds(value)
+        return bounds[1] if end else bounds[0]
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+
+def iter_export_rows(start, end, device_id, columns):
+    """Dòng export (tuple theo columns) trong [start, end), end=None: tới hiện tại
+
+    Ngày còn dữ liệu thô đọc sensor_data theo trang page_seconds, mỗi trang một truy vấn
+    ngắn trên connection mượn rồi trả ngay (không giữ read transaction suốt lúc tải, WAL
+    checkpoint không bị chặn). Ngày đã lưu trữ mà dữ liệu thô đã bị retention dọn đọc
+    file cột; cột không có trong file lưu trữ là None.
+    """
+    end = end or time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() + 1))
+    device_sql, device_params = device_clause(device_id)
+    query = (f"SELECT {', '.join(columns)} FROM sensor_data "
+             f"WHERE timestamp >= ? AND timestamp < ?{device_sql} ORDER BY timestamp ASC")
+    for day in utc_days(start, end):
+        day_start, day_end = day_bounds(day)
+        lo, hi = max(start, day_start), min(end, day_end)
+        if lo >= hi:
+            continue
+        conn = get_db()
+        try:
+            raw = conn.execute(f'SELECT 1 FROM sensor_data WHERE timestamp >= ? AND timestamp < ?{device_sql} LIMIT 1',
+                               (day_start, day_end) + device_params).fetchone()
+            archived = not raw and archived_day(conn.cursor(), device_id, day)
+            devices = archive_export_devices(conn, device_id, day) if archived else []
+        finally:
+            conn.close()
+        if archived:
+            yield from iter_archive_export_rows(devices, day, lo, hi, columns)
+            continue
+        if not raw:
+            continue
+        page_start, page_end = utc_epoch(lo), utc_epoch(hi)
+        while page_start < page_end:
+            page_stop = min(page_start + EXPORT_CONFIG['page_seconds'], page_end)
+            page = (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(page_start)),
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(page_stop)))
+            conn = get_db()
+            try:
+                rows = conn.execute(query, page + device_params).fetchall()
+            finally:
+                conn.close()
+            yield from rows
+            page_start = page_stop
+
+def archive_export_devices(conn, device_id, day):
+    """Tracker có file lưu trữ của ngày (lấy device_id từ sensor_rollup_day, không từ tên thư mục)"""
+    if device_id:
+        return [device_id]
+    rows = conn.execute('SELECT device_id FROM sensor_rollup_day WHERE bucket = ?', (day + ' 00:00:00',))
+    return [row[0] for row in rows if archive.has_day(row[0], day)]
+
+def iter_archive_export_rows(devices, day, lo, hi, columns):
+    """Dòng export từ file cột của các tracker trong [lo, hi), gộp theo epoch"""
+    names = [name for name, _ in ARCHIVE_COLUMNS[:-1]]
+    days = [archive.open_day(device, day) for device in devices]
+    try:
+        streams = [zip(d.iter_rows(utc_epoch(lo), utc_epoch(hi)), itertools.repeat(device))
+                   for d, device in zip(days, devices)]
+        for row, device in heapq.merge(*streams, key=lambda item: item[0][-1]):
+            values = dict(zip(names, row[1:-1]), device_id=device,
+                          timestamp=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(row[-1])))
+            yield tuple(values.get(col) for col in columns)
+    finally:
+        for d in days:
+            d.close()
+
+def iter_export_chunks(export_rows, columns, fmt, use_gzip, username):
+    """Sinh từng chunk bytes của file export, mỗi chunk tối đa chunk_size dòng"""
+    started = time.perf_counter()
+    rows_total = bytes_total = 0
+    compressor = zlib.compressobj(EXPORT_CONFIG['gzip_level'], zlib.DEFLATED, 31) if use_gzip else None
+    with export_stats_lock:
+        export_stats['active'] += 1
+    try:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if fmt == 'csv':
+            writer.writerow(columns)
+        while True:
+            rows = list(itertools.islice(export_rows, EXPORT_CONFIG['chunk_size']))
+            if not rows:
+                break
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buf.write(json.dumps(dict(zip(columns, row))))
+                    buf.write('\n')
+            rows_total += len(rows)
+            data = buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                bytes_total += len(data)
+                yield data
+        if fmt == 'csv' and rows_total == 0:
+            data = buf.getvalue().encode()
+            if compressor:
+                data = compressor.compress(data)
+            bytes_total += len(data)
+            yield data
+        if compressor:
+            data = compressor.flush()
+            bytes_total += len(data)
+            yield data
+    finally:
+        export_rows.close()
+        elapsed = time.perf_counter() - started
+        rows_per_s = round(rows_total / elapsed) if elapsed > 0 else 0
+        with export_stats_lock:
+            export_stats['active'] -= 1
+            export_stats['exports'] += 1
+            export_stats['rows'] += rows_total
+            export_stats['bytes'] += bytes_total
+            export_stats['last'] = {
+                'user': username, 'rows': rows_total, 'bytes': bytes_total,
+                'seconds': round(elapsed, 3), 'rows_per_s': rows_per_s
+            }
+        print(f"📤 Export {rows_total} rows ({bytes_total} bytes) in {elapsed:.2f}s - {rows_per_s} rows/s")
+
+@app.route('/api/export')
+@login_required
+@permission_required('view_reports')
+def export_sensor_data():
+    """Xuất sensor data dạng CSV / NDJSON theo stream
+    
+    Query: start, end (UTC, 'YYYY-MM-DD' hoặc 'YYYY-MM-DD HH:MM:SS'), columns (phân cách bằng dấu phẩy),
+    device, format=csv|ndjson, gzip=1
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'status': 'error', 'message': 'format phải là csv hoặc ndjson'}), 400
+    
+    columns = [col.strip() for col in request.args.get('columns', '').split(',') if col.strip()]
+    columns = columns or list(SENSOR_COLUMNS)
+    unknown = [col for col in columns if col not in SENSOR_COLUMNS]
+    if unknown:
+        return jsonify({'status': 'error', 'message': f'Cột không hợp lệ: {", ".join(unknown)}'}), 400
+    
+    try:
+        start = parse_export_time(request.args.get('start', utc_now().strftime('%Y-%m-%d')))
+        end = request.args.get('end')
+        end = parse_export_time(end, end=True) if end else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Thời gian không hợp lệ!'}), 400
+    
+    export_rows = iter_export_rows(start, end, request.args.get('device') or None, columns)
+    
+    use_gzip = request.args.get('gzip') in ('1', 'true')
+    filename = f"sensor_data_{start[:10]}.{'csv' if fmt == 'csv' else 'ndjson'}" + ('.gz' if use_gzip else '')
+    mimetype = 'application/gzip' if use_gzip else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    
+    log_user_activity(
+        session.get('user_id'),
+        session.get('username'),
+        'export_data',
+        f'Export {fmt} from {start} to {end or "now"} ({len(columns)} columns)',
+        request.remote_addr,
+        request.user_agent.string
+    )
+    
+    # Không đặt Content-Length: server trả về theo từng chunk
+    return Response(
+        stream_with_context(iter_export_chunks(export_rows, columns, fmt, use_gzip, session.get('username'))),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+# ================== SYSTEM STATS ==================
+@app.route('/api/system/stats')
+@login_required
+@permission_required('manage_system')
+def get_system_stats():
+    """Thống kê hoạt động nội bộ của server"""
+    return jsonify({
+        'ingest': sensor_writer.get_stats(),
+        'db_pool': db_pool.get_stats(),
+        'device_link': device_link.get_stats(),
+        'commands': get_command_stats(),
+        'alerts': alert_engine.get_stats(),
+        'notifier': slack_notifier.get_stats(),
+        'scheduler': scheduler.get_stats(),
+        'weather': weather_client.get_stats(),
+        'broadcast': live_broadcaster.get_stats(),
+        'auth': account_cache.get_stats(),
+        'audit': dict(audit_writer.get_stats(), collapsed=audit_stats['collapsed'],
+                      collapse_groups=len(audit_collapse)),
+        'response_cache': response_cache.get_stats(),
+        'retention': retention_stats,
+        'export': export_stats
+    })
+
+@app.route('/api/system/retention')
+@login_required
+@permission_required('manage_system')
+def get_retention_report():
+    """Báo cáo dry-run: số dòng và số byte retention sẽ thu hồi"""
+    return jsonify(apply_retention(dry_run=True))
+
 # ================== SLACK API ROUTES ==================
 @app.route('/api/test-slack-report')
 @login_required
@@ -1470,7 +3000,7 @@ def get_alerts_history():
     """Lấy lịch sử cảnh báo"""
     limit = request.args.get('limit', 50, type=int)
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('''SELECT datetime(timestamp, 'localtime') as local_time, alert_type, message, severity, data_json 
@@ -1498,31 +3028,10 @@ def get_alerts_history():
 def get_current_weather():
     """Lấy thông tin thời tiết hiện tại"""
     try:
-        # Lấy từ database
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''SELECT temperature, humidity, wind_speed, cloud_cover, 
-                            weather_code, sunrise, sunset, is_day, timestamp 
-                     FROM weather_data 
-                     ORDER BY timestamp DESC LIMIT 1''')
-        row = c.fetchone()
-        conn.close()
-        
-        if row:
-            weather_data = {
-                'temperature': row[0],
-                'humidity': row[1],
-                'wind_speed': row[2],
-                'cloud_cover': row[3],
-                'weather_code': row[4],
-                'sunrise': row[5],
-                'sunset': row[6],
-                'is_day': row[7] == 1,
-                'last_update': row[8],
-                'description': get_weather_code_description(row[4]),
-                'icon': get_weather_icon(row[4], row[7] == 1),
-                'source': 'database'
-            }
+        # Lấy từ bản chụp (dữ liệu đã lưu gần nhất)
+        snapshot = weather_snapshot
+        if snapshot:
+            weather_data = snapshot['current']
         else:
             # Lấy từ API
             weather_data = get_weather_data_openmeteo()
@@ -1552,42 +3061,10 @@ def get_current_weather():
 @permission_required('view_weather')
 def get_weather_forecast():
     """Lấy dự báo thời tiết 24h"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''SELECT forecast_json FROM weather_data 
-                     ORDER BY timestamp DESC LIMIT 1''')
-        row = c.fetchone()
-        conn.close()
-        
-        if row and row[0]:
-            forecast_data = json.loads(row[0])
-            
-            # Format dữ liệu
-            formatted_forecast = []
-            times = forecast_data.get('times', [])
-            temps = forecast_data.get('temperatures', [])
-            humids = forecast_data.get('humidities', [])
-            clouds = forecast_data.get('clouds', [])
-            winds = forecast_data.get('winds', [])
-            
-            for i in range(min(12, len(times))):
-                if i < len(times):
-                    time_str = times[i]
-                    hour = time_str[11:16] if 'T' in time_str else time_str
-                    
-                    formatted_forecast.append({
-                        'time': hour,
-                        'temperature': temps[i] if i < len(temps) else 0,
-                        'humidity': humids[i] if i < len(humids) else 0,
-                        'cloud_cover': clouds[i] if i < len(clouds) else 0,
-                        'wind_speed': winds[i] if i < len(winds) else 0
-                    })
-            
-            return jsonify({'forecast': formatted_forecast})
-        
-    except Exception as e:
-        print(f"❌ Forecast error: {e}")
+    # Dự báo đã format sẵn trong bản chụp
+    snapshot = weather_snapshot
+    if snapshot:
+        return jsonify({'forecast': snapshot['forecast']})
     
     # Fallback
     return jsonify({
@@ -1605,7 +3082,7 @@ def get_weather_forecast():
 def update_weather():
     """Cập nhật thủ công dữ liệu thời tiết"""
     try:
-        weather_data = get_weather_data_openmeteo()
+        weather_data = get_weather_data_openmeteo(force=True)
         
         # Log activity
         log_user_activity(
@@ -1629,10 +3106,11 @@ def update_weather():
 @app.route('/api/alerts/count')
 @login_required
 @permission_required('view_alerts')
+@cached_response('alerts_count', lambda: ['alerts'])
 def get_alerts_count():
     """Lấy số lượng cảnh báo theo loại"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         
         # Tổng số cảnh báo
@@ -1689,7 +3167,7 @@ def get_alerts_count():
 def clear_all_alerts():
     """Xóa tất cả lịch sử cảnh báo"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         c = conn.cursor()
         
         # Đếm số lượng cảnh báo trước khi xóa
@@ -1700,6 +3178,7 @@ def clear_all_alerts():
         c.execute('DELETE FROM alerts_log')
         
         conn.commit()
+        response_cache.invalidate('alerts')
         
         # Đếm số lượng sau khi xóa
         c.execute('SELECT COUNT(*) FROM alerts_log')
@@ -1746,7 +3225,10 @@ def control_pico():
         command = data.get('command')
         
         if command:
-            command_queue.append(data)
+            try:
+                dispatch_command(data)
+            except ValueError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 400
             
             # Log activity
             log_user_activity(
@@ -1788,15 +3270,15 @@ def handle_connect():
             'permissions': USER_ROLES.get(session.get('role', 'guest'), USER_ROLES['guest'])['permissions']
         })
     
-    socketio.emit('sensor_update', system_state['sensors'])
-    socketio.emit('status_update', {
-        'pico_online': system_state['pico_online'],
-        'last_update': system_state['last_pico_update']
-    })
+    # Client tham gia room của tracker đang xem (?device=), mặc định xem mọi tracker
+    device_id = request.args.get('device') or None
+    join_room(device_room(device_id))
+    emit_room_state(device_id)
     
-    # Gửi thông tin thời tiết
-    current_weather = get_current_weather()
-    socketio.emit('weather_update', current_weather.json)
+    # Gửi thông tin thời tiết cho client vừa kết nối (từ bản chụp, không truy vấn database)
+    snapshot = weather_snapshot
+    if snapshot:
+        emit('weather_update', snapshot['current'])
 
 @socketio.on('control_command')
 def handle_control_command(data):
@@ -1806,20 +3288,26 @@ def handle_control_command(data):
         socketio.emit('error', {'message': 'Chưa đăng nhập!'})
         return
     
-    user_role = session.get('role', 'guest')
-    if 'control_pico' not in USER_ROLES.get(user_role, USER_ROLES['guest'])['permissions']:
+    if 'control_pico' not in role_permissions(session.get('role', 'guest')):
         socketio.emit('error', {'message': 'Không có quyền điều khiển!'})
         return
     
     print(f"🎮 Web control from {session.get('username')}: {data}")
-    command_queue.append(data)
+    try:
+        device_id = resolve_command_target(data)
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    dispatch_command(data)
     
+    state = device_states.get(device_id, system_state)
     if data.get('command') == 'SET_MODE':
-        system_state['sensors']['mode'] = data.get('mode', 'AUTO')
+        state['sensors']['mode'] = data.get('mode', 'AUTO')
     elif data.get('command') == 'SET_ENERGY_MODE':
-        system_state['sensors']['energy_saving'] = data.get('energy_saving', False)
+        state['sensors']['energy_saving'] = data.get('energy_saving', False)
     
-    socketio.emit('sensor_update', system_state['sensors'])
+    for room in (device_room(device_id), ALL_DEVICES_ROOM):
+        live_broadcaster.update(room, state['sensors'])
     
     # Log activity
     log_user_activity(
@@ -1831,95 +3319,142 @@ def handle_control_command(data):
         request.user_agent.string
     )
 
+@socketio.on('subscribe_device')
+def handle_subscribe_device(data):
+    """Dashboard chọn tracker cần xem (device_id rỗng = mọi tracker)"""
+    device_id = (data or {}).get('device_id') or None
+    for room in rooms():
+        if room.startswith('device:'):
+            leave_room(room)
+    join_room(device_room(device_id))
+    emit_room_state(device_id)
+
+def emit_room_state(device_id):
+    """Gửi trạng thái của room vừa vào cho client (tracker chưa có dữ liệu: trạng thái rỗng,
+    không lấy trạng thái gộp của mọi tracker)"""
+    if device_id:
+        state = device_states.get(device_id) or empty_device_state(device_id)
+    else:
+        state = system_state
+    emit('sensor_update', room_frame(device_id, state))
+    emit('status_update', {
+        'device_id': device_id,
+        'pico_online': state['pico_online'],
+        'last_update': state['last_pico_update']
+    })
+
 # ================== SCHEDULED TASKS ==================
-def scheduled_tasks():
-    """Các task chạy định kỳ"""
-    last_daily_report_sent = None
+def mark_offline_devices():
+    """Đánh dấu offline các tracker không gửi dữ liệu quá LIVE_OFFLINE_SECONDS giây"""
+    now = time.time()
+    for device_id, state in list(device_states.items()):
+        if state['pico_online'] and now - state['sensors']['timestamp'] > LIVE_OFFLINE_SECONDS:
+            state['pico_online'] = False
+            live_broadcaster.update(device_room(device_id), status={
+                'device_id': device_id,
+                'pico_online': False,
+                'last_update': state['last_pico_update']
+            })
+            print(f"⚠️  PICO {device_id} offline - no data received")
     
-    while True:
-        try:
-            now = datetime.now()
-            
-            # 1. Gửi báo cáo hàng ngày lúc 18:00
-            if now.hour == 18 and now.minute == 0:
-                if last_daily_report_sent != now.date():
-                    send_daily_slack_report()
-                    last_daily_report_sent = now.date()
-                    time.sleep(60)  # Chờ 1 phút để không gửi nhiều lần
-            
-            # 2. Cập nhật thời tiết
-            weather_data = get_weather_data_openmeteo()
-            
-            # Tạo dữ liệu thời tiết để gửi qua socket
-            try:
-                # Lấy dữ liệu thời tiết từ database hoặc API
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                c.execute('''SELECT temperature, humidity, wind_speed, cloud_cover, 
-                                    weather_code, sunrise, sunset, is_day 
-                             FROM weather_data 
-                             ORDER BY timestamp DESC LIMIT 1''')
-                row = c.fetchone()
-                conn.close()
-                
-                if row:
-                    current_weather = {
-                        'temperature': row[0],
-                        'humidity': row[1],
-                        'wind_speed': row[2],
-                        'cloud_cover': row[3],
-                        'weather_code': row[4],
-                        'sunrise': row[5],
-                        'sunset': row[6],
-                        'is_day': row[7] == 1,
-                        'description': get_weather_code_description(row[4]),
-                        'icon': get_weather_icon(row[4], row[7] == 1),
-                        'source': 'database'
-                    }
-                else:
-                    current_weather = {
-                        'temperature': weather_data['temperature'],
-                        'humidity': weather_data['humidity'],
-                        'wind_speed': weather_data['wind_speed'],
-                        'cloud_cover': weather_data['cloud_cover'],
-                        'description': get_weather_code_description(weather_data.get('weather_code', 0)),
-                        'icon': get_weather_icon(weather_data.get('weather_code', 0), weather_data.get('is_day', True)),
-                        'source': 'api'
-                    }
-                
-                # Gửi qua socket
-                socketio.emit('weather_update', current_weather)
-                
-            except Exception as weather_error:
-                print(f"⚠️  Weather socket error: {weather_error}")
-                # Gửi dữ liệu fallback
-                socketio.emit('weather_update', {
-                    'temperature': 28.5,
-                    'humidity': 75,
-                    'wind_speed': 2.5,
-                    'cloud_cover': 40,
-                    'description': 'Dữ liệu tạm thời',
-                    'icon': '🌤️',
-                    'source': 'fallback'
-                })
-            
-            # 3. Kiểm tra cảnh báo
-            check_alerts()
-            
-            # 4. Kiểm tra PICO online
-            if (system_state['pico_online'] and 
-                time.time() - system_state['sensors']['timestamp'] > 30):
-                system_state['pico_online'] = False
-                socketio.emit('status_update', {
-                    'pico_online': False,
-                    'last_update': system_state['last_pico_update']
-                })
-                print("⚠️  PICO offline - no data received")
-                
-        except Exception as e:
-            print(f"❌ Scheduled task error: {e}")
+    if system_state['pico_online'] and now - system_state['sensors']['timestamp'] > LIVE_OFFLINE_SECONDS:
+        system_state['pico_online'] = False
+        live_broadcaster.update(ALL_DEVICES_ROOM, status={
+            'device_id': None,
+            'pico_online': False,
+            'last_update': system_state['last_pico_update']
+        })
+
+scheduler = Scheduler(SCHEDULER_CONFIG['workers'], get_db)
+
+def broadcast_weather(weather_data=None):
+    """Gửi thời tiết mới nhất (bản chụp, rồi tới dữ liệu API vừa lấy) qua socket"""
+    try:
+        snapshot = weather_snapshot
+        if snapshot:
+            current_weather = snapshot['current']
+        elif weather_data:
+            current_weather = {
+                'temperature': weather_data['temperature'],
+                'humidity': weather_data['humidity'],
+                'wind_speed': weather_data['wind_speed'],
+                'cloud_cover': weather_data['cloud_cover'],
+                'description': get_weather_code_description(weather_data.get('weather_code', 0)),
+                'icon': get_weather_icon(weather_data.get('weather_code', 0), weather_data.get('is_day', True)),
+                'source': 'api'
+            }
+        else:
+            return
+        
+        # Gửi qua socket
+        socketio.emit('weather_update', current_weather)
         
-        time.sleep(ALERT_CONFIG['check_interval'])
+    except Exception as weather_error:
+        print(f"⚠️  Weather socket error: {weather_error}")
+        # Gửi dữ liệu fallback
+        socketio.emit('weather_update', {
+            'temperature': 28.5,
+            'humidity': 75,
+            'wind_speed': 2.5,
+            'cloud_cover': 40,
+            'description': 'Dữ liệu tạm thời',
+            'icon': '🌤️',
+            'source': 'fallback'
+        })
+
+def refresh_weather():
+    """Cập nhật thời tiết từ Open-Meteo (mỗi WEATHER_CONFIG['update_interval'] giây)"""
+    broadcast_weather(get_weather_data_openmeteo(force=True))
+
+def archive_and_prune():
+    """Xuất ngày đã đóng ra archive rồi dọn dữ liệu cũ"""
+    if ARCHIVE_CONFIG['enabled']:
+        archive_closed_days()
+    apply_retention()
+
+def start_scheduler():
+    """Đăng ký các task định kỳ và chạy scheduler"""
+    scheduler.daily('daily_report', SCHEDULER_CONFIG['daily_report_at'], send_daily_slack_report,
+                    catch_up=SCHEDULER_CONFIG['daily_report_catch_up'])
+    scheduler.every('weather_refresh', WEATHER_CONFIG['update_interval'], refresh_weather)
+    scheduler.every('weather_broadcast', SCHEDULER_CONFIG['weather_broadcast_interval'], broadcast_weather,
+                    delay=SCHEDULER_CONFIG['weather_broadcast_interval'])
+    # Cảnh báo offline do alert_engine hẹn giờ, task này chỉ cập nhật trạng thái dashboard
+    scheduler.every('device_status', SCHEDULER_CONFIG['status_interval'], mark_offline_devices)
+    if RETENTION_CONFIG['enabled']:
+        scheduler.every('retention', RETENTION_CONFIG['interval'], archive_and_prune)
+    scheduler.start()
+
+def start_services(link=True):
+    """Chạy các thread nền: ghi database, device link, Slack, socket, cảnh báo, scheduler"""
+    sensor_writer.start()
+    audit_writer.start()
+    if link and LINK_CONFIG['enabled']:
+        device_link.start()
+    slack_notifier.start()
+    live_broadcaster.start()
+    watch_known_devices()
+    alert_engine.start()
+    start_scheduler()
+
+def print_banner():
+    """In thông tin khởi động"""
+    print("🚀 Solar Tracker Server starting...")
+    print("🔐 Role-Based Access Control ENABLED")
+    print("📊 User Roles:")
+    for role_name, role_info in USER_ROLES.items():
+        print(f"   - {role_name}: Level {role_info['level']}")
+    print("👤 Default Users:")
+    print("   - admin / admin123 (Quản trị viên)")
+    print("   - operator / operator123 (Vận hành viên)")
+    print("   - viewer / viewer123 (Người xem)")
+    print("   - guest / guest123 (Khách)")
+    print("🌤️  Weather API: Open-Meteo (Free)")
+    print("📊 Báo cáo Slack: #social (18:00 hàng ngày)")
+    print("🚨 Cảnh báo Slack: #cảnh-báo (tự động)")
+    print(f"🌐 Dashboard: http://localhost:{SERVER_CONFIG['port']}")
+    print(f"🔐 Login: http://localhost:{SERVER_CONFIG['port']}/login")
+    print("🔋 Alerts: Pin <20%, Không công suất, PICO offline, Hiệu suất thấp")
 
 # ================== ERROR HANDLERS ==================
 @app.errorhandler(403)
@@ -1945,25 +3480,41 @@ def internal_error(error):
 # ================== MAIN ==================
 if __name__ == '__main__':
     init_db()
-    # Start scheduled tasks
-    task_thread = threading.Thread(target=scheduled_tasks, daemon=True)
-    task_thread.start()
-    
-    print("🚀 Solar Tracker Server starting...")
-    print("🔐 Role-Based Access Control ENABLED")
-    print("📊 User Roles:")
-    for role_name, role_info in USER_ROLES.items():
-        print(f"   - {role_name}: Level {role_info['level']}")
-    print("👤 Default Users:")
-    print("   - admin / admin123 (Quản trị viên)")
-    print("   - operator / operator123 (Vận hành viên)")
-    print("   - viewer / viewer123 (Người xem)")
-    print("   - guest / guest123 (Khách)")
-    print("🌤️  Weather API: Open-Meteo (Free)")
-    print("📊 Báo cáo Slack: #social (18:00 hàng ngày)")
-    print("🚨 Cảnh báo Slack: #cảnh-báo (tự động)")
-    print("🌐 Dashboard: http://localhost:5000")
-    print("🔐 Login: http://localhost:5000/login")
-    print("🔋 Alerts: Pin <20%, Không công suất, PICO offline, Hiệu suất thấp")
-    
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)  
\ No newline at end of file
+    if '--rebuild-rollups' in sys.argv:
+        conn = get_db()
+        try:
+            print(f"✅ Rebuilt rollups: {rebuild_rollups(conn)} buckets")
+        finally:
+            conn.close()
+        sys.exit(0)
+    if '--rebuild-energy' in sys.argv:
+        conn = get_db()
+        try:
+            print(f"✅ Rebuilt daily energy: {energy_accumulator.rebuild(conn)} days")
+        finally:
+            conn.close()
+        sys.exit(0)
+    if '--vacuum' in sys.argv:
+        # Chuyển database cũ sang auto_vacuum = INCREMENTAL (VACUUM toàn bộ, chạy khi server dừng)
+        conn = get_db()
+        try:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            print(f"✅ auto_vacuum = {conn.execute('PRAGMA auto_vacuum').fetchone()[0]}")
+        finally:
+            conn.close()
+        sys.exit(0)
+    if '--retention-report' in sys.argv:
+        print(json.dumps(apply_retention(dry_run=True), indent=2))
+        sys.exit(0)
+    if '--check-query-plans' in sys.argv:
+        # Kiểm tra hồi quy: exit 1 nếu truy vấn nóng nào quét toàn bảng
+        sys.exit(0 if check_query_plans() else 1)
+    # debug=True chạy reloader: chỉ process con (WERKZEUG_RUN_MAIN) mới phục vụ. Process
+    # cha không chạy dịch vụ nền nào: nó không nhận packet (cảnh báo offline giả), không
+    # được gửi lại outbox Slack hay chạy retention / lưu trữ song song với process con
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_services()
+    print_banner()
+    
+    socketio.run(app, host=SERVER_CONFIG['host'], port=SERVER_CONFIG['port'], debug=True)
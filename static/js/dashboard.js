@@ -1,4 +1,6 @@
-const socket = io();
+// Tracker đang xem (?device=<id>), rỗng = mọi tracker
+const currentDevice = new URLSearchParams(window.location.search).get('device') || '';
+const socket = currentDevice ? io({ query: { device: currentDevice } }) : io();
 let lastPicoUpdate = 0;
 let historyChart = null;
 let dailyChart = null;
@@ -6,6 +8,12 @@ let currentChartType = 'power';
 let currentDailyChartType = 'power';
 let alertsBadgeInterval = null;
 
+// Thêm bộ lọc tracker vào URL API
+function withDevice(url) {
+    if (!currentDevice) return url;
+    return url + (url.includes('?') ? '&' : '?') + 'device=' + encodeURIComponent(currentDevice);
+}
+
 // Tab management
 function openTab(tabName, evt) {
     const e = evt || window.event;
@@ -113,8 +121,24 @@ function updateWeather(evt) {
 }
 
 // ================== SENSOR DATA FUNCTIONS ==================
+// Trạng thái đầy đủ khi vào room, sau đó server chỉ gửi các trường thay đổi
+let sensorState = {};
+
 socket.on('sensor_update', function(data) {
-    updateDashboard(data);
+    sensorState = Object.assign({}, data);
+    updateDashboard(sensorState);
+    lastPicoUpdate = Date.now();
+    updatePicoStatus(true);
+});
+
+// Lệnh bị server từ chối (vd. chưa chọn tracker khi có nhiều tracker)
+socket.on('error', function(data) {
+    showToast(data.message, 'error');
+});
+
+socket.on('sensor_delta', function(delta) {
+    Object.assign(sensorState, delta);
+    updateDashboard(sensorState);
     lastPicoUpdate = Date.now();
     updatePicoStatus(true);
 });
@@ -216,6 +240,7 @@ function sendControl(command, value) {
 
     if (command === 'SET_MODE') data.mode = value;
     if (command === 'SET_ENERGY_MODE') data.energy_saving = value;
+    if (currentDevice) data.device_id = currentDevice;
 
     socket.emit('control_command', data);
     console.log('Sent control:', data);
@@ -231,11 +256,14 @@ function sendManualAngles() {
     const azimuth = document.getElementById('azimuthSlider').value;
     const elevation = document.getElementById('elevationSlider').value;
 
-    socket.emit('control_command', {
+    const data = {
         command: 'SET_ANGLE',
         azimuth: parseFloat(azimuth),
         elevation: parseFloat(elevation)
-    });
+    };
+    if (currentDevice) data.device_id = currentDevice;
+
+    socket.emit('control_command', data);
 }
 
 // ================== SLACK TEST FUNCTIONS ==================
@@ -521,7 +549,7 @@ function changeDailyChartType(type, evt) {
 function loadHistoryChart() {
     const timeRange = document.getElementById('timeRange').value;
 
-    fetch(`/api/history-chart?hours=${timeRange}`)
+    fetch(withDevice(`/api/history-chart?hours=${timeRange}`))
         .then(response => response.json())
         .then(data => {
             if (data.labels.length === 0) {
@@ -671,7 +699,7 @@ function getChartConfig(type, data) {
 
 // Daily chart functions
 function loadAvailableDates() {
-    fetch('/api/available-dates')
+    fetch(withDevice('/api/available-dates'))
         .then(response => response.json())
         .then(dates => {
             const dateSelect = document.getElementById('dateSelect');
@@ -717,7 +745,7 @@ function loadDailyChart() {
         return;
     }
 
-    fetch(`/api/daily-chart?date=${selectedDate}`)
+    fetch(withDevice(`/api/daily-chart?date=${selectedDate}`))
         .then(response => response.json())
         .then(data => {
             if (data.labels.length === 0) {
@@ -883,7 +911,7 @@ function showNoDataMessage(canvasId, message) {
 }
 
 function loadReports() {
-    fetch('/api/report/daily')
+    fetch(withDevice('/api/report/daily'))
         .then(response => response.json())
         .then(data => {
             let html = `
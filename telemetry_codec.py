@@ -0,0 +1,164 @@
+"""Mã hóa nhị phân gói telemetry giữa PICO và server
+
+Dùng chung cho MicroPython (nạp cùng main.py) và server Flask.
+
+Layout v2, little-endian, kích thước cố định PACKET_SIZE byte:
+
+    magic                  2s  b'ST'
+    version                B   2
+    flags                  B   bit0 = AUTO, bit1 = energy_saving
+    device_id              16s ASCII, tối đa 16 byte, đệm b'\\0' (không có ở v1)
+    azimuth                H   độ x 10
+    elevation              H   độ x 10
+    voltage                H   V x 100
+    current                H   A x 100
+    power                  H   W x 100
+    efficiency             H   % x 10
+    light_intensity        H   giá trị ADC
+    light_sensors          4H  giá trị ADC
+    battery_voltage        H   V x 100
+    battery_soc            B   %
+    remaining_capacity_ah  H   Ah x 100
+    battery_capacity_ah    H   Ah x 100
+    timestamp              I   giây (đồng hồ của PICO)
+
+Bộ giải mã vẫn nhận gói v1 (không có device_id) từ firmware cũ.
+"""
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+MAGIC = b'ST'
+VERSION = 2
+FLAG_AUTO = 0x01
+FLAG_ENERGY_SAVING = 0x02
+
+DEVICE_ID_SIZE = 16
+
+PACKET_FORMAT = '<2sBB16sHHHHHHH4HHBHHI'
+PACKET_SIZE = struct.calcsize(PACKET_FORMAT)
+
+PACKET_FORMAT_V1 = '<2sBBHHHHHHH4HHBHHI'
+PACKET_SIZE_V1 = struct.calcsize(PACKET_FORMAT_V1)
+
+def _q(value, scale, limit=0xFFFF):
+    """Lượng tử hóa số thực thành số nguyên không dấu, ValueError nếu ngoài [0, limit]
+
+    Không kẹp giá trị: dòng âm hay điện áp vượt thang đo phải đến server nguyên vẹn
+    (gửi JSON) thay vì thành 0 / giá trị trần không phân biệt được với số đo thật.
+    """
+    v = value * scale + 0.5
+    if not 0 <= v < limit + 1:
+        raise ValueError('value %r out of range' % (value,))
+    return int(v)
+
+def pack_telemetry(buf, azimuth, elevation, voltage, current, power, efficiency,
+                   light_intensity, light_sensors, battery_voltage, battery_soc,
+                   remaining_capacity_ah, battery_capacity_ah, auto_mode,
+                   energy_saving, timestamp, device_id=b''):
+    """Ghi packet vào buffer có sẵn (bytearray PACKET_SIZE) để tránh cấp phát
+
+    ValueError nếu device_id dài hơn DEVICE_ID_SIZE byte hoặc có giá trị không biểu
+    diễn được trong layout (âm, vượt trần); buffer không bị ghi dở.
+    """
+    if len(device_id) > DEVICE_ID_SIZE:
+        raise ValueError('device_id longer than %d bytes' % DEVICE_ID_SIZE)
+    flags = (FLAG_AUTO if auto_mode else 0) | (FLAG_ENERGY_SAVING if energy_saving else 0)
+    struct.pack_into(
+        PACKET_FORMAT, buf, 0,
+        MAGIC, VERSION, flags, device_id,
+        _q(azimuth, 10), _q(elevation, 10),
+        _q(voltage, 100), _q(current, 100), _q(power, 100),
+        _q(efficiency, 10), _q(light_intensity, 1),
+        _q(light_sensors[0], 1), _q(light_sensors[1], 1),
+        _q(light_sensors[2], 1), _q(light_sensors[3], 1),
+        _q(battery_voltage, 100), _q(battery_soc, 1, 0xFF),
+        _q(remaining_capacity_ah, 100), _q(battery_capacity_ah, 100),
+        _q(timestamp, 1, 0xFFFFFFFF)
+    )
+    return buf
+
+def encode_packet(packet):
+    """Mã hóa packet dạng dict (cùng khóa với JSON) thành bytes"""
+    buf = bytearray(PACKET_SIZE)
+    pack_telemetry(
+        buf,
+        packet['azimuth'], packet['elevation'],
+        packet['voltage'], packet['current'], packet['power'],
+        packet.get('efficiency', 0), packet.get('light_intensity', 0),
+        packet.get('light_sensors') or (0, 0, 0, 0),
+        packet.get('battery_voltage', 0), packet.get('battery_soc', 0),
+        packet.get('remaining_capacity_ah', 0), packet.get('battery_capacity_ah', 3.0),
+        packet['mode'] == 'AUTO', packet['energy_saving'],
+        packet.get('timestamp', 0),
+        packet.get('device_id', '').encode()
+    )
+    return bytes(buf)
+
+def decode_packet(data):
+    """Giải mã bytes thành dict cùng dạng với packet JSON, ValueError nếu sai định dạng"""
+    if len(data) < 4 or data[:2] != MAGIC:
+        raise ValueError('bad magic')
+    version = data[2]
+    if version == VERSION:
+        if len(data) != PACKET_SIZE:
+            raise ValueError('bad length %d' % len(data))
+        (_, _, flags, device_id, az, el, voltage, current, power, efficiency,
+         light_intensity, l0, l1, l2, l3, battery_voltage, battery_soc, remaining,
+         capacity, timestamp) = struct.unpack(PACKET_FORMAT, data)
+        device_id = device_id.rstrip(b'\0').decode()
+    elif version == 1:
+        if len(data) != PACKET_SIZE_V1:
+            raise ValueError('bad length %d' % len(data))
+        (_, _, flags, az, el, voltage, current, power, efficiency, light_intensity,
+         l0, l1, l2, l3, battery_voltage, battery_soc, remaining, capacity,
+         timestamp) = struct.unpack(PACKET_FORMAT_V1, data)
+        device_id = ''
+    else:
+        raise ValueError('unsupported version %d' % version)
+    packet = {
+        'azimuth': az / 10,
+        'elevation': el / 10,
+        'voltage': voltage / 100,
+        'current': current / 100,
+        'power': power / 100,
+        'efficiency': efficiency / 10,
+        'light_intensity': light_intensity,
+        'light_sensors': [l0, l1, l2, l3],
+        'battery_voltage': battery_voltage / 100,
+        'battery_soc': battery_soc,
+        'remaining_capacity_ah': remaining / 100,
+        'battery_capacity_ah': capacity / 100,
+        'mode': 'AUTO' if flags & FLAG_AUTO else 'MANUAL',
+        'energy_saving': bool(flags & FLAG_ENERGY_SAVING),
+        'timestamp': timestamp
+    }
+    if device_id:
+        packet['device_id'] = device_id
+    return packet
+
+# ================== FRAMING (kết nối TCP lâu dài) ==================
+# Mỗi frame: type (B) + độ dài payload (H) + payload
+FRAME_TELEMETRY = 0x01   # PICO -> server, payload là packet ở trên
+FRAME_COMMAND = 0x02     # server -> PICO, payload là lệnh JSON (utf-8)
+FRAME_PING = 0x03        # giữ kết nối, payload rỗng
+
+FRAME_HEADER_FORMAT = '<BH'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+
+def encode_frame(frame_type, payload=b''):
+    return struct.pack(FRAME_HEADER_FORMAT, frame_type, len(payload)) + bytes(payload)
+
+def parse_frames(buf):
+    """Tách các frame hoàn chỉnh từ buffer, trả về (list (type, payload), phần còn dư)"""
+    frames = []
+    offset = 0
+    while len(buf) - offset >= FRAME_HEADER_SIZE:
+        frame_type, length = struct.unpack_from(FRAME_HEADER_FORMAT, buf, offset)
+        end = offset + FRAME_HEADER_SIZE + length
+        if end > len(buf):
+            break
+        frames.append((frame_type, bytes(buf[offset + FRAME_HEADER_SIZE:end])))
+        offset = end
+    return frames, buf[offset:]
@@ -0,0 +1,161 @@
+"""Client Open-Meteo dùng chung: cache TTL, single-flight, stale-while-revalidate, backoff
+
+- Payload JSON được cache trong bộ nhớ ttl giây (WEATHER_CONFIG['update_interval'])
+- Nhiều caller cùng lúc khi cache trống / bị ép làm mới chỉ tạo một request,
+  các caller còn lại chờ kết quả của request đó
+- Cache hết hạn nhưng chưa quá max_stale: trả ngay dữ liệu cũ, làm mới ở thread nền
+- Request lỗi: không gọi lại upstream trước khi hết thời gian backoff (lũy thừa + jitter)
+- Gửi If-None-Match / If-Modified-Since nếu upstream trả ETag / Last-Modified
+- on_update(payload) được gọi mỗi khi có payload mới (không gọi với 304)
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+
+class WeatherClient:
+    """Lấy và cache một endpoint JSON (Open-Meteo forecast) với params cố định"""
+
+    def __init__(self, url, params, ttl=1800, max_stale=6 * 3600, timeout=10, backoff_base=30.0,
+                 backoff_max=1800.0, on_update=None, session=None):
+        self.url = url
+        self.params = params
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_update = on_update
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session = session
+        self._payload = None
+        self._fetched_at = None           # monotonic lần nhận payload / 304 gần nhất
+        self._validators = {}             # header điều kiện cho request sau
+        self._failures = 0
+        self._retry_at = 0.0
+        self._flight = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'stale_served': 0,
+            'requests': 0,
+            'not_modified': 0,
+            'shared_waits': 0,            # caller chờ request đang chạy thay vì gửi request mới
+            'errors': 0,
+            'backoff_skips': 0,
+            'last_error': None,
+            'last_fetch_ms': None
+        }
+
+    def get(self, force=False):
+        """Payload mới nhất (có thể là dữ liệu cũ nếu upstream lỗi), None nếu chưa từng lấy được"""
+        with self._lock:
+            payload, fetched_at = self._payload, self._fetched_at
+            if payload is not None and not force:
+                age = time.monotonic() - fetched_at
+                if age < self.ttl:
+                    self.stats['hits'] += 1
+                    return payload
+                if age < self.ttl + self.max_stale:
+                    self.stats['stale_served'] += 1
+                    stale = True
+                else:
+                    stale = False
+            else:
+                stale = False
+        if stale:
+            self._start_flight(background=True)
+            return payload
+        self._start_flight(background=False)
+        with self._lock:
+            return self._payload
+
+    def _start_flight(self, background):
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+            elif not background:
+                self.stats['shared_waits'] += 1
+        if not leader:
+            if not background:
+                flight.done.wait(self.timeout + 1)
+            return
+        if background:
+            threading.Thread(target=self._run_flight, args=(flight,), name='weather-fetch', daemon=True).start()
+        else:
+            self._run_flight(flight)
+
+    def _run_flight(self, flight):
+        try:
+            self._fetch()
+        except Exception as e:
+            print(f"❌ Weather fetch error: {e}")
+        finally:
+            with self._lock:
+                self._flight = None
+            flight.done.set()
+
+    def _fetch(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._retry_at:
+                self.stats['backoff_skips'] += 1
+                return
+            headers = dict(self._validators)
+            self.stats['requests'] += 1
+        started = time.perf_counter()
+        error = None
+        try:
+            response = self.session.get(self.url, params=self.params, headers=headers, timeout=self.timeout)
+            if response.status_code == 304:
+                payload = None
+            elif response.status_code == 200:
+                payload = response.json()
+            else:
+                error = f'HTTP {response.status_code}'
+        except (requests.RequestException, ValueError) as e:
+            error = f'{type(e).__name__}: {e}'
+
+        with self._lock:
+            self.stats['last_fetch_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            if error is not None:
+                self._failures += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (self._failures - 1))
+                self._retry_at = time.monotonic() + delay * random.uniform(0.5, 1.5)
+                self.stats['errors'] += 1
+                self.stats['last_error'] = error
+                print(f"❌ Weather API error: {error}")
+                return
+            self._failures = 0
+            self._retry_at = 0.0
+            self._fetched_at = time.monotonic()
+            if payload is None:
+                self.stats['not_modified'] += 1
+                return
+            self._payload = payload
+            self._validators = {}
+            if response.headers.get('ETag'):
+                self._validators['If-None-Match'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                self._validators['If-Modified-Since'] = response.headers['Last-Modified']
+        if self.on_update is not None:
+            self.on_update(payload)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['cached'] = self._payload is not None
+            stats['age_s'] = round(time.monotonic() - self._fetched_at, 1) if self._fetched_at is not None else None
+            stats['backoff_s'] = round(max(0.0, self._retry_at - time.monotonic()), 1)
+            return stats